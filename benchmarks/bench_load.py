@@ -0,0 +1,311 @@
+"""
+Load Test
+
+Replays a mix of list, filtered list, get, create, update, delete and
+in-stock calls against a running inventory service at fixed open-loop
+arrival rates, and reports the throughput and the p50/p95/p99/p99.9 latency
+of every route at each rate.
+
+Requests are sent when the plan says, whether or not earlier ones have
+returned, the way independent clients arrive. Latency is measured from that
+scheduled time, so time spent queued (in the server, or waiting for a free
+client thread) counts against it, and an overloaded server shows up as
+growing latency instead of as a quietly lower request rate.
+
+The plan of arrivals is generated from --seed, and can be written out with
+--save-plan and replayed exactly with --plan. The table is seeded through the
+bulk endpoint with items from tests/factories.py.
+
+Start the service, e.g. with gunicorn and one of its profiles, then run:
+    python -m benchmarks.bench_load --url http://localhost:8080 \\
+        --rates 50 100 200 400 --duration 30 --items 10000
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import factory.random
+import requests
+from requests.adapters import HTTPAdapter
+
+from service.models import Condition
+from tests.factories import InventoryItemFactory
+
+API = "/api/inventories"
+
+# The share of each call in the traffic, overridden with --mix
+DEFAULT_MIX = {
+    "list": 25,
+    "filtered_list": 20,
+    "get": 35,
+    "create": 8,
+    "update": 6,
+    "delete": 2,
+    "in_stock": 4,
+}
+
+PERCENTILES = (50, 95, 99, 99.9)
+SEED_CHUNK_SIZE = 1000
+
+
+class Items:
+    """The ids of the items that exist, shared by the client threads"""
+
+    def __init__(self, ids: List[int]):
+        self._lock = threading.Lock()
+        self._ids = list(ids)
+
+    def pick(self, rand: random.Random, remove: bool = False) -> Optional[int]:
+        """Returns a random id, and forgets it if it is about to be deleted"""
+        with self._lock:
+            if not self._ids:
+                return None
+            index = rand.randrange(len(self._ids))
+            if remove:
+                self._ids[index] = self._ids[-1]
+                return self._ids.pop()
+            return self._ids[index]
+
+    def add(self, inventory_item_id: int):
+        """Remembers an item that was just created"""
+        with self._lock:
+            self._ids.append(inventory_item_id)
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parses a mix such as "get=70,list=30" into weights by operation"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def make_plan(
+    mix: Dict[str, float], rates: List[float], duration: float, seed: int
+) -> List[Dict]:
+    """Returns the arrivals of every rate: when each call is due and what it is
+
+    Arrivals follow a Poisson process, the gaps between them are drawn from
+    an exponential distribution with the mean 1 / rate.
+    """
+    rand = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    plan = []
+    for rate in rates:
+        at = rand.expovariate(rate)
+        while at < duration:
+            operation = rand.choices(names, weights)[0]
+            plan.append({"rate": rate, "at": round(at, 6), "operation": operation})
+            at += rand.expovariate(rate)
+    return plan
+
+
+def seed_items(session: requests.Session, url: str, count: int) -> List[int]:
+    """Creates count items through the bulk endpoint and returns their ids
+
+    With a count of 0 the ids of the items already stored are returned.
+    """
+    if count == 0:
+        response = session.get(url + API, headers={"Accept": "application/x-ndjson"})
+        response.raise_for_status()
+        return [json.loads(line)["id"] for line in response.iter_lines() if line]
+    ids = []
+    for start in range(0, count, SEED_CHUNK_SIZE):
+        batch = [
+            item.serialize()
+            for item in InventoryItemFactory.build_batch(
+                min(SEED_CHUNK_SIZE, count - start)
+            )
+        ]
+        response = session.post(url + API + "/bulk", json=batch)
+        response.raise_for_status()
+        ids.extend(result["item"]["id"] for result in response.json()["results"])
+    return ids
+
+
+def build_request(
+    operation: str, items: Items, rand: random.Random, payloads: List[Dict]
+) -> Tuple[str, str, Optional[Dict]]:
+    """Returns the method, path and body of one call of the mix"""
+    if operation == "list":
+        return "GET", API + "?limit=100", None
+    if operation == "filtered_list":
+        condition = rand.choice(list(Condition)).name
+        return "GET", f"{API}?condition={condition}&in_stock=true&limit=100", None
+    if operation == "create":
+        return "POST", API, rand.choice(payloads)
+    inventory_item_id = items.pick(rand, remove=operation == "delete")
+    path = f"{API}/{inventory_item_id}"
+    if operation == "get":
+        return "GET", path, None
+    if operation == "update":
+        return "PUT", path, rand.choice(payloads)
+    if operation == "delete":
+        return "DELETE", path, None
+    return "PUT", path + "/in-stock", None
+
+
+class Recorder:
+    """Collects the latency and outcome of every call, by operation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, operation: str, latency: float, ok: bool):
+        """Adds one finished call"""
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(latency)
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+
+def run_rate(
+    url: str,
+    arrivals: List[Dict],
+    items: Items,
+    payloads: List[Dict],
+    rand: random.Random,
+    connections: int,
+) -> Tuple[Recorder, float]:
+    """Sends the arrivals of one rate on time and waits for every answer
+
+    :return: the recorded calls and the seconds until the last one finished
+    """
+    recorder = Recorder()
+    local = threading.local()
+
+    def session() -> requests.Session:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.mount("http://", HTTPAdapter(pool_maxsize=1))
+        return local.session
+
+    def call(operation, method, path, body, due):
+        try:
+            response = session().request(method, url + path, json=body, timeout=60)
+            ok = response.status_code < 500
+            if ok and operation == "create" and response.status_code == 201:
+                items.add(response.json()["id"])
+        except requests.RequestException:
+            ok = False
+        recorder.record(operation, time.perf_counter() - due, ok)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        for arrival in arrivals:
+            due = start + arrival["at"]
+            method, path, body = build_request(
+                arrival["operation"], items, rand, payloads
+            )
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(call, arrival["operation"], method, path, body, due)
+    return recorder, time.perf_counter() - start
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Returns the nearest-rank percentile of sorted values"""
+    index = max(0, min(len(ordered) - 1, int(len(ordered) * pct / 100 + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> Dict[str, Dict]:
+    """Returns the throughput, errors and latency percentiles of every operation"""
+    summary = {}
+    everything = []
+    for operation, latencies in sorted(recorder.latencies.items()):
+        everything.extend(latencies)
+        summary[operation] = describe(
+            sorted(latencies), recorder.errors.get(operation, 0), elapsed
+        )
+    summary["all"] = describe(
+        sorted(everything), sum(recorder.errors.values()), elapsed
+    )
+    return summary
+
+
+def describe(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    """Summarizes the sorted latencies of one operation in milliseconds"""
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1),
+    }
+    for pct in PERCENTILES:
+        result[f"p{pct:g}_ms"] = round(percentile(latencies, pct) * 1000, 2)
+    return result
+
+
+def print_summary(rate: float, summary: Dict[str, Dict]):
+    """Prints one line per operation"""
+    print(f"\nArrival rate {rate:g}/s")
+    header = "".join(f"{'p' + format(pct, 'g'):>10}" for pct in PERCENTILES)
+    print(f"{'operation':<15}{'requests':>9}{'errors':>8}{'req/s':>9}{header}")
+    for operation, result in summary.items():
+        latencies = "".join(f"{result[f'p{pct:g}_ms']:>10.1f}" for pct in PERCENTILES)
+        print(
+            f"{operation:<15}{result['requests']:>9}{result['errors']:>8}"
+            f"{result['throughput']:>9.1f}{latencies}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Seeds the service and replays the traffic at every arrival rate"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--duration", type=float, default=30, help="seconds per rate")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--items", type=int, default=1000, help="items to seed")
+    parser.add_argument("--connections", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--plan", help="replay the arrivals in this file")
+    parser.add_argument("--save-plan", help="write the arrivals to this file")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.plan:
+        with open(args.plan) as lines:
+            plan = [json.loads(line) for line in lines]
+    else:
+        plan = make_plan(args.mix, args.rates, args.duration, args.seed)
+    if args.save_plan:
+        with open(args.save_plan, "w") as output:
+            output.writelines(json.dumps(arrival) + "\n" for arrival in plan)
+
+    rand = random.Random(args.seed)
+    factory.random.reseed_random(args.seed)
+    payloads = [item.serialize() for item in InventoryItemFactory.build_batch(500)]
+    print(f"Seeding {args.items} inventory items...")
+    items = Items(seed_items(requests.Session(), args.url, args.items))
+
+    results = {}
+    rates = list(dict.fromkeys(arrival["rate"] for arrival in plan))
+    for rate in rates:
+        arrivals = [arrival for arrival in plan if arrival["rate"] == rate]
+        recorder, elapsed = run_rate(
+            args.url, arrivals, items, payloads, rand, args.connections
+        )
+        results[format(rate, "g")] = summarize(recorder, elapsed)
+        print_summary(rate, results[format(rate, "g")])
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+        print(f"\nWrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Benchmark Suite
+
+Times the model and route operations of the service on tables of different
+sizes, seeded with tests/factories.py:
+    - serialize() and deserialize() of one item
+    - find(), and find_by_sku/condition/in_stock() read a page at a time
+    - search_rows() by the first half of a SKU and, fuzzy, by its middle
+    - create(), deserialize() and update(), and delete() of one item, each
+      in its own commit
+    - GET /api/inventories, plain and filtered, through the Flask test client
+
+The item and list caches are turned off, so every call reaches the database.
+Each operation reports its median, 95th percentile and best time. The results
+are written as JSON, and compared with the JSON of an earlier run if one is
+given; an operation whose median got slower by more than the tolerance is a
+regression and makes the suite exit with status 1.
+
+Run it from the root of the repository against a scratch database, it drops
+and re-creates the inventory tables:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_suite \\
+        --output bench.json --baseline baseline.json
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+import sqlalchemy
+
+from service import create_app
+from service.models import Condition, InventoryItem, db
+from tests.factories import InventoryItemFactory
+
+CHUNK_SIZE = 10000
+
+# Every call goes to the database, and the request logs stay quiet
+app = create_app(
+    {
+        "ITEM_CACHE_SIZE": 0,
+        "LIST_CACHE_SIZE": 0,
+        "LOG_PAYLOAD_SAMPLE_RATE": 0,
+        "SLOW_QUERY_SECONDS": 0,
+    }
+)
+app.app_context().push()
+
+
+def seed(rows: int):
+    """Re-creates the table with rows items built by InventoryItemFactory"""
+    db.drop_all()
+    db.create_all()
+    for start in range(0, rows, CHUNK_SIZE):
+        batch = InventoryItemFactory.build_batch(min(CHUNK_SIZE, rows - start))
+        InventoryItem.create_many(batch, CHUNK_SIZE)
+        print(f"  {start + len(batch)} of {rows} items", end="\r", flush=True)
+    print()
+    db.session.remove()
+
+
+def measure(
+    call: Callable, inputs: Iterable, setup: Optional[Callable] = None
+) -> Dict[str, float]:
+    """Times call once for each input and summarizes the times in microseconds
+
+    :param setup: run before each call without being timed
+    """
+    times = []
+    for value in inputs:
+        if setup:
+            setup()
+        start = time.perf_counter()
+        call(value)
+        times.append((time.perf_counter() - start) * 1e6)
+    times.sort()
+    median = statistics.median(times)
+    return {
+        "calls": len(times),
+        "median_us": round(median, 2),
+        "p95_us": round(times[min(len(times) - 1, int(len(times) * 0.95))], 2),
+        "best_us": round(times[0], 2),
+        "ops_per_sec": round(1e6 / median, 1),
+    }
+
+
+def run_size(rows: int, calls: int, page: int) -> Dict[str, Dict]:
+    """Seeds rows items and times every operation calls times"""
+    print(f"Seeding {rows} inventory items...")
+    seed(rows)
+    rand = random.Random(42)
+    max_id = db.session.query(db.func.max(InventoryItem.id)).scalar()
+    ids = [rand.randint(1, max_id) for _ in range(calls)]
+    skus = [
+        sku
+        for (sku,) in db.session.query(InventoryItem.sku).filter(
+            InventoryItem.id.in_(ids)
+        )
+    ]
+    skus = [rand.choice(skus) for _ in range(calls)]
+    built = InventoryItemFactory.build_batch(calls)
+    payloads = [item.serialize() for item in built]
+    client = app.test_client()
+
+    results = {}
+
+    def record(name: str, call: Callable, inputs: Iterable, setup=None):
+        results[name] = measure(call, inputs, setup)
+        print(f"  {name:<32}{results[name]['median_us']:>12.1f} us")
+
+    # Reads start from an empty session, so find() cannot answer from the
+    # session's identity map without a query
+    forget = db.session.expunge_all
+    record("serialize", lambda item: item.serialize(), built)
+    record("deserialize", lambda data: InventoryItem().deserialize(data), payloads)
+    record("find", InventoryItem.find, ids, forget)
+    record(
+        "find_by_sku",
+        lambda sku: InventoryItem.find_by_sku(sku).limit(page).all(),
+        skus,
+        forget,
+    )
+    record(
+        "search_rows prefix",
+        lambda sku: InventoryItem.search_rows(sku[: len(sku) // 2 + 1]),
+        skus,
+        forget,
+    )
+    record(
+        "search_rows fuzzy",
+        lambda sku: InventoryItem.search_rows(sku[1:-1] or sku, "fuzzy"),
+        skus,
+        forget,
+    )
+    record(
+        "find_by_condition",
+        lambda condition: InventoryItem.find_by_condition(condition).limit(page).all(),
+        [rand.choice(list(Condition)) for _ in range(calls)],
+        forget,
+    )
+    record(
+        "find_by_in_stock",
+        lambda in_stock: InventoryItem.find_by_in_stock(in_stock).limit(page).all(),
+        [rand.choice([True, False]) for _ in range(calls)],
+        forget,
+    )
+
+    # The created items are updated and deleted again, so every size keeps
+    # the number of rows it was seeded with
+    created = InventoryItemFactory.build_batch(calls)
+    record("create", lambda item: item.create(), created)
+    record(
+        "update",
+        lambda change: change[0].deserialize(change[1]).update(),
+        zip(created, payloads),
+    )
+    record("delete", lambda item: item.delete(), created)
+
+    record(
+        "GET /api/inventories",
+        lambda _: client.get("/api/inventories", query_string={"limit": page}),
+        range(calls),
+    )
+    record(
+        "GET /api/inventories?condition",
+        lambda condition: client.get(
+            "/api/inventories", query_string={"condition": condition, "limit": page}
+        ),
+        [rand.choice(list(Condition)).name for _ in range(calls)],
+    )
+    db.session.remove()
+    return results
+
+
+def environment() -> Dict[str, str]:
+    """Describes where the results were measured"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "machine": platform.platform(),
+        "database": db.engine.dialect.name,
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Prints the change of every median from baseline and returns regressions"""
+    if baseline["environment"]["database"] != results["environment"]["database"]:
+        print(
+            "Warning: the baseline was measured on {}, not {}".format(
+                baseline["environment"]["database"],
+                results["environment"]["database"],
+            )
+        )
+    regressions = []
+    print(
+        f"{'rows':>9}  {'operation':<32}{'baseline us':>13}{'now us':>11}{'change':>9}"
+    )
+    for rows, operations in results["results"].items():
+        for name, now in operations.items():
+            before = baseline["results"].get(rows, {}).get(name)
+            if before is None:
+                continue
+            change = now["median_us"] / before["median_us"] - 1
+            flag = ""
+            if change > tolerance:
+                regressions.append(f"{name} at {rows} rows")
+                flag = "  <- regression"
+            print(
+                f"{rows:>9}  {name:<32}{before['median_us']:>13.1f}"
+                f"{now['median_us']:>11.1f}{change:>+9.0%}{flag}"
+            )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Runs the suite, writes the results and compares them with a baseline"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--calls", type=int, default=200, help="calls per operation")
+    parser.add_argument("--page", type=int, default=100, help="rows per read")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="slowdown of a median that counts as a regression, 0.25 is 25%%",
+    )
+    args = parser.parse_args(argv)
+
+    results = {
+        "environment": environment(),
+        "settings": {"calls": args.calls, "page": args.page},
+        "results": {
+            str(rows): run_size(rows, args.calls, args.page) for rows in args.sizes
+        },
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+        print(f"Wrote {args.output}")
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as baseline:
+        regressions = compare(results, json.load(baseline), args.tolerance)
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,14 +8,77 @@ DATABASE_URI = os.getenv(
 )
 
 # override if we are running in Cloud Foundry
-if 'VCAP_SERVICES' in os.environ:
-    vcap = json.loads(os.environ['VCAP_SERVICES'])
-    DATABASE_URI = vcap['user-provided'][0]['credentials']['url']
+if "VCAP_SERVICES" in os.environ:
+    vcap = json.loads(os.environ["VCAP_SERVICES"])
+    DATABASE_URI = vcap["user-provided"][0]["credentials"]["url"]
 
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker process: pool_size connections are kept
+# open and up to max_overflow more are opened under load. A checkout waits
+# at most DB_POOL_TIMEOUT seconds, connections are replaced after
+# DB_POOL_RECYCLE seconds, and pre-ping tests each one before it is used so
+# a database restart does not surface as errors. SQLite ignores the sizes.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# /health/ready reports 503 once this share of the pool is checked out
+DB_POOL_READY_SATURATION = float(os.getenv("DB_POOL_READY_SATURATION", "1.0"))
+
+# Largest page a client may ask for with ?limit=
+MAX_PAGE_LIMIT = int(os.getenv("MAX_PAGE_LIMIT", "1000"))
+
+# Rows fetched per round trip when streaming the inventory list
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Rows written per INSERT statement by the bulk create endpoint
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Rows removed per DELETE statement by the filtered delete endpoint
+BULK_DELETE_CHUNK_SIZE = int(os.getenv("BULK_DELETE_CHUNK_SIZE", "10000"))
+
+# Serialized items cached per worker process by InventoryItem.find_serialized()
+ITEM_CACHE_SIZE = int(os.getenv("ITEM_CACHE_SIZE", "10000"))
+ITEM_CACHE_TTL = float(os.getenv("ITEM_CACHE_TTL", "30"))
+
+# Encoded list responses cached per worker process until the table changes,
+# at most LIST_CACHE_MAX_BYTES of them; larger responses are not cached.
+# Writes by other workers are seen once the TTL runs out, when an entry is
+# checked against the count of writes kept in the database.
+LIST_CACHE_SIZE = int(os.getenv("LIST_CACHE_SIZE", "256"))
+LIST_CACHE_TTL = float(os.getenv("LIST_CACHE_TTL", "5"))
+LIST_CACHE_MAX_BYTES = int(os.getenv("LIST_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Seconds between the folds of the inventory summary's pending changes that
+# each worker runs after a request; 0 leaves them to flask summary-fold
+SUMMARY_FOLD_SECONDS = float(os.getenv("SUMMARY_FOLD_SECONDS", "60"))
+
+# Log records queued for the background logging thread of each worker.
+# Records are dropped rather than wait when it is full; 0 logs synchronously.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Share of requests that log their full payload, between 0 and 1, with
+# per-route overrides keyed by "<METHOD> <rule>", e.g.
+# LOG_PAYLOAD_SAMPLE_RATES='{"PUT /api/inventories/<inventory_item_id>": 1}'
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+LOG_PAYLOAD_SAMPLE_RATES = json.loads(os.getenv("LOG_PAYLOAD_SAMPLE_RATES", "{}"))
+
+# Record request, database and list metrics and serve them on /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Report the statements each request ran in X-DB-Queries and Server-Timing
+QUERY_STATS_HEADERS = os.getenv("QUERY_STATS_HEADERS", "true").lower() == "true"
+
+# Log statements that take at least this many seconds, 0 to log none, and
+# with SLOW_QUERY_EXPLAIN the plan the database chose for them
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.5"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() == "true"
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
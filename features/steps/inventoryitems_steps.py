@@ -32,14 +32,9 @@ from compare import expect
 def step_impl(context):
     """Delete all Pets and load new ones"""
     headers = {"Content-Type": "application/json"}
-    # list all of the pets and delete them one by one
-    context.resp = requests.get(context.base_url + "/api/inventories")
+    # delete all of the pets with one request
+    context.resp = requests.delete(context.base_url + "/api/inventories?all=true")
     expect(context.resp.status_code).to_equal(200)
-    for item in context.resp.json():
-        context.resp = requests.delete(
-            context.base_url + "/api/inventories/" + str(item["id"]), headers=headers
-        )
-        expect(context.resp.status_code).to_equal(204)
 
     # load the database with new pets
     create_url = context.base_url + "/api/inventories"
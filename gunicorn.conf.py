@@ -1,6 +1,133 @@
+"""
+Gunicorn configuration for the inventory service
+
+The server profile is chosen with GUNICORN_PROFILE:
+
+single   - one sync worker, one request at a time (the default, for development)
+sync     - 2 x cores + 1 sync worker processes
+threaded - one gthread worker process per core, GUNICORN_THREADS threads each
+
+The production profiles preload the app and recycle workers after
+GUNICORN_MAX_REQUESTS requests, plus up to GUNICORN_MAX_REQUESTS_JITTER more
+so they do not all restart at once. WEB_CONCURRENCY overrides the number of
+worker processes of any profile. Every worker has its own connection pool, so
+keep WEB_CONCURRENCY x (DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW) below the
+connection limit of the database.
+"""
+import multiprocessing
 import os
+import shutil
+import sys
+import tempfile
+
+PROFILES = {
+    "single": {
+        "workers": 1,
+        "worker_class": "sync",
+        "threads": 1,
+        "preload_app": False,
+        "max_requests": 0,
+        "max_requests_jitter": 0,
+    },
+    "sync": {
+        "workers": multiprocessing.cpu_count() * 2 + 1,
+        "worker_class": "sync",
+        "threads": 1,
+        "preload_app": True,
+        "max_requests": 1000,
+        "max_requests_jitter": 100,
+    },
+    "threaded": {
+        "workers": multiprocessing.cpu_count(),
+        "worker_class": "gthread",
+        "threads": 4,
+        "preload_app": True,
+        "max_requests": 1000,
+        "max_requests_jitter": 100,
+    },
+}
+
+profile_name = os.getenv("GUNICORN_PROFILE", "single")
+if profile_name not in PROFILES:
+    raise RuntimeError(
+        "Unknown GUNICORN_PROFILE {}, use one of {}".format(
+            profile_name, ", ".join(PROFILES)
+        )
+    )
+profile = PROFILES[profile_name]
 
 PORT = os.getenv("PORT", "8080")
 bind = "0.0.0.0:" + PORT
-workers = 1
-log_level = "info"
\ No newline at end of file
+log_level = "info"
+
+workers = int(os.getenv("WEB_CONCURRENCY", profile["workers"]))
+threads = int(os.getenv("GUNICORN_THREADS", profile["threads"]))
+worker_class = "gthread" if threads > 1 else profile["worker_class"]
+preload_app = (
+    os.getenv("GUNICORN_PRELOAD", str(profile["preload_app"])).lower() == "true"
+)
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", profile["max_requests"]))
+max_requests_jitter = int(
+    os.getenv("GUNICORN_MAX_REQUESTS_JITTER", profile["max_requests_jitter"])
+)
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+# Workers write their metrics to files in this directory so /metrics can add
+# up every worker. It must be set before the app imports prometheus_client.
+metrics_dir = None
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    metrics_dir = tempfile.mkdtemp(prefix="inventory-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+
+def dispose_db():
+    """Drops the pooled connections of the app, if it has been loaded
+
+    Only a preloaded app exists in the master process. Its connections must
+    not be shared with the workers forked from it.
+    """
+    if "service.models" in sys.modules:
+        sys.modules["service.models"].dispose_db()
+
+
+def on_starting(server):
+    """Logs the profile the server was started with"""
+    server.log.info(
+        "Profile %s: %d %s workers x %d threads, preload %s",
+        profile_name,
+        workers,
+        worker_class,
+        threads,
+        preload_app,
+    )
+
+
+def on_exit(server):  # pylint: disable=unused-argument
+    """Removes the metric files of this server, if it made the directory"""
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Stops counting the in-flight requests of a worker that exited
+
+    Its counters and histograms are folded into the archive files, so the
+    directory does not grow by a few files for every recycled worker.
+    """
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import multiprocess
+
+    from service import metrics
+
+    multiprocess.mark_process_dead(worker.pid)
+    metrics.archive_dead_worker(worker.pid)
+
+
+def pre_fork(server, worker):  # pylint: disable=unused-argument
+    """Closes the master's connections before a worker is forked from it"""
+    dispose_db()
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Gives the new worker an empty connection pool of its own"""
+    dispose_db()
@@ -3,25 +3,67 @@
 """
 Package for the application models and service routes for the inventory service
 
-This module creates and configures the Flask app and sets up the logging
-and SQL database
+create_app() creates and configures the Flask app and sets up the logging
+and SQL database. Importing the package does neither: nothing connects to
+the database until the first request or command needs it, and the schema is
+created and upgraded by ``flask db-upgrade``, not by every worker that boots.
 """
-import sys
 import logging
+from typing import Dict, Optional
+
 from flask import Flask
 
-# Create Flask application
-app = Flask(__name__)
-app.config.from_object("config")
+from service import log_utils
+
+
+def create_app(overrides: Optional[Dict] = None) -> Flask:
+    """Creates the Flask app of the inventory service
+
+    :param overrides: settings that replace the ones in config.py, e.g. the
+        database of a test suite
+    """
+    app = Flask(__name__)
+    app.config.from_object("config")
+    app.config.update(overrides or {})
+
+    # Import the models, routes and commands only once an app is created,
+    # so importing the models alone does not load flask_restx and Swagger
+    # pylint: disable=import-outside-toplevel
+    from service import commands, metrics, models, query_stats, routes
+
+    configure_logging(app)
+    models.init_db(app)
+    query_stats.init_app(app)
+    metrics.init_app(app)
+    app.register_blueprint(routes.blueprint)
+    routes.api.init_app(app)
+    check_sample_rates(app, routes.payload_sampler)
+    app.cli.add_command(commands.db_upgrade)
+    app.cli.add_command(commands.summary_rebuild)
+    app.cli.add_command(commands.summary_fold)
+
+    app.logger.info("Service inititalized!")
+    return app
 
-# Import the models, routes and error handlers after the Flask app is created
-from service import models, routes
 
-# Set up logging for production
-print("Configuring logging for {}...".format(__name__))
-app.logger.propagate = False
+def check_sample_rates(app: Flask, sampler: log_utils.PayloadSampler):
+    """Warns about payload sample rates keyed by a route the app does not have"""
+    routes = [
+        "{} {}".format(method, rule)
+        for rule in app.url_map.iter_rules()
+        for method in rule.methods
+    ]
+    for route in sampler.unknown_routes(routes):
+        app.logger.warning(
+            "LOG_PAYLOAD_SAMPLE_RATES has %r, which matches no route", route
+        )
+
+
+def configure_logging(app: Flask):
+    """Sends the app's log records to gunicorn's handlers in one format"""
+    print("Configuring logging for {}...".format(__name__))
+    app.logger.propagate = False
 
-if __name__ != "__main__":
     gunicorn_logger = logging.getLogger("gunicorn.error")
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
@@ -33,17 +75,11 @@ if __name__ != "__main__":
     for handler in app.logger.handlers:
         handler.setFormatter(formatter)
 
-    app.logger.info("Logging handler established")
-
-app.logger.info(70 * "*")
-app.logger.info("  I N V E N T O R Y   S E R V I C E  ".center(70, "*"))
-app.logger.info(70 * "*")
-
-try:
-    models.init_db(app)  # make our sqlalchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+    # Format and write the records on a background thread of each worker
+    if app.config["LOG_QUEUE_SIZE"] > 0:
+        log_utils.install_queue_handler(app.logger, app.config["LOG_QUEUE_SIZE"])
 
-app.logger.info("Service inititalized!")
+    app.logger.info("Logging handler established")
+    app.logger.info(70 * "*")
+    app.logger.info("  I N V E N T O R Y   S E R V I C E  ".center(70, "*"))
+    app.logger.info(70 * "*")
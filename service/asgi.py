@@ -0,0 +1,343 @@
+"""
+Async Inventory Service
+
+An ASGI variant of the /api/inventories routes, for many concurrent slow
+clients per process. Requests wait for the database without holding a
+thread: queries are the same SQLAlchemy Core statements InventoryItem builds
+for the Flask routes, run on asyncpg (Postgres) or aiosqlite (SQLite)
+through the databases library. Payloads are validated and items serialized
+with the InventoryItem rules, so both variants return the same JSON.
+
+Run it with uvicorn, or under gunicorn with the uvicorn worker:
+    uvicorn service.asgi:app --port 8081
+    gunicorn -k uvicorn.workers.UvicornWorker service.asgi:app
+
+Paths:
+------
+GET /api/inventories - Returns a page of the Inventory items that match the filters
+POST /api/inventories - Creates an Inventory item
+GET /api/inventories/{id} - Retrieve an inventory item based on id
+PUT /api/inventories/{id} - updates an inventory item record in the database
+DELETE /api/inventories/{id} - deletes an inventory item record in the database
+PUT /api/inventories/{id}/in-stock - update the in_stock attribute of an item to True
+"""
+import json
+import logging
+from http import HTTPStatus
+from typing import Dict
+from urllib.parse import urlencode
+
+from databases import Database
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import config
+from service import status
+from service.encoders import RowEncoder
+from service.models import Condition, DataValidationError, InventoryItem
+
+logger = logging.getLogger("uvicorn.error")
+
+JSON = "application/json"
+
+TRUE_VALUES = ("true", "1")
+FALSE_VALUES = ("false", "0")
+
+row_encoder = RowEncoder(InventoryItem.ROW_FIELDS)
+
+
+def database_url(uri: str) -> str:
+    """Returns the URL the databases library expects for a SQLAlchemy URI"""
+    if uri.startswith("postgres://"):
+        return "postgresql://" + uri[len("postgres://") :]
+    return uri
+
+
+def connect_options(uri: str, settings: Dict) -> Dict:
+    """Sizes the asyncpg pool from the same settings as the Flask pool"""
+    if uri.startswith("sqlite"):
+        return {}
+    return {
+        "min_size": settings["DB_POOL_SIZE"],
+        "max_size": settings["DB_POOL_SIZE"] + settings["DB_POOL_MAX_OVERFLOW"],
+    }
+
+
+database = Database(
+    database_url(config.SQLALCHEMY_DATABASE_URI),
+    **connect_options(config.SQLALCHEMY_DATABASE_URI, vars(config)),
+)
+table = InventoryItem.__table__
+
+
+######################################################################
+# U T I L I T Y   F U N C T I O N S
+######################################################################
+def item_etag(data: Dict) -> str:
+    """Returns the same strong ETag for an item as the Flask routes"""
+    return '"{}-{}"'.format(data["id"], data["version"])
+
+
+def item_response(data: Dict, code: int = status.HTTP_200_OK, headers=None):
+    """Returns an item as JSON with its ETag, if its version is in it"""
+    response = JSONResponse(data, status_code=code, headers=headers)
+    if "version" in data:
+        response.headers["ETag"] = item_etag(data)
+    return response
+
+
+def error_response(code: int, error: str, message: str):
+    """Returns an error body shaped like the ones of the Flask routes"""
+    logger.error(message)
+    return JSONResponse(
+        {"status_code": code, "error": error, "message": message}, status_code=code
+    )
+
+
+def parse_boolean(name: str, value: str) -> bool:
+    """Converts a query string flag the way flask_restx inputs.boolean does"""
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise DataValidationError(f"Invalid {name}: {value}")
+
+
+def parse_int(name: str, value: str) -> int:
+    """Converts a query string number"""
+    try:
+        return int(value)
+    except ValueError as error:
+        raise DataValidationError(f"Invalid {name}: {value}") from error
+
+
+def parse_fields(request: Request):
+    """Returns the names of the fields a request asked for, see projection()"""
+    fields = request.query_params.get("fields")
+    return InventoryItem.projection(fields.split(",") if fields else None)
+
+
+def parse_list_args(request: Request) -> Dict:
+    """Returns the filters, limit, cursor and fields of a list request"""
+    params = request.query_params
+    args = {
+        "sku": params.get("sku"),
+        "condition": params.get("condition"),
+        "cursor": params.get("cursor"),
+        "fields": parse_fields(request),
+        "in_stock": None,
+        "limit": None,
+    }
+    if "in_stock" in params:
+        args["in_stock"] = parse_boolean("in_stock", params["in_stock"])
+    for column in InventoryItem.RANGE_FILTERS:
+        for name in (f"{column}_min", f"{column}_max"):
+            args[name] = parse_int(name, params[name]) if name in params else None
+    if "limit" in params:
+        limit = parse_int("limit", params["limit"])
+        if limit < 1:
+            raise DataValidationError(f"Invalid limit: {limit}")
+        args["limit"] = min(limit, config.MAX_PAGE_LIMIT)
+    return args
+
+
+async def read_payload(request: Request) -> Dict:
+    """Returns the JSON body of a request, or aborts with 415 or 400"""
+    if request.headers.get("Content-Type") != JSON:
+        raise HTTPException(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type must be {JSON}"
+        )
+    try:
+        return json.loads(await request.body())
+    except ValueError as error:
+        raise DataValidationError(
+            "Invalid inventory item: body is not valid JSON"
+        ) from error
+
+
+def serialize_fields(data: Dict) -> Dict:
+    """Serializes an item whose fields came from InventoryItem.parse_fields()"""
+    data = {name: data[name] for name in InventoryItem.ROW_FIELDS}
+    if isinstance(data["condition"], Condition):
+        data["condition"] = data["condition"].name
+    return data
+
+
+async def find_item(inventory_item_id: int, for_update: bool = False, fields=None):
+    """Returns the serialized item with inventory_item_id, or aborts with 404
+
+    :param fields: the names of the fields to read, see projection()
+    """
+    fields = InventoryItem.projection(fields)
+    statement = InventoryItem.rows_statement(fields=fields).where(
+        table.c.id == inventory_item_id
+    )
+    if for_update:
+        statement = statement.with_for_update()
+    row = await database.fetch_one(statement)
+    if row is None:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND,
+            f"Inventory item with id '{inventory_item_id}' was not found.",
+        )
+    return dict(zip(fields, row.values()))
+
+
+def check_if_match(request: Request, data: Dict):
+    """Aborts with 412 if If-Match was sent and does not match the item"""
+    if_match = request.headers.get("If-Match")
+    if if_match and if_match != "*" and item_etag(data) not in if_match:
+        raise HTTPException(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "Inventory item {} has changed, fetch it and retry".format(data["id"]),
+        )
+
+
+async def update_item(request: Request, inventory_item_id: int, fields: Dict):
+    """Writes fields to an item and bumps its version, like the ORM does"""
+    async with database.transaction():
+        current = await find_item(inventory_item_id, for_update=True)
+        check_if_match(request, current)
+        version = current["version"] + 1
+        await database.execute(
+            table.update()
+            .where(table.c.id == inventory_item_id)
+            .values(**fields, version=version)
+        )
+    return serialize_fields({**current, **fields, "version": version})
+
+
+######################################################################
+# E N D P O I N T S
+######################################################################
+async def list_inventory_items(request: Request):
+    """Returns a page of the InventoryItems that match the query string filters"""
+    args = parse_list_args(request)
+    logger.info("Request for inventory list %s", args)
+    rows = await database.fetch_all(
+        InventoryItem.page_statement(
+            args, args["limit"], args["cursor"], args["fields"]
+        )
+    )
+    rows, next_cursor = InventoryItem.split_page(
+        [tuple(row.values()) for row in rows], args["limit"]
+    )
+    headers = {}
+    if next_cursor:
+        query_args = dict(request.query_params, cursor=next_cursor)
+        next_url = "{}?{}".format(str(request.url).split("?")[0], urlencode(query_args))
+        headers = {"Link": f'<{next_url}>; rel="next"', "X-Next-Cursor": next_cursor}
+    return Response(
+        row_encoder.project(args["fields"]).encode_list(rows),
+        media_type=JSON,
+        headers=headers,
+    )
+
+
+async def create_inventory_item(request: Request):
+    """Creates an InventoryItem from the posted JSON"""
+    data = await read_payload(request)
+    fields = InventoryItem.parse_fields(data, InventoryItem.FIELD_TYPES)
+    statement = table.insert().values(**fields, version=1)
+    if database.url.dialect == "postgresql":
+        statement = statement.returning(table.c.id)
+    inventory_item_id = await database.execute(statement)
+    logger.info("Inventory item with ID [%s] created.", inventory_item_id)
+    location_url = str(
+        request.url_for("inventory_item", inventory_item_id=inventory_item_id)
+    )
+    return item_response(
+        serialize_fields({"id": inventory_item_id, **fields, "version": 1}),
+        status.HTTP_201_CREATED,
+        {"Location": location_url},
+    )
+
+
+async def get_inventory_item(request: Request):
+    """Returns the InventoryItem with the id in the path"""
+    inventory_item_id = request.path_params["inventory_item_id"]
+    data = await find_item(inventory_item_id, fields=parse_fields(request))
+    if "version" in data and request.headers.get("If-None-Match") == item_etag(data):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    return item_response(data)
+
+
+async def update_inventory_item(request: Request):
+    """Replaces the fields of the InventoryItem with the id in the path"""
+    inventory_item_id = request.path_params["inventory_item_id"]
+    data = await read_payload(request)
+    fields = InventoryItem.parse_fields(data, InventoryItem.FIELD_TYPES)
+    data = await update_item(request, inventory_item_id, fields)
+    logger.info("Inventory item with id [%s] was updated.", inventory_item_id)
+    return item_response(data)
+
+
+async def delete_inventory_item(request: Request):
+    """Deletes the InventoryItem with the id in the path, if it exists"""
+    inventory_item_id = request.path_params["inventory_item_id"]
+    await database.execute(table.delete().where(table.c.id == inventory_item_id))
+    logger.info("Inventory item with id [%s] was deleted", inventory_item_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def in_stock(request: Request):
+    """Marks the InventoryItem with the id in the path as in stock"""
+    inventory_item_id = request.path_params["inventory_item_id"]
+    data = await update_item(request, inventory_item_id, {"in_stock": True})
+    logger.info("Item with id [%s] is in-stock!!", inventory_item_id)
+    return item_response(data)
+
+
+async def data_validation_error(request: Request, error: DataValidationError):
+    """Handles Value Errors from bad data"""
+    return error_response(status.HTTP_400_BAD_REQUEST, "Bad Request", str(error))
+
+
+async def http_error(request: Request, error: HTTPException):
+    """Returns aborted requests in the same shape as the Flask routes"""
+    return error_response(
+        error.status_code, HTTPStatus(error.status_code).phrase, error.detail
+    )
+
+
+app = Starlette(
+    routes=[
+        Route(
+            "/api/inventories",
+            list_inventory_items,
+            methods=["GET"],
+            name="inventory_items",
+        ),
+        Route("/api/inventories", create_inventory_item, methods=["POST"]),
+        Route(
+            "/api/inventories/{inventory_item_id:int}",
+            get_inventory_item,
+            methods=["GET"],
+            name="inventory_item",
+        ),
+        Route(
+            "/api/inventories/{inventory_item_id:int}",
+            update_inventory_item,
+            methods=["PUT"],
+        ),
+        Route(
+            "/api/inventories/{inventory_item_id:int}",
+            delete_inventory_item,
+            methods=["DELETE"],
+        ),
+        Route(
+            "/api/inventories/{inventory_item_id:int}/in-stock",
+            in_stock,
+            methods=["PUT"],
+        ),
+    ],
+    exception_handlers={
+        DataValidationError: data_validation_error,
+        HTTPException: http_error,
+    },
+    on_startup=[database.connect],
+    on_shutdown=[database.disconnect],
+)
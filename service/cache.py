@@ -0,0 +1,147 @@
+"""
+In-process caches for the inventory service
+
+Classes
+-------
+LRUCache - A bounded, thread-safe cache whose entries also expire after a TTL
+GenerationCounter - A number that is bumped by every write to a table
+
+Each gunicorn worker has its own caches. A write only invalidates the cache
+of the worker that made it, so the TTL bounds how long another worker can
+serve a value that has since changed. An expired entry can instead be
+revalidated, e.g. against the database's count of writes, and kept.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """A least recently used cache with a maximum size and a time to live
+
+    The size is a number of entries and, if maxbytes is set, the total of
+    the sizes given to set() as well. A value larger than maxbytes on its
+    own is not cached at all.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, maxbytes: int = 0):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+    def configure(self, maxsize: int, ttl: float, maxbytes: int = 0):
+        """Changes the size and TTL of the cache and empties it"""
+        with self._lock:
+            self.maxsize = maxsize
+            self.maxbytes = maxbytes
+            self.ttl = ttl
+            self._entries.clear()
+            self.bytes = 0
+
+    def get(
+        self, key: Hashable, revalidate: Optional[Callable[[Any], bool]] = None
+    ) -> Optional[Any]:
+        """Returns the value cached for key, or None if it is missing or expired
+
+        :param revalidate: called with an expired value, outside the lock. If
+            it returns True the value is still good and gets a new TTL.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is None or revalidate is None:
+                self._remove(key)
+                self.misses += 1
+                return None
+        valid = revalidate(entry[1])
+        with self._lock:
+            # Another thread may have replaced the entry meanwhile
+            if self._entries.get(key) is entry:
+                if valid:
+                    self._entries[key] = (time.monotonic() + self.ttl,) + entry[1:]
+                    self._entries.move_to_end(key)
+                else:
+                    self._remove(key)
+            if not valid:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.revalidations += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, size: int = 0):
+        """Caches value for key, evicting the least recently used entries if full
+
+        :param size: the size of value in bytes, counted against maxbytes
+        """
+        if self.maxsize <= 0 or (self.maxbytes and size > self.maxbytes):
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self.bytes += size
+            while len(self._entries) > self.maxsize or (
+                self.maxbytes and self.bytes > self.maxbytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Removes the entry for key, if there is one"""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key: Hashable):
+        """Removes the entry for key, if there is one. The lock must be held."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit, miss and eviction counters and the current size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "revalidations": self.revalidations,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "bytes": self.bytes,
+                "maxbytes": self.maxbytes,
+            }
+
+
+class GenerationCounter:
+    """A counter that every write to a table bumps
+
+    Cache entries keyed by the generation they were built in are never
+    served again once the generation moves on, so they need no invalidation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def bump(self) -> int:
+        """Moves on to the next generation and returns it"""
+        with self._lock:
+            self.value += 1
+            return self.value
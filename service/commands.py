@@ -0,0 +1,53 @@
+"""
+Flask CLI commands for the inventory service
+
+Commands
+--------
+flask db-upgrade - Creates missing tables, columns and indexes on a live database
+    and drops the indexes the models no longer define
+flask summary-rebuild - Recounts the inventory summary from the items
+flask summary-fold - Adds the pending changes to the inventory summary rows
+"""
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from service.models import InventorySummary, drop_unused_indexes, upgrade_db
+
+
+@click.command("db-upgrade")
+@with_appcontext
+@click.option(
+    "--blocking",
+    is_flag=True,
+    help="Build and drop Postgres indexes without CONCURRENTLY",
+)
+def db_upgrade(blocking):
+    """Creates missing tables, columns and indexes without locking writes"""
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    created = upgrade_db(app, concurrently=not blocking)
+    for name in created:
+        click.echo(f"Added {name}")
+    dropped = drop_unused_indexes(app, concurrently=not blocking)
+    for name in dropped:
+        click.echo(f"Dropped {name}")
+    click.echo(f"Database is up to date ({len(created) + len(dropped)} changes made)")
+
+
+@click.command("summary-rebuild")
+@with_appcontext
+def summary_rebuild():
+    """Recounts the inventory summary, e.g. after the items were edited by hand"""
+    InventorySummary.rebuild()
+    totals = InventorySummary.totals()["total"]
+    click.echo(
+        "Inventory summary rebuilt ({items} items, {units} units)".format(**totals)
+    )
+
+
+@click.command("summary-fold")
+@with_appcontext
+def summary_fold():
+    """Adds the changes the triggers recorded to the summary rows, e.g. from cron"""
+    InventorySummary.fold()
+    click.echo("Inventory summary folded")
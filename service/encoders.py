@@ -0,0 +1,97 @@
+"""
+JSON encoders for the ORM-free read path
+
+Classes
+-------
+RowEncoder - Encodes row tuples to JSON with a function compiled for the columns
+"""
+from itertools import groupby
+from json.encoder import encode_basestring_ascii
+from operator import itemgetter
+from typing import Dict, Iterable, Sequence
+
+
+class RowEncoder:
+    """Encodes plain row tuples as JSON objects without building dicts
+
+    The columns are known up front, so encode_row() is compiled once into a
+    single string format, e.g. ``'{"id":%s,"sku":%s}' % (row[0], quote(row[1]))``.
+    Columns must not be NULL.
+    """
+
+    def __init__(self, fields: Dict[str, type]):
+        """
+        :param fields: the name of each column in row order, and the type it
+            is encoded as: int, bool or str
+        """
+        self.fields = dict(fields)
+        self.encode_row = self._compile(self.fields)
+        self._projections = {}
+
+    def project(self, names: Sequence[str]) -> "RowEncoder":
+        """Returns the encoder of rows that hold only the named fields, in order
+
+        Each projection is compiled once and kept, so names should come from
+        a fixed set, e.g. checked against the fields, not straight from a
+        client.
+        """
+        names = tuple(names)
+        if names == tuple(self.fields):
+            return self
+        encoder = self._projections.get(names)
+        if encoder is None:
+            encoder = RowEncoder({name: self.fields[name] for name in names})
+            self._projections[names] = encoder
+        return encoder
+
+    @staticmethod
+    def _compile(fields: Dict[str, type]):
+        """Builds the function that encodes one row with these fields"""
+        parts = []
+        values = []
+        for index, (name, kind) in enumerate(fields.items()):
+            parts.append(encode_basestring_ascii(name) + ":%s")
+            if kind is bool:
+                values.append(f"_booleans[row[{index}]]")
+            elif kind is str:
+                values.append(f"_quote(row[{index}])")
+            else:
+                values.append(f"row[{index}]")
+        template = "{" + ",".join(parts) + "}"
+        source = "def encode_row(row):\n    return {!r} % ({},)\n".format(
+            template, ", ".join(values)
+        )
+        namespace = {
+            "_booleans": {True: "true", False: "false"},
+            "_quote": encode_basestring_ascii,
+        }
+        exec(
+            compile(source, "<RowEncoder {}>".format(",".join(fields)), "exec"),
+            namespace,
+        )
+        return namespace["encode_row"]
+
+    def encode_list(self, rows: Iterable[Sequence]) -> bytes:
+        """Encodes rows as a JSON array"""
+        return ("[" + ",".join(map(self.encode_row, rows)) + "]").encode("utf-8")
+
+    def encode_groups(self, rows: Iterable[Sequence], key: str) -> bytes:
+        """Encodes rows that lead with a group key as a JSON array of groups
+
+        Rows that follow each other with the same first column become one
+        ``{key: <first column>, "items": [<rest of each row>]}`` object, so
+        rows should be ordered by it. The first column must be a string, and
+        the fields of this encoder describe the columns after it.
+        """
+        groups = []
+        for group_key, group in groupby(rows, key=itemgetter(0)):
+            items = ",".join(self.encode_row(row[1:]) for row in group)
+            groups.append(
+                '{%s:%s,"items":[%s]}'
+                % (
+                    encode_basestring_ascii(key),
+                    encode_basestring_ascii(group_key),
+                    items,
+                )
+            )
+        return ("[" + ",".join(groups) + "]").encode("utf-8")
@@ -0,0 +1,130 @@
+"""
+Logging helpers that keep log formatting off the request thread
+
+Classes
+-------
+QueueLogHandler - Hands records to a background thread, dropping them when full
+PayloadSampler - Decides per route whether a verbose payload is logged
+
+Functions
+---------
+install_queue_handler - Moves the handlers of a logger behind a QueueLogHandler
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class QueueLogHandler(QueueHandler):
+    """A QueueHandler that never blocks the thread that logs
+
+    Records are put on a bounded queue and a QueueListener thread passes them
+    to the real handlers, which is where they are formatted and written. When
+    the queue is full the record is dropped and counted instead of waiting.
+
+    The listener is started by the first record a process logs, so a handler
+    created before gunicorn forks its workers still gets a thread in each one.
+    A forked process also gets its own queue: the one it inherited may hold
+    the parent's records, or a lock the parent held while it forked.
+    """
+
+    def __init__(self, handlers: List[logging.Handler], maxsize: int = 10000):
+        super().__init__(queue.Queue(maxsize))
+        self.handlers = list(handlers)
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord):
+        """Puts the record on the queue, or drops it if the queue is full"""
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Leaves the message unformatted so the listener thread renders it
+
+        The stock QueueHandler formats every record before queueing it, which
+        is the cost this handler exists to move off the request thread. The
+        arguments of a record must therefore not be changed after logging it.
+        """
+        return record
+
+    def start(self):
+        """Starts the listener thread for this process"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self.queue = queue.Queue(self.queue.maxsize)
+            self._listener = QueueListener(
+                self.queue, *self.handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Writes out the records still queued and stops the listener thread"""
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+def install_queue_handler(
+    logger: logging.Logger, maxsize: int = 10000
+) -> Optional[QueueLogHandler]:
+    """Replaces the handlers of logger with one QueueLogHandler in front of them
+
+    Returns the new handler, or None if logger had no handlers to move.
+    """
+    if not logger.handlers:
+        return None
+    handler = QueueLogHandler(logger.handlers, maxsize)
+    logger.handlers = [handler]
+    return handler
+
+
+class PayloadSampler:
+    """Decides which requests of a route log their full payload
+
+    Each route has a rate between 0 (never) and 1 (always); routes that are
+    not listed use the default rate.
+    """
+
+    def __init__(
+        self,
+        default: float = 1.0,
+        rates: Optional[Dict[str, float]] = None,
+        rand: Callable[[], float] = random.random,
+    ):
+        self.default = default
+        self.rates = dict(rates or {})
+        self._rand = rand
+
+    def configure(self, default: float, rates: Optional[Dict[str, float]] = None):
+        """Changes the default and per-route rates"""
+        self.default = default
+        self.rates = dict(rates or {})
+
+    def unknown_routes(self, routes: Iterable[str]) -> List[str]:
+        """Returns the routes with a rate that are not among routes"""
+        return sorted(set(self.rates) - set(routes))
+
+    def sample(self, route: str) -> bool:
+        """Returns True if this request of route should log its payload"""
+        rate = self.rates.get(route, self.default)
+        if rate >= 1:
+            return True
+        return rate > 0 and self._rand() < rate
@@ -0,0 +1,173 @@
+"""
+Prometheus metrics for the inventory service
+
+Functions
+---------
+init_app - Records the metrics of every request and serves them on /metrics
+archive_dead_worker - Folds the metric files of an exited worker into one
+
+Every request records its latency, request and response sizes, status, and
+the number and time of its database statements, labelled by the endpoint
+that handled it (e.g. inventory_item_resource) and its method. List calls
+also record how many rows they returned.
+
+Under gunicorn each worker writes its metrics to files in
+PROMETHEUS_MULTIPROC_DIR, which gunicorn.conf.py sets before any worker
+starts, and /metrics adds up the files of every worker. The variable must be
+set before prometheus_client is imported. The database numbers come from
+service.query_stats, which create_app() sets up first.
+
+Workers that gunicorn recycles leave their counter and histogram files
+behind, and /metrics would read every one of them on each scrape. The
+master calls archive_dead_worker() when a worker exits, which adds its
+files to one archive file per type and deletes them.
+"""
+import os
+import time
+
+from flask import Flask, Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+
+from service import query_stats
+
+LABELS = ("endpoint", "method")
+# Metric types whose values outlive the worker that recorded them
+ARCHIVED_TYPES = ("counter", "histogram")
+SIZE_BUCKETS = (0, 100, 1000, 10000, 100000, 1000000, 10000000, float("inf"))
+
+REQUEST_LATENCY = Histogram(
+    "inventory_request_duration_seconds", "Time spent handling a request", LABELS
+)
+REQUESTS = Counter("inventory_requests_total", "Requests handled", LABELS + ("status",))
+REQUESTS_IN_FLIGHT = Gauge(
+    "inventory_requests_in_flight",
+    "Requests being handled",
+    LABELS,
+    multiprocess_mode="livesum",
+)
+REQUEST_SIZE = Histogram(
+    "inventory_request_size_bytes",
+    "Size of request bodies",
+    LABELS,
+    buckets=SIZE_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "inventory_response_size_bytes",
+    "Size of response bodies that were not streamed",
+    LABELS,
+    buckets=SIZE_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    "inventory_db_queries_per_request",
+    "Database statements run by a request",
+    LABELS,
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, float("inf")),
+)
+DB_TIME = Histogram(
+    "inventory_db_seconds_per_request",
+    "Time a request spent running database statements",
+    LABELS,
+)
+LIST_ROWS = Histogram(
+    "inventory_list_rows",
+    "Items returned by a list call",
+    buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000, float("inf")),
+)
+
+
+def registry():
+    """Returns the registry with the metrics of every worker"""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    collector = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector)
+    return collector
+
+
+def archive_dead_worker(pid: int, path: str = None):
+    """Adds the counters and histograms of an exited worker to the archive
+
+    The merged archive is written next to the old one and renamed over it
+    before the worker's file is deleted, so a scrape in between counts the
+    worker twice, once. Only the master may call this, one worker at a time.
+    """
+    path = path or os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    for typ in ARCHIVED_TYPES:
+        dead = os.path.join(path, "{}_{}.db".format(typ, pid))
+        if not os.path.exists(dead):
+            continue
+        archive = os.path.join(path, "{}_archive.db".format(typ))
+        files = [dead] + ([archive] if os.path.exists(archive) else [])
+        merged = multiprocess.MultiProcessCollector.merge(files, accumulate=False)
+        # Not named *.db, so scrapes skip it until it is complete
+        staged = archive + ".tmp"
+        if os.path.exists(staged):
+            os.remove(staged)
+        values = MmapedDict(staged)
+        for metric in merged:
+            for name, labels, value, _, _ in metric.samples:
+                key = mmap_key(metric.name, name, labels.keys(), labels.values())
+                values.write_value(key, value)
+        values.close()
+        os.replace(staged, archive)
+        os.remove(dead)
+
+
+def metrics():
+    """Returns the metrics in the Prometheus text format"""
+    return Response(
+        generate_latest(registry()), headers={"Content-Type": CONTENT_TYPE_LATEST}
+    )
+
+
+def start_request():
+    """Notes when a request started and counts it as in flight"""
+    if request.endpoint == "metrics":
+        return
+    g.metrics_labels = (request.endpoint or "unmatched", request.method)
+    g.metrics_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(*g.metrics_labels).inc()
+
+
+def finish_request(response):
+    """Records the latency, sizes and database use of a finished request"""
+    labels = g.get("metrics_labels")
+    if labels is None:
+        return response
+    REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - g.metrics_start)
+    REQUESTS.labels(*labels, response.status_code).inc()
+    REQUEST_SIZE.labels(*labels).observe(request.content_length or 0)
+    if not response.is_streamed:
+        RESPONSE_SIZE.labels(*labels).observe(response.calculate_content_length() or 0)
+    stats = query_stats.current()
+    if stats is not None:
+        DB_QUERIES.labels(*labels).observe(stats.count)
+        DB_TIME.labels(*labels).observe(stats.seconds)
+    return response
+
+
+def end_request(error=None):  # pylint: disable=unused-argument
+    """Stops counting the request as in flight, even if it failed"""
+    labels = g.pop("metrics_labels", None)
+    if labels is not None:
+        REQUESTS_IN_FLIGHT.labels(*labels).dec()
+
+
+def init_app(app: Flask):
+    """Records the metrics of every request of app and serves /metrics"""
+    if not app.config["METRICS_ENABLED"]:
+        return
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(end_request)
+    app.add_url_rule("/metrics", "metrics", metrics)
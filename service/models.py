@@ -6,29 +6,339 @@ Models for the inventory service
 Models
 ------
 InventoryItem - An item stored in the inventory service
+InventorySummary - Item counts and units by condition, in_stock and SKU, kept
+    up to date by triggers on the inventory_item table
+InventorySummaryDelta - A change to the summary that is yet to be folded in
 """
+import base64
+import binascii
 from enum import Enum
+import hashlib
 import logging
-from typing import Dict, Union
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (
+    DDL,
+    String,
+    case,
+    cast,
+    event,
+    func,
+    inspect,
+    literal,
+    or_,
+    select,
+    text,
+    tuple_,
+    type_coerce,
+    union_all,
+)
+from sqlalchemy.schema import CreateIndex
+
+from service.cache import GenerationCounter, LRUCache
+from service.pool import engine_options
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# The lowest limit on bound parameters per statement of any SQLite build
+SQLITE_MAX_VARIABLES = 999
+
+# The longest SKU the inventory_item table holds
+SKU_LENGTH = 63
+
+# Serialized InventoryItems by id, sized from the config in init_db()
+item_cache = LRUCache()
+
+# Bumped after every committed write to the inventory_item table
+table_generation = GenerationCounter()
+
+
+def invalidate_caches(inventory_item_ids: Optional[List[int]] = None):
+    """Forgets cached copies of items after a write has been committed
+
+    :param inventory_item_ids: the ids of the items that were written, or
+        None if the ids are not known
+    """
+    table_generation.bump()
+    if inventory_item_ids is None:
+        item_cache.clear()
+        return
+    for inventory_item_id in inventory_item_ids:
+        item_cache.invalidate(inventory_item_id)
+
+
+def commit_keeping_state():
+    """Commits the session without expiring the objects in it
+
+    A commit normally expires every object, so serializing one that was just
+    written reads it back with another SELECT. After a flush of objects that
+    hold exactly what was written, the ORM-managed version included, that
+    read is not needed. The next ordinary commit expires them as usual.
+    """
+    session = db.session()
+    session.expire_on_commit = False
+    try:
+        session.commit()
+    finally:
+        session.expire_on_commit = True
+
 
 def init_db(app):
     """Initialies the SQLAlchemy app"""
     InventoryItem.init_db(app)
 
 
+def fold_summary(error=None):  # pylint: disable=unused-argument
+    """Folds the summary deltas after a request when due, see fold_if_due()
+
+    A failed fold is logged and left for the next one, it never fails the
+    request that happened to run it.
+    """
+    try:
+        InventorySummary.fold_if_due()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Could not fold the inventory summary")
+
+
+def dispose_db():
+    """Closes the pooled connections so a forked process opens its own
+
+    gunicorn calls this around forking workers from a preloaded app.
+    """
+    if InventoryItem.app is not None:
+        db.get_engine(InventoryItem.app).dispose()
+
+
+def upgrade_db(app, concurrently: bool = True):
+    """Creates any missing tables, columns and indexes on a live database
+
+    ``db.create_all()`` skips tables that already exist, so columns and
+    indexes added to the models after a table was created have to be added
+    here. New columns must have a server default, which Postgres adds
+    without rewriting the table. Indexes are built with CREATE INDEX
+    CONCURRENTLY on Postgres so writes are not locked out while they build.
+    Indexes left INVALID by an interrupted concurrent build are dropped and
+    built again.
+
+    :param app: the Flask app whose database should be upgraded
+    :param concurrently: build Postgres indexes without blocking writes
+
+    :return: the names of the tables, columns and indexes that were added
+    :rtype: list
+
+    The summary triggers are replaced when they differ from the ones the
+    models define, and a summary table that was just created is filled from
+    the existing items. Indexes that only exist on Postgres, listed in a
+    table's ``info["postgresql_indexes"]``, are built there like the others.
+    Indexes the models no longer define are left to drop_unused_indexes().
+    """
+    engine = db.get_engine(app)
+    tables = set(inspect(engine).get_table_names())
+    db.create_all(app=app)
+    created = [
+        table.name for table in db.metadata.sorted_tables if table.name not in tables
+    ]
+    if InventorySummary.__tablename__ in created:
+        # The triggers keep the summary up to date from now on, this counts
+        # the items that were written before
+        InventorySummary.rebuild()
+    online = concurrently and engine.dialect.name == "postgresql"
+    with engine.connect() as conn:
+        if online:
+            # CONCURRENTLY cannot run inside a transaction block
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            invalid = {
+                row[0]
+                for row in conn.execute(
+                    text(
+                        "SELECT c.relname FROM pg_index i "
+                        "JOIN pg_class c ON c.oid = i.indexrelid "
+                        "WHERE NOT i.indisvalid"
+                    )
+                )
+            }
+        else:
+            invalid = set()
+        for table in db.metadata.sorted_tables:
+            columns = {
+                column["name"] for column in inspect(conn).get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                logger.info("Adding column %s to %s", column.name, table.name)
+                ddl = "ALTER TABLE {} ADD COLUMN {} {} DEFAULT {}".format(
+                    table.name,
+                    column.name,
+                    column.type.compile(dialect=engine.dialect),
+                    column.server_default.arg,
+                )
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                conn.execute(text(ddl))
+                created.append(f"{table.name}.{column.name}")
+            existing = {
+                index["name"] for index in inspect(conn).get_indexes(table.name)
+            }
+            indexes = {
+                index.name: str(CreateIndex(index).compile(dialect=engine.dialect))
+                for index in table.indexes
+            }
+            if engine.dialect.name == "postgresql":
+                indexes.update(table.info.get("postgresql_indexes", {}))
+            for name, ddl in sorted(indexes.items()):
+                if name in existing and name not in invalid:
+                    continue
+                logger.info("Building index %s on %s", name, table.name)
+                if online:
+                    if name in invalid:
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+                    ddl = ddl.replace("INDEX", "INDEX CONCURRENTLY", 1)
+                conn.execute(text(ddl))
+                created.append(name)
+    return created
+
+
+def drop_unused_indexes(app, concurrently: bool = True) -> List[str]:
+    """Drops the indexes of the models' tables that the models no longer define
+
+    Run it after upgrade_db(), so an index that replaces one of these is
+    built before the old one goes. Only indexes named like the models' own,
+    ``ix_<table>_...``, are dropped, which leaves alone those made by hand
+    and those behind constraints. Postgres drops them CONCURRENTLY, so
+    writes are not locked out meanwhile.
+
+    :param app: the Flask app whose database should be upgraded
+    :param concurrently: drop Postgres indexes without blocking writes
+
+    :return: the names of the indexes that were dropped
+    :rtype: list
+    """
+    engine = db.get_engine(app)
+    online = concurrently and engine.dialect.name == "postgresql"
+    dropped = []
+    with engine.connect() as conn:
+        if online:
+            # CONCURRENTLY cannot run inside a transaction block
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        tables = set(inspect(conn).get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            defined = {index.name for index in table.indexes}
+            defined.update(table.info.get("postgresql_indexes", {}))
+            for index in inspect(conn).get_indexes(table.name):
+                name = index["name"]
+                if (
+                    name in defined
+                    or not name.startswith(f"ix_{table.name}_")
+                    or index.get("duplicates_constraint")
+                ):
+                    continue
+                logger.info("Dropping index %s from %s", name, table.name)
+                drop = "DROP INDEX CONCURRENTLY" if online else "DROP INDEX"
+                conn.execute(text(f"{drop} {name}"))
+                dropped.append(name)
+    return dropped
+
+
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+def encode_cursor(inventory_item_id: Union[int, str]) -> str:
+    """Encodes the id (or other key) of the last item on a page into an opaque cursor"""
+    token = base64.urlsafe_b64encode(str(inventory_item_id).encode("ascii"))
+    return token.decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Decodes a cursor made by encode_cursor() back into an item id"""
+    try:
+        return int(decode_cursor_key(cursor))
+    except ValueError as error:
+        raise DataValidationError(f"Invalid cursor: {cursor}") from error
+
+
+def decode_cursor_key(cursor: str) -> str:
+    """Decodes a cursor made by encode_cursor() back into the text it holds"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii")
+    except (binascii.Error, UnicodeError, ValueError) as error:
+        raise DataValidationError(f"Invalid cursor: {cursor}") from error
+
+
+def encode_restock_cursor(condition: str, inventory_item_id: int) -> str:
+    """Encodes the last row on a page of the restock report into a cursor"""
+    return encode_cursor(f"{condition}:{inventory_item_id}")
+
+
+def decode_restock_cursor(cursor: str) -> Tuple["Condition", int]:
+    """Decodes a cursor made by encode_restock_cursor()"""
+    condition, _, inventory_item_id = decode_cursor_key(cursor).partition(":")
+    try:
+        return Condition[condition], int(inventory_item_id)
+    except (ValueError, KeyError) as error:
+        raise DataValidationError(f"Invalid cursor: {cursor}") from error
+
+
+def escape_like(value: str) -> str:
+    """Escapes the wildcards of a LIKE pattern, with backslash as the escape"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    """Returns the first text after every text that starts with prefix
+
+    Texts that start with prefix are >= prefix and < this bound when
+    compared code point by code point, or byte by byte in UTF-8. None means
+    there is no such bound and only the lower one applies.
+    """
+    for end in range(len(prefix) - 1, -1, -1):
+        if ord(prefix[end]) < sys.maxunicode:
+            return prefix[:end] + chr(ord(prefix[end]) + 1)
+    return None
+
+
+def parse_sku(value) -> str:
+    """Returns value if it is a SKU the inventory_item table can hold"""
+    if not isinstance(value, str) or not value.strip():
+        raise DataValidationError("Invalid sku: must be a non-empty string")
+    if len(value) > SKU_LENGTH:
+        raise DataValidationError(
+            f"Invalid sku: must be at most {SKU_LENGTH} characters"
+        )
+    return value
+
+
+def stream_statement(statement, batch_size: int) -> Iterator[tuple]:
+    """Runs a Core SELECT and returns an iterator over its rows
+
+    The rows are read batch_size at a time through a server-side cursor
+    where the database has one. The statement runs before this returns, so
+    its errors are raised here and not by the first row asked for.
+    """
+    result = db.session.execute(statement.execution_options(stream_results=True))
+
+    def fetch():
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
+    return fetch()
+
+
 class Condition(Enum):
     """Enumeration of valid Item conditions"""
 
@@ -42,8 +352,43 @@ class InventoryItem(db.Model):
 
     app = None
 
+    # Fields a client may set, with the function that converts each one
+    FIELD_TYPES = {
+        "sku": parse_sku,
+        "count": int,
+        "condition": lambda value: getattr(Condition, value),
+        "restock_level": int,
+        "restock_amount": int,
+        "in_stock": bool,
+    }
+
+    # Columns read by the ORM-free read path, with the JSON type of each
+    ROW_FIELDS = {
+        "id": int,
+        "sku": str,
+        "count": int,
+        "condition": str,
+        "restock_level": int,
+        "restock_amount": int,
+        "in_stock": bool,
+        "version": int,
+    }
+
+    # Columns of the restock report, restock_amount being the order to place
+    RESTOCK_FIELDS = {
+        "condition": str,
+        "id": int,
+        "sku": str,
+        "count": int,
+        "restock_level": int,
+        "order_quantity": int,
+    }
+
+    # Columns that can be filtered by a range with <column>_min / <column>_max
+    RANGE_FILTERS = ("count", "restock_level", "restock_amount")
+
     id = db.Column(db.Integer, primary_key=True)
-    sku = db.Column(db.String(63), nullable=False)
+    sku = db.Column(db.String(SKU_LENGTH), nullable=False)
     count = db.Column(db.Integer, nullable=False)
     condition = db.Column(
         db.Enum(Condition),
@@ -53,6 +398,47 @@ class InventoryItem(db.Model):
     restock_level = db.Column(db.Integer, nullable=False)
     restock_amount = db.Column(db.Integer, nullable=False)
     in_stock = db.Column(db.Boolean(), nullable=False, default=False)
+    # Bumped on every change, see __mapper_args__ and the bulk update methods
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    # Every list filter pairs with id, which is the order pages are read in.
+    # The low stock index only holds items at or under their restock level.
+    # SQLite compares SKUs byte by byte, so its SKU index also returns SKU
+    # prefixes in order. On Postgres prefix search reads a second SKU index
+    # in the "C" collation, which compares bytes as well, and the trigram
+    # index of fuzzy SKU search. Both only exist on Postgres, so they are
+    # kept in the table's info and built by the listeners at the end of this
+    # module and by upgrade_db().
+    __table_args__ = (
+        db.Index("ix_inventory_item_condition_id", condition, id),
+        db.Index("ix_inventory_item_in_stock_id", in_stock, id),
+        db.Index(
+            "ix_inventory_item_low_stock",
+            condition,
+            id,
+            postgresql_where=(count <= restock_level),
+            sqlite_where=(count <= restock_level),
+        ),
+        db.Index("ix_inventory_item_sku_id", sku, id),
+        {
+            "info": {
+                "postgresql_indexes": {
+                    "ix_inventory_item_sku_c": (
+                        "CREATE INDEX ix_inventory_item_sku_c "
+                        'ON inventory_item (sku COLLATE "C", id)'
+                    ),
+                    "ix_inventory_item_sku_trgm": (
+                        "CREATE INDEX ix_inventory_item_sku_trgm "
+                        "ON inventory_item USING gist (sku gist_trgm_ops)"
+                    ),
+                }
+            }
+        },
+    )
+
+    # The ORM checks and bumps the version on every UPDATE, so a change made
+    # to a stale copy of an item fails with a StaleDataError
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"<Inventory item {self.sku} id={self.id}>"
@@ -64,13 +450,284 @@ class InventoryItem(db.Model):
         logger.info("Creating %s", self.sku)
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
-        db.session.commit()
+        commit_keeping_state()
+        invalidate_caches([self.id])
+
+    @classmethod
+    def create_many(cls, items: List["InventoryItem"], chunk_size: int = 1000):
+        """
+        Creates many Inventory items in one transaction
+
+        Items are written with multi-row INSERT statements of at most
+        chunk_size rows instead of one INSERT and COMMIT per item. The id of
+        every item is set once they are all written.
+        """
+        logger.info("Creating %d inventory items", len(items))
+        columns = list(cls.FIELD_TYPES) + ["version"]
+        if db.engine.dialect.name == "sqlite":
+            # SQLite caps the number of bound parameters in one statement
+            chunk_size = min(chunk_size, SQLITE_MAX_VARIABLES // len(columns))
+        try:
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start : start + chunk_size]
+                for item in chunk:
+                    item.version = 1
+                rows = [
+                    {name: getattr(item, name) for name in columns} for item in chunk
+                ]
+                for item, item_id in zip(chunk, cls._insert_rows(rows)):
+                    item.id = item_id
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        invalidate_caches([item.id for item in items])
+
+    @classmethod
+    def _insert_rows(cls, rows: List[Dict]) -> List[int]:
+        """Inserts rows with one statement and returns their new ids in order"""
+        table = cls.__table__
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            # Reserve the ids first so each row is matched to its id for sure
+            ids = [
+                row[0]
+                for row in db.session.execute(
+                    text(
+                        "SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+                        "FROM generate_series(1, :count)"
+                    ),
+                    {"table": table.name, "count": len(rows)},
+                )
+            ]
+            db.session.execute(
+                table.insert().values(
+                    [dict(row, id=item_id) for row, item_id in zip(rows, ids)]
+                )
+            )
+            return ids
+        if dialect == "sqlite":
+            # SQLite holds the write lock, so one statement gets consecutive ids
+            last_id = db.session.execute(table.insert().values(rows)).lastrowid
+            return list(range(last_id - len(rows) + 1, last_id + 1))
+        return [
+            db.session.execute(table.insert().values(row)).inserted_primary_key[0]
+            for row in rows
+        ]
+
+    @classmethod
+    def update_many(
+        cls, changes: List[Dict], chunk_size: int = 1000
+    ) -> Tuple[List[Dict], List[int]]:
+        """
+        Updates some fields of many Inventory items in one transaction
+
+        All of the changes are applied by set-based UPDATE statements of the
+        form ``SET count = CASE id WHEN 1 THEN 5 ... ELSE count END``, and the
+        updated rows are read back with RETURNING where the database has it.
+
+        :param changes: dicts with the id of an item and the fields to change
+        :type changes: list
+        :param chunk_size: the most items changed by one statement
+        :type chunk_size: int
+
+        :return: the serialized updated items, and the ids that were not
+            found. Nothing is changed if any id was not found.
+        :rtype: tuple
+
+        """
+        logger.info("Updating %d inventory items", len(changes))
+        updates = {}
+        for change in changes:
+            if not isinstance(change, dict):
+                raise DataValidationError("Invalid change: expected an object")
+            try:
+                item_id = int(change["id"])
+            except (KeyError, TypeError, ValueError) as error:
+                raise DataValidationError("Invalid change: missing or bad id")
+            names = set(change) - {"id"}
+            if not names:
+                raise DataValidationError(f"Invalid change for {item_id}: no fields")
+            unknown = names - set(cls.FIELD_TYPES)
+            if unknown:
+                raise DataValidationError(
+                    f"Invalid change for {item_id}: unknown {', '.join(sorted(unknown))}"
+                )
+            if item_id in updates:
+                raise DataValidationError(f"Invalid change: {item_id} given twice")
+            updates[item_id] = cls.parse_fields(change, sorted(names))
+
+        table = cls.__table__
+        if db.engine.dialect.name == "sqlite":
+            # Each item can bind an id and a value for every field
+            chunk_size = min(
+                chunk_size, SQLITE_MAX_VARIABLES // (2 * len(cls.FIELD_TYPES) + 1)
+            )
+        ids = list(updates)
+        rows = []
+        try:
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start : start + chunk_size]
+                values = {}
+                for name in cls.FIELD_TYPES:
+                    column = table.c[name]
+                    whens = {
+                        item_id: literal(updates[item_id][name], column.type)
+                        for item_id in chunk
+                        if name in updates[item_id]
+                    }
+                    if whens:
+                        values[name] = case(whens, value=table.c.id, else_=column)
+                values["version"] = table.c.version + 1
+                statement = table.update().where(table.c.id.in_(chunk)).values(values)
+                rows.extend(cls._execute_returning(statement, chunk))
+            missing = sorted(set(ids) - {row["id"] for row in rows})
+            if missing:
+                db.session.rollback()
+                return [], missing
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        invalidate_caches(ids)
+        position = {item_id: index for index, item_id in enumerate(ids)}
+        return sorted(rows, key=lambda row: position[row["id"]]), []
+
+    @classmethod
+    def adjust_count(
+        cls, inventory_item_id: int, delta: int, allow_negative: bool = False
+    ) -> Optional[Dict]:
+        """
+        Adds delta to the count of an Inventory item without reading it first
+
+        The change is one ``UPDATE ... SET count = count + :delta`` so
+        concurrent adjustments never overwrite each other. in_stock becomes
+        False when the count drops to zero or below, and True when it rises
+        above zero again.
+
+        :param inventory_item_id: the id of the item to adjust
+        :param delta: the amount to add to the count, negative to remove
+        :param allow_negative: allow the count to drop below zero
+
+        :return: the serialized item, or None if there is no item with that id
+            or the guard against a negative count stopped the change
+        :rtype: dict
+
+        """
+        logger.info("Adjusting count of %s by %d", inventory_item_id, delta)
+        table = cls.__table__
+        new_count = table.c.count + delta
+        statement = (
+            table.update()
+            .where(table.c.id == inventory_item_id)
+            .values(
+                count=new_count,
+                in_stock=case(
+                    [(new_count <= 0, False), (table.c.count <= 0, True)],
+                    else_=table.c.in_stock,
+                ),
+                version=table.c.version + 1,
+            )
+        )
+        if not allow_negative:
+            statement = statement.where(new_count >= 0)
+        try:
+            rows = cls._execute_returning(statement, [inventory_item_id])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        invalidate_caches([inventory_item_id])
+        return rows[0] if rows else None
+
+    @classmethod
+    def _execute_returning(cls, statement, ids: List[int]) -> List[Dict]:
+        """Runs an UPDATE and returns the serialized rows it changed
+
+        Postgres hands the rows back with RETURNING. Other databases get a
+        SELECT of the ids in the same transaction instead.
+        """
+        table = cls.__table__
+        if db.engine.dialect.name == "postgresql":
+            result = db.session.execute(statement.returning(*table.columns))
+        elif db.session.execute(statement).rowcount:
+            result = db.session.execute(table.select().where(table.c.id.in_(ids)))
+        else:
+            return []
+        return [cls.serialize_row(row) for row in result]
+
+    @staticmethod
+    def serialize_row(row) -> Dict[str, Union[str, int]]:
+        """Serialize a database row of the inventory_item table into a dictionary"""
+        data = dict(row)
+        data["condition"] = data["condition"].name
+        return data
 
     def delete(self):
         """Removes a Inventory item from the database"""
         logger.info("Deleting %s", self.sku)
         db.session.delete(self)
         db.session.commit()
+        invalidate_caches([self.id])
+
+    @classmethod
+    def delete_by_id(cls, inventory_item_id) -> bool:
+        """
+        Removes the Inventory item with inventory_item_id without reading it first
+
+        :return: True if an item was removed, False if there was none
+        :rtype: bool
+
+        """
+        try:
+            inventory_item_id = int(inventory_item_id)
+        except (TypeError, ValueError):
+            return False
+        logger.info("Deleting %s", inventory_item_id)
+        table = cls.__table__
+        try:
+            deleted = db.session.execute(
+                table.delete().where(table.c.id == inventory_item_id)
+            ).rowcount
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        invalidate_caches([inventory_item_id])
+        return bool(deleted)
+
+    @classmethod
+    def delete_by_filters(cls, filters: Dict, chunk_size: int = 10000) -> int:
+        """
+        Removes every Inventory item that matches filters from the database
+
+        Each chunk of up to chunk_size items is removed by one DELETE ... WHERE
+        statement and committed on its own, so a very large delete never holds
+        its locks for long. See filter_criteria() for the filters understood.
+
+        :return: the number of items that were removed
+        :rtype: int
+
+        """
+        logger.info("Deleting all inventory items matching %s", filters)
+        table = cls.__table__
+        chunk = select([table.c.id]).order_by(table.c.id).limit(chunk_size)
+        for criterion in cls.filter_criteria(filters):
+            chunk = chunk.where(criterion)
+        statement = table.delete().where(table.c.id.in_(chunk))
+        deleted = 0
+        while True:
+            try:
+                count = db.session.execute(statement).rowcount
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            # Which ids went is not known, so forget every cached item
+            invalidate_caches()
+            deleted += count
+            if count < chunk_size:
+                return deleted
 
     def update(self):
         """
@@ -81,7 +738,9 @@ class InventoryItem(db.Model):
         )  # TODO: Not sure about the sku part. Might change it later.
         if not self.id:
             raise DataValidationError("Update called with empty ID field.")
-        db.session.commit()
+        commit_keeping_state()
+        # The item cache is keyed by the integer id
+        invalidate_caches([int(self.id)])
 
     def serialize(self) -> Dict[str, Union[str, int]]:
         """Serialize an InventoryItem into a dictionary"""
@@ -93,17 +752,28 @@ class InventoryItem(db.Model):
             "restock_level": self.restock_level,
             "restock_amount": self.restock_amount,
             "in_stock": self.in_stock,
+            "version": self.version,
         }
 
     def deserialize(self, data: Dict[str, Union[str, int]]):
         """Deserialize an inventory item from a dictionary"""
+        for name, value in self.parse_fields(data, self.FIELD_TYPES).items():
+            setattr(self, name, value)
+        return self
+
+    @classmethod
+    def parse_fields(cls, data: Dict[str, Union[str, int]], names) -> Dict:
+        """Converts the named fields of data with the rules of FIELD_TYPES
+
+        :param data: the fields sent by a client
+        :param names: the names of the fields that must be in data
+
+        :return: the converted value of each named field
+        :rtype: dict
+
+        """
         try:
-            self.sku = data["sku"]
-            self.count = int(data["count"])
-            self.condition = getattr(Condition, data["condition"])
-            self.restock_level = int(data["restock_level"])
-            self.restock_amount = int(data["restock_amount"])
-            self.in_stock = bool(data["in_stock"])
+            return {name: cls.FIELD_TYPES[name](data[name]) for name in names}
         except KeyError as error:
             raise DataValidationError(
                 f"Invalid inventory item: missing {error.args[0]}"
@@ -116,18 +786,29 @@ class InventoryItem(db.Model):
             raise DataValidationError(
                 f"Invalid condition for inventory item: {data['condition']}"
             )
-        return self
 
     @classmethod
     def init_db(cls, app: Flask):
-        """Initializes the database session"""
+        """Initializes the database session
+
+        The engine connects on first use. Tables are created and upgraded by
+        upgrade_db(), which ``flask db-upgrade`` runs.
+        """
         logger.info("Initializing database")
         cls.app = app
+        item_cache.configure(
+            app.config.get("ITEM_CACHE_SIZE", 0), app.config.get("ITEM_CACHE_TTL", 0)
+        )
+        # The first fold is due one interval after the process starts
+        InventorySummary.fold_interval = app.config.get("SUMMARY_FOLD_SECONDS", 0)
+        InventorySummary.next_fold = time.monotonic() + InventorySummary.fold_interval
+        app.teardown_request(fold_summary)
+        # Size the connection pool from the DB_POOL_* settings
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+            app.config["SQLALCHEMY_DATABASE_URI"], app.config
+        )
         # Initialize from our Flask app
         db.init_app(app)
-        app.app_context().push()
-        # Create tables
-        db.create_all()
 
     @classmethod
     def find(cls, inventory_item_id):
@@ -143,12 +824,429 @@ class InventoryItem(db.Model):
         logger.info("Processing lookup for id %s ...", inventory_item_id)
         return cls.query.get(inventory_item_id)
 
+    @classmethod
+    def find_serialized(
+        cls,
+        inventory_item_id,
+        use_cache: bool = True,
+        fields: Optional[Iterable[str]] = None,
+    ):
+        """Finds a serialized inventory item by it's ID, through the item cache
+
+        Items are cached on first read and dropped from the cache by every
+        write to them in this process. Only whole items are cached: a
+        projection is cut from a cached item, or read on its own from the
+        database, column list and all.
+
+        :param inventory_item_id: the id of the inventory item to find
+        :type inventory_item_id: int
+        :param use_cache: False to always read the item from the database
+        :type use_cache: bool
+        :param fields: the fields to return, see projection(), or None for all
+        :type fields: list
+
+        :return: the serialized item, or None if not found
+        :rtype: dict
+
+        """
+        names = cls.projection(fields)
+        try:
+            inventory_item_id = int(inventory_item_id)
+        except (TypeError, ValueError):
+            return None
+        if use_cache:
+            data = item_cache.get(inventory_item_id)
+            if data is not None:
+                return {name: data[name] for name in names}
+        logger.info("Processing lookup for id %s ...", inventory_item_id)
+        row = db.session.execute(
+            cls.rows_statement(fields=names).where(
+                cls.__table__.c.id == inventory_item_id
+            )
+        ).first()
+        if row is None:
+            return None
+        data = dict(zip(names, row))
+        if len(names) == len(cls.ROW_FIELDS):
+            item_cache.set(inventory_item_id, data)
+        return data
+
+    @classmethod
+    def projection(cls, fields: Optional[Iterable[str]] = None) -> Tuple[str, ...]:
+        """Returns the ROW_FIELDS a client asked for, in ROW_FIELDS order
+
+        The id is always part of a projection: it names the item, and pages
+        are cut after the id of their last row.
+
+        :param fields: names of ROW_FIELDS, e.g. from ``?fields=sku,count``,
+            or None or empty for every field
+
+        :return: the names of the columns to read and encode
+        :rtype: tuple
+
+        """
+        names = {name.strip() for name in fields or () if name.strip()}
+        if not names:
+            return tuple(cls.ROW_FIELDS)
+        unknown = names.difference(cls.ROW_FIELDS)
+        if unknown:
+            raise DataValidationError(f"Invalid fields: {', '.join(sorted(unknown))}")
+        return tuple(name for name in cls.ROW_FIELDS if name == "id" or name in names)
+
+    @classmethod
+    def rows_statement(
+        cls, filters: Optional[Dict] = None, fields: Optional[Iterable[str]] = None
+    ):
+        """Returns a Core SELECT of the ROW_FIELDS columns that match filters
+
+        The condition is read as its plain name instead of as a Condition.
+        With fields, only the columns of projection(fields) are selected.
+        """
+        table = cls.__table__
+        columns = [
+            type_coerce(table.c.condition, String)
+            if name == "condition"
+            else table.c[name]
+            for name in cls.projection(fields)
+        ]
+        statement = select(columns)
+        for criterion in cls.filter_criteria(filters or {}):
+            statement = statement.where(criterion)
+        return statement
+
+    @classmethod
+    def select_rows(
+        cls,
+        filters: Optional[Dict] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> Tuple[List[tuple], Optional[str]]:
+        """Returns one page of InventoryItems as plain row tuples
+
+        This is paginate() without the ORM: rows hold the ROW_FIELDS columns
+        in order and no InventoryItem instances are built.
+
+        :param filters: see filter_criteria(), or None for all
+        :param limit: the maximum number of rows to return, or None for all
+        :param cursor: the cursor returned with the previous page, if any
+        :param fields: only read the columns of projection(fields)
+
+        :return: the rows on the page and the cursor for the next page, or
+            None if this is the last page
+        :rtype: tuple
+
+        """
+        rows = db.session.execute(cls.page_statement(filters, limit, cursor, fields))
+        return cls.split_page(rows.fetchall(), limit)
+
+    @classmethod
+    def page_statement(
+        cls,
+        filters: Optional[Dict] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[Iterable[str]] = None,
+    ):
+        """Returns the Core SELECT for one page of select_rows()
+
+        The statement asks for one row more than limit so split_page() can
+        tell whether there is a next page at all.
+        """
+        if limit is not None and limit < 1:
+            raise DataValidationError(f"Invalid limit: {limit}")
+        table = cls.__table__
+        statement = cls.rows_statement(filters, fields)
+        if cursor:
+            statement = statement.where(table.c.id > decode_cursor(cursor))
+        statement = statement.order_by(table.c.id)
+        if limit is not None:
+            statement = statement.limit(limit + 1)
+        return statement
+
+    @staticmethod
+    def split_page(
+        rows: List[tuple], limit: Optional[int]
+    ) -> Tuple[List[tuple], Optional[str]]:
+        """Returns the page and the next cursor from a page_statement()'s rows"""
+        if limit is None or len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1][0])
+
+    @classmethod
+    def stream_rows(
+        cls,
+        filters: Optional[Dict] = None,
+        batch_size: int = 1000,
+        fields: Optional[Iterable[str]] = None,
+    ) -> Iterator[tuple]:
+        """Returns an iterator over InventoryItems as plain row tuples ordered by id
+
+        This is stream() without the ORM, read through a server-side cursor
+        where the database has one. The query runs before the first row is
+        asked for, so bad filters raise here rather than mid-stream. With
+        fields, rows hold the columns of projection(fields) only.
+        """
+        statement = cls.rows_statement(filters, fields).order_by(cls.__table__.c.id)
+        return stream_statement(statement, batch_size)
+
+    @classmethod
+    def restock_statement(
+        cls, condition: Optional[str] = None, cursor: Optional[str] = None
+    ):
+        """Returns a Core SELECT of the RESTOCK_FIELDS of the items to reorder
+
+        Items are due a restock order once their count is at or under their
+        restock level. The rows are ordered by condition and id, the columns
+        of the partial ix_inventory_item_low_stock index, whose WHERE clause
+        is repeated here word for word so the database can use it: the query
+        reads only the low stock items, already in order.
+        """
+        table = cls.__table__
+        columns = [
+            type_coerce(table.c.condition, String),
+            table.c.id,
+            table.c.sku,
+            table.c.count,
+            table.c.restock_level,
+            table.c.restock_amount,
+        ]
+        statement = select(columns).where(table.c.count <= table.c.restock_level)
+        if condition:
+            statement = statement.where(
+                cls.filter_criteria({"condition": condition})[0]
+            )
+        if cursor:
+            after_condition, after_id = decode_restock_cursor(cursor)
+            statement = statement.where(
+                tuple_(table.c.condition, table.c.id)
+                > tuple_(literal(after_condition, table.c.condition.type), after_id)
+            )
+        return statement.order_by(table.c.condition, table.c.id)
+
+    @classmethod
+    def restock_rows(
+        cls,
+        condition: Optional[str] = None,
+        limit: int = 1000,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[tuple], Optional[str]]:
+        """Returns one page of the restock report as plain row tuples
+
+        :param condition: only report items in this condition, or None for all
+        :param limit: the maximum number of rows to return
+        :param cursor: the cursor returned with the previous page, if any
+
+        :return: rows of the RESTOCK_FIELDS in order, and the cursor for the
+            next page, or None if this is the last page
+        :rtype: tuple
+
+        """
+        if limit < 1:
+            raise DataValidationError(f"Invalid limit: {limit}")
+        statement = cls.restock_statement(condition, cursor).limit(limit + 1)
+        rows = db.session.execute(statement).fetchall()
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_restock_cursor(rows[-1][0], rows[-1][1])
+
+    @classmethod
+    def stream_restock_rows(
+        cls, condition: Optional[str] = None, batch_size: int = 1000
+    ) -> Iterator[tuple]:
+        """Returns an iterator over every row of the restock report
+
+        Like stream_rows(), the rows are read through a server-side cursor
+        where the database has one, and the query runs before the first row
+        is asked for.
+        """
+        return stream_statement(cls.restock_statement(condition), batch_size)
+
+    @classmethod
+    def search_statement(
+        cls,
+        sku: str,
+        match: str = "prefix",
+        filters: Optional[Dict] = None,
+        dialect: str = "sqlite",
+    ):
+        """Returns a Core SELECT of the ROW_FIELDS of the items whose SKU matches
+
+        A prefix search returns the SKUs that start with sku in SKU order, so
+        an exact match comes first. They are found with a range on the SKU
+        index, compared byte by byte: in the "C" collation on Postgres,
+        whose ix_inventory_item_sku_c index returns them in that order.
+
+        A fuzzy search returns the SKUs that contain sku, ignoring case, or
+        that are close to it. On Postgres both are found through the pg_trgm
+        trigram index, nearest first by word similarity, which the index
+        returns in order, so LIMIT stops the scan early. SQLite has no
+        trigram index: it scans the SKU index for the SKUs that contain sku,
+        earliest and shortest match first, and matches no misspellings.
+
+        :param filters: see filter_criteria(), the SKU filter excepted
+        :param dialect: the name of the database's dialect
+        """
+        if not sku:
+            raise DataValidationError("Invalid search: the SKU is empty")
+        table = cls.__table__
+        statement = cls.rows_statement(filters)
+        if match == "prefix":
+            column = table.c.sku
+            if dialect == "postgresql":
+                column = column.collate("C")
+            statement = statement.where(column >= sku)
+            upper_bound = prefix_upper_bound(sku)
+            if upper_bound is not None:
+                statement = statement.where(column < upper_bound)
+            return statement.order_by(column, table.c.id)
+        if match != "fuzzy":
+            raise DataValidationError(f"Invalid search match: {match}")
+        if dialect == "postgresql":
+            # Written as text so the % of the operator is escaped for drivers
+            # with the pyformat parameter style, which a custom op() is not
+            statement = statement.where(
+                or_(
+                    table.c.sku.ilike("%" + escape_like(sku) + "%", escape="\\"),
+                    text("inventory_item.sku %> :search").bindparams(search=sku),
+                )
+            )
+            distance = text("inventory_item.sku <->> :search").bindparams(search=sku)
+            return statement.order_by(distance, table.c.sku, table.c.id)
+        position = func.instr(func.lower(table.c.sku), sku.lower())
+        return statement.where(position > 0).order_by(
+            position, func.length(table.c.sku), table.c.sku, table.c.id
+        )
+
+    @classmethod
+    def search_rows(
+        cls,
+        sku: str,
+        match: str = "prefix",
+        filters: Optional[Dict] = None,
+        limit: int = 20,
+    ) -> List[tuple]:
+        """Returns the best matches of a SKU search as plain row tuples
+
+        :param sku: the SKU, or the part of it, to search for
+        :param match: prefix or fuzzy, see search_statement()
+        :param filters: see filter_criteria(), the SKU filter excepted
+        :param limit: the maximum number of rows to return
+
+        :return: rows of the ROW_FIELDS columns, best match first
+        :rtype: list
+
+        """
+        if limit < 1:
+            raise DataValidationError(f"Invalid limit: {limit}")
+        logger.info("Searching for inventory items with sku %s (%s)", sku, match)
+        statement = cls.search_statement(sku, match, filters, db.engine.dialect.name)
+        return db.session.execute(statement.limit(limit)).fetchall()
+
     @classmethod
     def all(cls):
         """Returns all of the InventoryItems in the database"""
         logger.info("Returning a list of all inventory items...")
         return cls.query.all()
 
+    @classmethod
+    def filter_criteria(cls, filters: Dict) -> List:
+        """Returns the SQL criteria for every filter that is set in filters
+
+        :param filters: any of sku, condition, in_stock and the <column>_min /
+            <column>_max bounds of the RANGE_FILTERS columns. Keys that are
+            missing or None are ignored.
+        :type filters: dict
+
+        :return: criteria to be ANDed together in one WHERE clause
+        :rtype: list
+
+        """
+        criteria = []
+        if filters.get("sku"):
+            criteria.append(cls.sku == filters["sku"])
+        condition = filters.get("condition")
+        if condition:
+            if not isinstance(condition, Condition):
+                try:
+                    condition = Condition[condition]
+                except KeyError as error:
+                    raise DataValidationError(
+                        f"Invalid condition: {condition}"
+                    ) from error
+            criteria.append(cls.condition == condition)
+        if filters.get("in_stock") is not None:
+            criteria.append(cls.in_stock == filters["in_stock"])
+        for name in cls.RANGE_FILTERS:
+            column = getattr(cls, name)
+            if filters.get(f"{name}_min") is not None:
+                criteria.append(column >= filters[f"{name}_min"])
+            if filters.get(f"{name}_max") is not None:
+                criteria.append(column <= filters[f"{name}_max"])
+        return criteria
+
+    @classmethod
+    def find_by_filters(cls, filters: Dict):
+        """Return all InventoryItems that match every filter in filters
+
+        See filter_criteria() for the filters that are understood.
+        """
+        logger.info("Returning all inventory items matching %s", filters)
+        return cls.query.filter(*cls.filter_criteria(filters))
+
+    @classmethod
+    def paginate(
+        cls, query=None, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[List["InventoryItem"], Optional[str]]:
+        """Returns one page of InventoryItems ordered by id
+
+        Pages are found with a keyset (``id > last id``) instead of an OFFSET,
+        so a page costs the same no matter how deep the client pages.
+
+        :param query: a query from one of the find_by_* methods, or None for all
+        :param limit: the maximum number of items to return, or None for all
+        :param cursor: the cursor returned with the previous page, if any
+
+        :return: the items on the page and the cursor for the next page, or
+            None if this is the last page
+        :rtype: tuple
+
+        """
+        if query is None:
+            query = cls.query
+        if limit is not None and limit < 1:
+            raise DataValidationError(f"Invalid limit: {limit}")
+        if cursor:
+            query = query.filter(cls.id > decode_cursor(cursor))
+        query = query.order_by(cls.id)
+        if limit is None:
+            return query.all(), None
+
+        # Ask for one extra row so we know if there is a next page at all
+        items = query.limit(limit + 1).all()
+        if len(items) <= limit:
+            return items, None
+        items = items[:limit]
+        return items, encode_cursor(items[-1].id)
+
+    @classmethod
+    def stream(cls, query=None, batch_size: int = 1000) -> Iterator[Dict]:
+        """Yields serialized InventoryItems ordered by id, one batch at a time
+
+        Rows are read through a server-side cursor where the database has
+        one, so only ``batch_size`` items are held in memory at once.
+
+        :param query: a query from one of the find_by_* methods, or None for all
+        :param batch_size: the number of rows to fetch per round trip
+
+        """
+        if query is None:
+            query = cls.query
+        for item in query.order_by(cls.id).yield_per(batch_size):
+            yield item.serialize()
+
     @classmethod
     def find_by_sku(cls, sku: str):
         """Return all InventoryItems with a given SKU"""
@@ -166,3 +1264,490 @@ class InventoryItem(db.Model):
         """Return all InventoryItems by in_stock status"""
         logger.info("Returning all inventory items with in_stock = %s", in_stock)
         return cls.query.filter(cls.in_stock == in_stock)
+
+
+class InventorySummary(db.Model):
+    """The number of items and the units they hold, for one value of a column
+
+    There is one row for every condition, for each in_stock state and for
+    every SKU that has items. Triggers on inventory_item record the changes
+    of every write as InventorySummaryDelta rows in the same transaction,
+    whether it goes through the ORM, a bulk Core statement or the ASGI app.
+    Reads add the pending deltas to the summary rows, so they never scan the
+    items, and fold() moves the deltas into the summary rows for good.
+    rebuild() recounts everything from scratch.
+    """
+
+    # The inventory_item columns the summary is kept for
+    DIMENSIONS = ("condition", "in_stock", "sku")
+
+    # A dimension whose one row counts the writes to inventory_item
+    WRITES = "writes"
+
+    # The statements that fire the triggers, which are named after them
+    TRIGGER_EVENTS = ("insert", "update", "delete")
+
+    # The Postgres advisory lock that fold() and rebuild() run under
+    FOLD_LOCK = 7412001
+
+    # Seconds between the folds each process runs, see fold_if_due()
+    fold_interval = 0.0
+    next_fold = 0.0
+    _fold_lock = threading.Lock()
+
+    dimension = db.Column(db.String(16), primary_key=True)
+    value = db.Column(db.String(SKU_LENGTH), primary_key=True)
+    items = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<Inventory summary {self.dimension}={self.value}>"
+
+    @staticmethod
+    def dimension_values(record: str) -> List[Tuple[str, str]]:
+        """Returns the SQL of each dimension's value in a trigger record
+
+        :param record: NEW or OLD, or the name of a transition table
+        """
+        return [
+            ("condition", f"CAST({record}.condition AS VARCHAR)"),
+            ("in_stock", f"CASE WHEN {record}.in_stock THEN 'true' ELSE 'false' END"),
+            ("sku", f"{record}.sku"),
+        ]
+
+    @classmethod
+    def record_sql(cls, records: List[Tuple[int, str]], tables: bool) -> str:
+        """Returns the INSERT that appends the changes of a trigger to the deltas
+
+        :param records: the sign and name of each record, e.g. [(-1, "OLD"),
+            (1, "NEW")] for an update. The changes are added up per summary
+            row first, so a row whose value did not change gets no delta.
+        :param tables: True if the records are the transition tables of a
+            statement trigger rather than the rows of a row trigger
+
+        Every write also adds one to the WRITES row, even if it changed no
+        summary row.
+        """
+        written = records[-1][1]
+        deltas = [
+            f"SELECT '{dimension}' AS dimension, {value} AS value, "
+            f"{sign} AS items, {sign} * {record}.count AS units"
+            + (f" FROM {record}" if tables else "")
+            for sign, record in records
+            for dimension, value in cls.dimension_values(record)
+        ]
+        deltas.append(
+            f"SELECT '{cls.WRITES}' AS dimension, '' AS value, 1 AS items, 0 AS units"
+            + (f" WHERE EXISTS (SELECT 1 FROM {written})" if tables else "")
+        )
+        return (
+            "INSERT INTO inventory_summary_delta (dimension, value, items, units) "
+            "SELECT dimension, value, SUM(items), SUM(units) "
+            f"FROM ({' UNION ALL '.join(deltas)}) AS delta "
+            "GROUP BY dimension, value "
+            "HAVING SUM(items) <> 0 OR SUM(units) <> 0"
+        )
+
+    @classmethod
+    def trigger_ddl(cls, dialect: str) -> List[str]:
+        """Returns the statements that create the triggers on inventory_item
+
+        On Postgres the triggers run once per statement and read the rows it
+        wrote from transition tables, which needs Postgres 10 or later.
+        """
+        if dialect == "postgresql":
+            insert = cls.record_sql([(1, "new_rows")], tables=True)
+            update = cls.record_sql([(-1, "old_rows"), (1, "new_rows")], tables=True)
+            delete = cls.record_sql([(-1, "old_rows")], tables=True)
+            return [
+                "CREATE OR REPLACE FUNCTION inventory_summary_record() "
+                "RETURNS trigger AS $$ BEGIN "
+                f"IF TG_OP = 'INSERT' THEN {insert}; "
+                f"ELSIF TG_OP = 'UPDATE' THEN {update}; "
+                f"ELSE {delete}; "
+                "END IF; RETURN NULL; END $$ LANGUAGE plpgsql",
+                "CREATE TRIGGER inventory_summary_insert "
+                "AFTER INSERT ON inventory_item REFERENCING NEW TABLE AS new_rows "
+                "FOR EACH STATEMENT EXECUTE PROCEDURE inventory_summary_record()",
+                "CREATE TRIGGER inventory_summary_update "
+                "AFTER UPDATE ON inventory_item "
+                "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+                "FOR EACH STATEMENT EXECUTE PROCEDURE inventory_summary_record()",
+                "CREATE TRIGGER inventory_summary_delete "
+                "AFTER DELETE ON inventory_item REFERENCING OLD TABLE AS old_rows "
+                "FOR EACH STATEMENT EXECUTE PROCEDURE inventory_summary_record()",
+            ]
+        # SQLite only has row triggers, and only one writer at a time
+        return [
+            f"CREATE TRIGGER inventory_summary_{event} AFTER {event.upper()} "
+            f"ON inventory_item FOR EACH ROW BEGIN {cls.record_sql(records, False)}; END"
+            for event, records in zip(
+                cls.TRIGGER_EVENTS,
+                ([(1, "NEW")], [(-1, "OLD"), (1, "NEW")], [(-1, "OLD")]),
+            )
+        ]
+
+    @classmethod
+    def install_triggers(cls, connection) -> bool:
+        """Installs the triggers on inventory_item unless they are current
+
+        Replacing a trigger locks the table against writes, so the installed
+        triggers are compared with trigger_ddl() first. On Postgres the
+        function carries a hash of the statements that created it; SQLite
+        keeps the statements themselves. Older triggers are dropped in the
+        same transaction as the new ones are created.
+
+        :return: True if the triggers were installed
+        """
+        statements = cls.trigger_ddl(connection.dialect.name)
+        if connection.dialect.name == "postgresql":
+            version = hashlib.sha1("; ".join(statements).encode()).hexdigest()
+            names = ", ".join(f"'inventory_summary_{e}'" for e in cls.TRIGGER_EVENTS)
+            installed = connection.execute(
+                text(
+                    "SELECT obj_description("
+                    "to_regprocedure('inventory_summary_record()'), 'pg_proc'), "
+                    "(SELECT count(*) FROM pg_trigger "
+                    "WHERE tgrelid = 'inventory_item'::regclass "
+                    f"AND tgname IN ({names}))"
+                )
+            ).first()
+            if tuple(installed) == (version, len(cls.TRIGGER_EVENTS)):
+                return False
+            statements = (
+                [
+                    "DROP TRIGGER IF EXISTS inventory_summary_apply ON inventory_item",
+                    "DROP FUNCTION IF EXISTS inventory_summary_apply()",
+                ]
+                + [
+                    f"DROP TRIGGER IF EXISTS inventory_summary_{event} "
+                    "ON inventory_item"
+                    for event in cls.TRIGGER_EVENTS
+                ]
+                + statements
+                + [f"COMMENT ON FUNCTION inventory_summary_record() IS '{version}'"]
+            )
+        else:
+            installed = dict(
+                connection.execute(
+                    text(
+                        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+                        "AND tbl_name = 'inventory_item'"
+                    )
+                ).fetchall()
+            )
+            if set(installed.values()) == set(statements):
+                return False
+            statements = [
+                f"DROP TRIGGER {name}"
+                for name in sorted(installed)
+                if name.startswith("inventory_summary_")
+            ] + statements
+        logger.info("Installing the inventory summary triggers")
+        with connection.begin():
+            for statement in statements:
+                connection.execute(DDL(statement))
+        return True
+
+    @classmethod
+    def current_statement(cls, dimensions: Iterable[str], after: Optional[str] = None):
+        """Returns a Core SELECT of the summary rows with their deltas added
+
+        :param dimensions: the dimensions whose rows are read
+        :param after: only read the values after this one
+
+        The rows have the dimension, value, items and units columns and are
+        grouped by dimension and value, so ordering by those lets the
+        database merge the summary's primary key with the few deltas.
+        """
+        parts = []
+        for table in (cls.__table__, InventorySummaryDelta.__table__):
+            part = select(
+                [table.c.dimension, table.c.value, table.c["items"], table.c.units]
+            ).where(table.c.dimension.in_(list(dimensions)))
+            if after is not None:
+                part = part.where(table.c.value > after)
+            parts.append(part)
+        rows = union_all(*parts).alias("rows")
+        return select(
+            [
+                rows.c.dimension,
+                rows.c.value,
+                func.sum(rows.c["items"]).label("items"),
+                func.sum(rows.c.units).label("units"),
+            ]
+        ).group_by(rows.c.dimension, rows.c.value)
+
+    @classmethod
+    def fold(cls, wait: bool = True) -> bool:
+        """Adds the deltas to the summary rows and deletes them
+
+        Writers only ever append deltas, so this is the one place that
+        updates summary rows. Folds run one at a time and update the rows in
+        (dimension, value) order. On Postgres the deltas are deleted and
+        added up by one statement, which only sees the committed ones; those
+        of transactions still running are left for the next fold.
+
+        :param wait: wait for a fold that is running elsewhere to finish,
+            rather than return False at once
+
+        :return: False if the deltas were left to a fold that was running
+        :rtype: bool
+        """
+        table = cls.__table__
+        delta = InventorySummaryDelta.__table__
+        upsert = (
+            "INSERT INTO inventory_summary (dimension, value, items, units) "
+            "SELECT dimension, value, SUM(items), SUM(units) FROM {} "
+            "GROUP BY dimension, value "
+            "HAVING SUM(items) <> 0 OR SUM(units) <> 0 "
+            "ORDER BY dimension, value "
+            "ON CONFLICT (dimension, value) DO UPDATE SET "
+            "items = inventory_summary.items + excluded.items, "
+            "units = inventory_summary.units + excluded.units"
+        )
+        try:
+            if db.engine.dialect.name == "postgresql":
+                key = {"key": cls.FOLD_LOCK}
+                if wait:
+                    db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), key)
+                elif not db.session.execute(
+                    text("SELECT pg_try_advisory_xact_lock(:key)"), key
+                ).scalar():
+                    db.session.rollback()
+                    return False
+                rows = db.session.execute(
+                    text(
+                        "WITH moved AS (DELETE FROM inventory_summary_delta "
+                        "RETURNING dimension, value, items, units) "
+                        + upsert.format("moved")
+                        + " RETURNING dimension, value, items"
+                    )
+                )
+                emptied = [
+                    value
+                    for dimension, value, item_count in rows
+                    if dimension == "sku" and item_count == 0
+                ]
+                for start in range(0, len(emptied), SQLITE_MAX_VARIABLES):
+                    db.session.execute(
+                        table.delete().where(
+                            (table.c.dimension == "sku")
+                            & table.c.value.in_(
+                                emptied[start : start + SQLITE_MAX_VARIABLES]
+                            )
+                            & (table.c["items"] == 0)
+                        )
+                    )
+            else:
+                last = db.session.execute(select([func.max(delta.c.id)])).scalar()
+                if last is not None:
+                    folded = delta.c.id <= last
+                    # The WHERE clause keeps SQLite from reading ON as a join
+                    db.session.execute(
+                        text(
+                            upsert.format("inventory_summary_delta WHERE id <= :last")
+                        ),
+                        {"last": last},
+                    )
+                    db.session.execute(
+                        table.delete().where(
+                            (table.c.dimension == "sku")
+                            & (table.c["items"] == 0)
+                            & table.c.value.in_(
+                                select([delta.c.value]).where(
+                                    folded & (delta.c.dimension == "sku")
+                                )
+                            )
+                        )
+                    )
+                    db.session.execute(delta.delete().where(folded))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return True
+
+    @classmethod
+    def fold_if_due(cls) -> bool:
+        """Folds the deltas if this process has not for fold_interval seconds
+
+        It runs after every request, so the deltas never pile up for longer
+        than that, whether or not ``flask summary-fold`` is scheduled. One
+        thread of a process tries at a time, and never waits for a fold
+        that another process is running.
+
+        :return: True if the deltas were folded
+        :rtype: bool
+        """
+        if cls.fold_interval <= 0 or time.monotonic() < cls.next_fold:
+            return False
+        if not cls._fold_lock.acquire(blocking=False):
+            return False
+        try:
+            if time.monotonic() < cls.next_fold:
+                return False
+            cls.next_fold = time.monotonic() + cls.fold_interval
+            return cls.fold(wait=False)
+        finally:
+            cls._fold_lock.release()
+
+    @classmethod
+    def rebuild(cls):
+        """Recounts the summary from the inventory_item table
+
+        On Postgres the items are locked against writes, not reads, while
+        they are counted, so no trigger records a delta halfway through, and
+        no fold runs at the same time. The WRITES row is kept.
+        """
+        logger.info("Rebuilding the inventory summary")
+        table = cls.__table__
+        delta = InventorySummaryDelta.__table__
+        items = InventoryItem.__table__
+        values = {
+            "condition": cast(items.c.condition, String),
+            "in_stock": case([(items.c.in_stock, "true")], else_="false"),
+            "sku": items.c.sku,
+        }
+        try:
+            if db.engine.dialect.name == "postgresql":
+                db.session.execute(
+                    text("SELECT pg_advisory_xact_lock(:key)"), {"key": cls.FOLD_LOCK}
+                )
+                db.session.execute(text("LOCK TABLE inventory_item IN SHARE MODE"))
+            db.session.execute(
+                table.delete().where(table.c.dimension.in_(cls.DIMENSIONS))
+            )
+            db.session.execute(
+                delta.delete().where(delta.c.dimension.in_(cls.DIMENSIONS))
+            )
+            for dimension in cls.DIMENSIONS:
+                value = values[dimension]
+                db.session.execute(
+                    table.insert().from_select(
+                        ["dimension", "value", "items", "units"],
+                        select(
+                            [
+                                literal(dimension),
+                                value,
+                                func.count(),
+                                func.coalesce(func.sum(items.c.count), 0),
+                            ]
+                        ).group_by(value),
+                    )
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def totals(cls) -> Dict[str, Dict]:
+        """Returns the items and units by condition and in_stock, and overall
+
+        Conditions and states without items are reported as zero.
+        """
+        statement = cls.current_statement(["condition", "in_stock"])
+        totals = {
+            "condition": {
+                condition.name: {"items": 0, "units": 0} for condition in Condition
+            },
+            "in_stock": {
+                state: {"items": 0, "units": 0} for state in ("true", "false")
+            },
+        }
+        for dimension, value, item_count, units in db.session.execute(statement):
+            totals[dimension][value] = {"items": int(item_count), "units": int(units)}
+        totals["total"] = {
+            name: sum(group[name] for group in totals["condition"].values())
+            for name in ("items", "units")
+        }
+        return totals
+
+    @classmethod
+    def write_count(cls) -> int:
+        """Returns the number of writes to inventory_item so far
+
+        It grows with every committed write, from any process, so it tells
+        whether anything changed since it was last read.
+        """
+        row = db.session.execute(cls.current_statement([cls.WRITES])).first()
+        return int(row["items"]) if row else 0
+
+    @classmethod
+    def sku_rows(
+        cls, limit: int = 1000, cursor: Optional[str] = None
+    ) -> Tuple[List[tuple], Optional[str]]:
+        """Returns one page of (sku, items, units) rows in SKU order
+
+        :return: the rows on the page and the cursor for the next page, or
+            None if this is the last page
+        :rtype: tuple
+
+        """
+        if limit < 1:
+            raise DataValidationError(f"Invalid limit: {limit}")
+        after = decode_cursor_key(cursor) if cursor else None
+        rows = cls.current_statement(["sku"], after).alias("sku_rows")
+        statement = (
+            select([rows.c.value, rows.c["items"], rows.c.units])
+            .where(rows.c["items"] > 0)
+            .order_by(rows.c.value)
+            .limit(limit + 1)
+        )
+        rows = db.session.execute(statement).fetchall()
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1][0])
+
+
+class InventorySummaryDelta(db.Model):
+    """A change to one InventorySummary row that has not been folded into it
+
+    The triggers on inventory_item only ever insert these rows, so writers
+    never wait on each other for the summary row of a condition or in_stock
+    state they share, and cannot deadlock over them.
+    """
+
+    __tablename__ = "inventory_summary_delta"
+
+    # Reads add up the deltas of a few dimensions, or of the WRITES row
+    __table_args__ = (
+        db.Index("ix_inventory_summary_delta_dimension_value", "dimension", "value"),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    dimension = db.Column(db.String(16), nullable=False)
+    value = db.Column(db.String(SKU_LENGTH), nullable=False)
+    items = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<Inventory summary delta {self.dimension}={self.value}>"
+
+
+@event.listens_for(db.metadata, "before_create")
+def install_extensions(target, connection, **kw):
+    """Installs the Postgres extensions that the indexes need"""
+    # pylint: disable=unused-argument
+    if connection.dialect.name == "postgresql":
+        connection.execute(DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
+@event.listens_for(db.metadata, "after_create")
+def create_postgresql_indexes(target, connection, tables=(), **kw):
+    """Builds the Postgres only indexes of the tables that were just created"""
+    # pylint: disable=unused-argument
+    if connection.dialect.name != "postgresql":
+        return
+    for table in tables:
+        for ddl in table.info.get("postgresql_indexes", {}).values():
+            connection.execute(DDL(ddl))
+
+
+@event.listens_for(db.metadata, "after_create")
+def install_summary_triggers(target, connection, **kw):
+    """Creates the triggers that maintain InventorySummary, if they changed"""
+    # pylint: disable=unused-argument
+    InventorySummary.install_triggers(connection)
@@ -0,0 +1,121 @@
+"""
+Connection pool tuning and statistics for the inventory service
+
+Classes
+-------
+TimedQueuePool - A QueuePool that measures how long checkouts wait
+
+Functions
+---------
+engine_options - Builds SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* settings
+pool_status - Returns the live statistics of a pool
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+# Options that only a QueuePool accepts. SQLite uses a pool without a size,
+# which rejects them.
+QUEUE_POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that counts checkouts and the time they spend waiting
+
+    The time includes opening a new connection when the pool has none free.
+    The counters start again when the engine is disposed and the pool is
+    recreated.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        with self._stats_lock:
+            self.waiting += 1
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.waiting -= 1
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def wait_stats(self) -> Dict:
+        """Returns the checkout counters, with wait times in milliseconds"""
+        with self._stats_lock:
+            return {
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": round(
+                    self.wait_total * 1000 / self.checkouts if self.checkouts else 0, 3
+                ),
+                "wait_ms_max": round(self.wait_max * 1000, 3),
+            }
+
+
+def engine_options(database_uri: str, config: Dict) -> Dict:
+    """Returns the engine options for database_uri from the DB_POOL_* settings"""
+    options = {
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_POOL_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+    if database_uri.startswith("sqlite"):
+        for name in QUEUE_POOL_OPTIONS:
+            del options[name]
+    else:
+        options["poolclass"] = TimedQueuePool
+    return options
+
+
+def pool_status(pool, saturation_limit: float = 1.0) -> Dict:
+    """Returns the live statistics of pool and whether it is saturated
+
+    A pool is saturated when a request is waiting for a connection, or when
+    the share of its connections that are checked out reaches
+    saturation_limit. Pools without a fixed size are never saturated.
+    """
+    status = {"class": type(pool).__name__, "saturated": False}
+    if not isinstance(pool, QueuePool):
+        return status
+
+    # pylint: disable=protected-access
+    capacity: Optional[int] = None
+    if pool._max_overflow >= 0:
+        capacity = pool.size() + pool._max_overflow
+    checked_out = pool.checkedout()
+    status.update(
+        size=pool.size(),
+        capacity=capacity,
+        checked_in=pool.checkedin(),
+        checked_out=checked_out,
+        overflow=max(pool.overflow(), 0),
+        saturation=round(checked_out / capacity, 3) if capacity else 0,
+    )
+    if isinstance(pool, TimedQueuePool):
+        status.update(pool.wait_stats())
+    status["saturated"] = bool(
+        status.get("waiting") or (capacity and status["saturation"] >= saturation_limit)
+    )
+    return status
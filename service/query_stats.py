@@ -0,0 +1,199 @@
+"""
+Per-request database statement counters
+
+Classes
+-------
+QueryStats - The number of statements a request ran and the time they took
+SlowQueryLog - Logs statements that ran longer than a threshold
+QueryBudgetExceeded - Raised in testing when a view runs more statements than
+    its budget
+
+Functions
+---------
+init_app - Starts counting the statements of every request of a Flask app
+current - Returns the QueryStats of the request being handled, if any
+query_budget - Declares the most statements a view may run
+
+The counters hook the cursor events of every SQLAlchemy Engine, so they also
+count statements run by engines created after init_app(). Each response says
+how many statements it ran in X-DB-Queries and how long they took in
+Server-Timing. Statements that a streamed body runs after the response was
+started are not in its headers.
+"""
+import functools
+import logging
+import reprlib
+import time
+from typing import Optional
+
+from flask import Flask, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app.slow_query")
+
+# Keeps the bound parameters of a bulk statement to a readable size
+parameter_repr = reprlib.Repr()
+parameter_repr.maxstring = 100
+parameter_repr.maxother = 100
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more statements than its query budget allows"""
+
+
+class QueryStats:
+    """The statements one request ran and the seconds spent running them"""
+
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+class SlowQueryLog:
+    """Logs every statement that took at least threshold seconds
+
+    With explain set, the plan the database chose for the statement is
+    logged with it. The plan is read with EXPLAIN, which does not run the
+    statement again, on a cursor of its own so the results of the slow
+    statement are not disturbed.
+    """
+
+    def __init__(self, threshold: float = 0, explain: bool = False):
+        self.threshold = threshold
+        self.explain = explain
+
+    def configure(self, threshold: float, explain: bool):
+        """Changes the threshold in seconds, 0 to log nothing, and EXPLAIN"""
+        self.threshold = threshold
+        self.explain = explain
+
+    def record(self, conn, statement, parameters, executemany, elapsed):
+        """Logs the statement if it took at least the threshold"""
+        # pylint: disable=too-many-arguments
+        if not self.threshold or elapsed < self.threshold:
+            return
+        logger.warning(
+            "Slow query (%.3fs): %s parameters=%s",
+            elapsed,
+            statement,
+            parameter_repr.repr(parameters),
+        )
+        if self.explain and not executemany:
+            plan = self.query_plan(conn, statement, parameters)
+            if plan:
+                logger.warning("Query plan:\n%s", plan)
+
+    @staticmethod
+    def query_plan(conn, statement, parameters) -> Optional[str]:
+        """Returns what EXPLAIN says about statement, or None if it cannot"""
+        if statement.lstrip()[:6].upper() not in ("SELECT", "UPDATE", "DELETE"):
+            return None
+        explain = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(explain + statement, parameters)
+            return "\n".join(
+                " ".join(str(column) for column in row) for row in cursor.fetchall()
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Could not explain the slow query: %s", error)
+            return None
+        finally:
+            cursor.close()
+
+
+# Sized from the app's config in init_app()
+slow_query_log = SlowQueryLog()
+
+
+def current() -> Optional[QueryStats]:
+    """Returns the QueryStats of the request being handled, if any"""
+    if not has_request_context():
+        return None
+    return g.get("query_stats")
+
+
+def query_budget(limit: int):
+    """Declares the most statements a view may run
+
+    A view that runs more fails with QueryBudgetExceeded while the app is
+    testing, and logs a warning otherwise, so an N+1 pattern or an extra
+    round trip shows up as soon as it is written.
+    """
+
+    def decorate(view):
+        @functools.wraps(view)
+        def budgeted(*args, **kwargs):
+            g.query_budget = limit
+            return view(*args, **kwargs)
+
+        return budgeted
+
+    return decorate
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Notes when a statement started"""
+    # pylint: disable=unused-argument,too-many-arguments
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Adds a finished statement to the counters of the current request"""
+    # pylint: disable=unused-argument,too-many-arguments
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+    slow_query_log.record(conn, statement, parameters, executemany, elapsed)
+
+
+def handle_error(context):
+    """Forgets the start of a statement that failed"""
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def start_request():
+    """Gives the request that is starting counters of its own"""
+    g.query_stats = QueryStats()
+    g.query_budget = None
+
+
+def finish_request(response):
+    """Reports the statements of a request and checks them against its budget"""
+    stats = current()
+    if stats is None:
+        return response
+    if current_app.config["QUERY_STATS_HEADERS"]:
+        response.headers["X-DB-Queries"] = str(stats.count)
+        response.headers.add(
+            "Server-Timing",
+            'db;dur={:.2f};desc="{} queries"'.format(stats.seconds * 1000, stats.count),
+        )
+    budget = g.get("query_budget")
+    if budget is not None and stats.count > budget:
+        message = "{} {} ran {} statements, its query budget is {}".format(
+            request.method, request.url_rule, stats.count, budget
+        )
+        if current_app.testing:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
+
+
+def init_app(app: Flask):
+    """Counts the statements of every request of app"""
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(Engine, "handle_error", handle_error)
+    slow_query_log.configure(
+        app.config["SLOW_QUERY_SECONDS"], app.config["SLOW_QUERY_EXPLAIN"]
+    )
+    app.before_request(start_request)
+    app.after_request(finish_request)
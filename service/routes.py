@@ -5,27 +5,110 @@ Inventory Service
 Paths:
 ------
 GET / - return a homepage of the inventory system
+GET /stats - return the counters of the in-process caches and connection pool
+GET /health/ready - return 503 while the connection pool is saturated
 POST /inventories - Creates an Inventory item
-GET /inventories - Returns a list all of the Inventory items
+POST /inventories/bulk - Creates many Inventory items from a JSON array or NDJSON
+PATCH /inventories/bulk - Updates some fields of many Inventory items at once
+GET /inventories - Returns a list all of the Inventory items, a page at a time
+                   or streamed as NDJSON
 GET /inventories/{id} - Retrieve an inventory item based on id
 PUT /inventories/{id} - updates an inventory item record in the database
 DELETE /inventories/{id} - deletes an inventory item record in the database
+DELETE /inventories - deletes every inventory item that matches the filters
 PUT /inventories/{ID}/in-stock - update the in_stock attribute of Inventory model to True
+POST /inventories/{ID}/adjust - add to or remove from the count of an item atomically
+GET /inventories/restock - Returns the items to reorder by condition, a page at a
+                           time or streamed as CSV
+GET /inventories/search - Returns the items whose SKU starts with, contains or is
+                          close to some text, best match first
+GET /inventories/summary - Returns the items and units by condition and in_stock
+GET /inventories/summary/skus - Returns the items and units of each SKU, a page at a time
 """
-from flask import jsonify, request, url_for, make_response, abort
+import csv
+import io
+import json
+import logging
+from urllib.parse import urlencode
+
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    request,
+    url_for,
+    abort,
+    stream_with_context,
+)
 from flask_restx import Api, Resource, fields, reqparse, inputs
+from sqlalchemy.orm.exc import StaleDataError
 from werkzeug.exceptions import NotFound
 
-from service.models import InventoryItem, Condition, DataValidationError
+from service.cache import LRUCache
+from service.encoders import RowEncoder
+from service.log_utils import PayloadSampler
+from service.metrics import LIST_ROWS
+from service.pool import pool_status
+from service.query_stats import query_budget
+from service.models import (
+    InventoryItem,
+    InventorySummary,
+    DataValidationError,
+    item_cache,
+    table_generation,
+    db,
+)
 from . import status  # HTTP Status Codes
 
-# Import Flask application
-from . import app
+# The app that create_app() registered the blueprint on
+from flask import current_app as app  # pylint: disable=wrong-import-order
+
+blueprint = Blueprint("inventory", __name__)
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+CSV = "text/csv"
+
+# Encodes the rows of InventoryItem.select_rows() and stream_rows()
+row_encoder = RowEncoder(InventoryItem.ROW_FIELDS)
+
+# Encodes the rows of InventoryItem.restock_rows() after their condition
+restock_encoder = RowEncoder(
+    {
+        name: kind
+        for name, kind in InventoryItem.RESTOCK_FIELDS.items()
+        if name != "condition"
+    }
+)
+
+# Encodes the rows of InventorySummary.sku_rows()
+sku_totals_encoder = RowEncoder({"sku": str, "items": int, "units": int})
+
+# Encoded list responses by table generation and query arguments
+list_cache = LRUCache()
+
+# Which requests log their full payload, see LOG_PAYLOAD_SAMPLE_RATE
+payload_sampler = PayloadSampler()
+
+
+@blueprint.record
+def configure(state):
+    """Sizes the list cache and payload sampling from the app's config"""
+    config = state.app.config
+    list_cache.configure(
+        config["LIST_CACHE_SIZE"],
+        config["LIST_CACHE_TTL"],
+        config["LIST_CACHE_MAX_BYTES"],
+    )
+    payload_sampler.configure(
+        config["LOG_PAYLOAD_SAMPLE_RATE"], config["LOG_PAYLOAD_SAMPLE_RATES"]
+    )
+
 
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route("/")
+@blueprint.route("/")
 def index():
     """
     Return a simple UI for our service
@@ -33,13 +116,49 @@ def index():
     return app.send_static_file("index.html")
 
 
+######################################################################
+# GET CACHE AND POOL STATISTICS
+######################################################################
+@blueprint.route("/stats")
+def stats():
+    """
+    Return the counters of this worker's caches and connection pool
+    """
+    return jsonify(
+        item_cache=item_cache.stats(),
+        list_cache=list_cache.stats(),
+        db_pool=pool_status(db.engine.pool),
+    )
+
+
+######################################################################
+# READINESS CHECK
+######################################################################
+@blueprint.route("/health/ready")
+def ready():
+    """
+    Return 200 while this worker can get a database connection without waiting
+
+    A load balancer can route around an instance that returns 503 here. The
+    check reads the pool counters and does not use a connection itself.
+    """
+    pool = pool_status(db.engine.pool, app.config["DB_POOL_READY_SATURATION"])
+    if pool["saturated"]:
+        app.logger.warning("Not ready, connection pool is saturated: %s", pool)
+        return (
+            jsonify(status="saturated", db_pool=pool),
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return jsonify(status="ready", db_pool=pool), status.HTTP_200_OK
+
+
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
 # Document the type of autorization required
 
+# create_app() attaches the API to the app with api.init_app()
 api = Api(
-    app,
     version="1.0.0",
     title="Inventory REST API Service",
     description="The inventory service provides an interface for interacting with items in our inventory",  # noqa E503
@@ -86,20 +205,202 @@ inventory_item_model = api.inherit(
         "id": fields.Integer(
             readOnly=True, description="The unique id assigned internally by service"
         ),
+        "version": fields.Integer(
+            readOnly=True, description="Bumped by the service on every change"
+        ),
     },
 )
 
 
-# query string arguments
-inventory_item_args = reqparse.RequestParser()
+patch_model = api.model(
+    "InventoryItemPatch",
+    {
+        "id": fields.Integer(
+            required=True, description="The id of the inventory item to change"
+        ),
+        "sku": fields.String(description="The SKU of the inventory item"),
+        "count": fields.Integer(
+            description="Number of the item that are currently in stock"
+        ),
+        "condition": fields.String(description="The condition of the item"),
+        "restock_level": fields.Integer(
+            description="The number of items that will trigger a restock order"
+        ),
+        "restock_amount": fields.Integer(
+            description="The number of items to order when restocking"
+        ),
+        "in_stock": fields.Boolean(description="The in_stock status of our item"),
+    },
+)
+
+
+adjust_model = api.model(
+    "InventoryItemAdjustment",
+    {
+        "delta": fields.Integer(
+            required=True,
+            description="The amount to add to the count, negative to remove",
+        ),
+        "allow_negative": fields.Boolean(
+            default=False, description="Allow the count to drop below zero"
+        ),
+    },
+)
+
+
+restock_item_model = api.model(
+    "RestockItem",
+    {
+        "id": fields.Integer(description="The id of the inventory item"),
+        "sku": fields.String(description="The SKU of the inventory item"),
+        "count": fields.Integer(description="Number of the item in stock"),
+        "restock_level": fields.Integer(
+            description="The count at or under which the item is reordered"
+        ),
+        "order_quantity": fields.Integer(
+            description="The number of items to order, its restock amount"
+        ),
+    },
+)
+
+restock_group_model = api.model(
+    "RestockGroup",
+    {
+        "condition": fields.String(description="The condition of the items"),
+        "items": fields.List(fields.Nested(restock_item_model)),
+    },
+)
+
+
+totals_model = api.model(
+    "InventoryTotals",
+    {
+        "items": fields.Integer(description="The number of inventory items"),
+        "units": fields.Integer(description="The sum of their counts"),
+    },
+)
+
+summary_model = api.model(
+    "InventorySummary",
+    {
+        "condition": fields.Raw(description="The totals of each condition"),
+        "in_stock": fields.Raw(description="The totals of in_stock true and false"),
+        "total": fields.Nested(totals_model),
+    },
+)
+
+sku_totals_model = api.inherit(
+    "SkuTotals",
+    totals_model,
+    {"sku": fields.String(description="The SKU of the inventory items")},
+)
+
+
+# query string arguments shared by every request on the collection
+inventory_filter_args = reqparse.RequestParser()
+inventory_filter_args.add_argument(
+    "sku", type=str, required=False, help="Filter items by SKU"
+)
+inventory_filter_args.add_argument(
+    "condition", type=str, required=False, help="Filter items by condition"
+)
+inventory_filter_args.add_argument(
+    "in_stock",
+    type=inputs.boolean,
+    required=False,
+    help="Filter items by availability",
+)
+for column in InventoryItem.RANGE_FILTERS:
+    inventory_filter_args.add_argument(
+        f"{column}_min",
+        type=int,
+        required=False,
+        help=f"Filter items with {column} greater than or equal to this",
+    )
+    inventory_filter_args.add_argument(
+        f"{column}_max",
+        type=int,
+        required=False,
+        help=f"Filter items with {column} less than or equal to this",
+    )
+
+# query string arguments for listing the collection
+inventory_item_args = inventory_filter_args.copy()
+inventory_item_args.add_argument(
+    "limit", type=inputs.positive, required=False, help="Maximum items per page"
+)
 inventory_item_args.add_argument(
-    "sku", type=str, required=False, help="List items by SKU"
+    "cursor", type=str, required=False, help="Cursor of the page to return"
 )
 inventory_item_args.add_argument(
-    "condition", type=str, required=False, help="List items by condition"
+    "fields",
+    type=str,
+    required=False,
+    help="Comma separated fields to return, e.g. sku,count. The id is always returned",
 )
 inventory_item_args.add_argument(
-    "in_stock", type=inputs.boolean, required=False, help="List items by availability"
+    "stream",
+    type=inputs.boolean,
+    required=False,
+    help="Stream every matching item as a chunked JSON array",
+)
+
+# query string arguments for deleting the items that match the filters
+inventory_delete_args = inventory_filter_args.copy()
+inventory_delete_args.add_argument(
+    "all",
+    type=inputs.boolean,
+    default=False,
+    help="Confirms that every item is to be deleted when no filter is given",
+)
+
+# query string arguments for reading one item, whose GETs may be sent
+# with a JSON Content-Type and no body
+item_args = reqparse.RequestParser()
+item_args.add_argument(
+    "fields",
+    type=str,
+    required=False,
+    location="args",
+    help="Comma separated fields to return, e.g. sku,count. The id is always returned",
+)
+
+# query string arguments of a SKU search, filtered like the list
+search_args = inventory_filter_args.copy()
+search_args.replace_argument(
+    "sku", type=str, required=True, help="The SKU, or part of it, to search for"
+)
+search_args.add_argument(
+    "match",
+    type=str,
+    choices=("prefix", "fuzzy"),
+    default="prefix",
+    help="prefix for SKUs that start with sku, fuzzy for SKUs that contain or "
+    "are close to it",
+)
+search_args.add_argument(
+    "limit", type=inputs.positive, default=20, help="Maximum items to return"
+)
+
+# query string arguments of the restock report
+restock_args = reqparse.RequestParser()
+restock_args.add_argument(
+    "condition", type=str, required=False, help="Only report items in this condition"
+)
+restock_args.add_argument(
+    "limit", type=inputs.positive, required=False, help="Maximum items per page"
+)
+restock_args.add_argument(
+    "cursor", type=str, required=False, help="Cursor of the page to return"
+)
+
+# query string arguments for paging through the SKU totals
+page_args = reqparse.RequestParser()
+page_args.add_argument(
+    "limit", type=inputs.positive, required=False, help="Maximum SKUs per page"
+)
+page_args.add_argument(
+    "cursor", type=str, required=False, help="Cursor of the page to return"
 )
 
 ######################################################################
@@ -117,6 +418,18 @@ def request_validation_error(error):
     }, status.HTTP_400_BAD_REQUEST
 
 
+@api.errorhandler(StaleDataError)
+def stale_data_error(error):
+    """Handles an update made to an item that another request just changed"""
+    message = "Inventory item was changed by another request, fetch it and retry"
+    app.logger.warning(message)
+    return {
+        "status_code": status.HTTP_412_PRECONDITION_FAILED,
+        "error": "Precondition Failed",
+        "message": message,
+    }, status.HTTP_412_PRECONDITION_FAILED
+
+
 ######################################################################
 #  PATH: /inventories/{id}
 ######################################################################
@@ -135,25 +448,35 @@ class InventoryItemResource(Resource):
     # RETRIEVE AN INVENTORY ITEM
     # ---------------------------------------------------------------------
     @api.doc("get_inventory_items")
+    @api.expect(item_args, validate=True)
     @api.response(404, "Inventory item not found")
-    @api.marshal_with(inventory_item_model)
+    @api.response(304, "Inventory item not modified since the If-None-Match ETag")
+    @api.response(200, "Success", inventory_item_model)
+    @query_budget(1)
     def get(self, inventory_item_id):
         """
         Retrieve an inventory item
 
-        This endpoint will return a inventory item based on the id specified in the path
+        This endpoint will return a inventory item based on the id specified in the path.
+        Send ``Cache-Control: no-cache`` to skip the item cache, and
+        ``?fields=sku,count`` to only return some of the fields.
         """
+        args = item_args.parse_args()
         app.logger.info(
             "Request to Read a inventory item with id [%s]", inventory_item_id
         )
-        inventory_item = InventoryItem.find(inventory_item_id)
+        inventory_item = InventoryItem.find_serialized(
+            inventory_item_id,
+            use_cache=not request.cache_control.no_cache,
+            fields=field_names(args),
+        )
         if not inventory_item:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 "Inventory item with id '{}' was not found.".format(inventory_item_id),
             )
-        app.logger.info("Found item %s", inventory_item.serialize())
-        return inventory_item.serialize(), status.HTTP_200_OK
+        log_payload("Found item %s", inventory_item)
+        return etag_response(inventory_item)
 
     # ---------------------------------------------------------------------
     # UPDATE AN EXISTING INVENTORY ITEM
@@ -161,8 +484,10 @@ class InventoryItemResource(Resource):
     @api.doc("update_inventory_items")
     @api.response(404, "Inventory Item not found")
     @api.response(400, "The posted Inventory Item data was not valid")
+    @api.response(412, "Inventory Item changed since the If-Match ETag")
+    @api.response(200, "Success", inventory_item_model)
     @api.expect(inventory_item_model)
-    @api.marshal_with(inventory_item_model)
+    @query_budget(2)
     def put(self, inventory_item_id):
         """
         Update an inventory item
@@ -177,22 +502,23 @@ class InventoryItemResource(Resource):
             raise NotFound(
                 "Inventory item with id '{}' was not found.".format(inventory_item_id)
             )
+        check_if_match(inventory_item.serialize())
 
         data = request.get_json()
-        app.logger.info(data)
+        log_payload("Payload = %s", data)
         inventory_item.deserialize(data)
-        inventory_item.id = inventory_item_id
         inventory_item.update()
         app.logger.info(
             "Inventory item with id [%s] was updated successfully.", inventory_item.id
         )
-        return make_response(jsonify(inventory_item.serialize()), status.HTTP_200_OK)
+        return etag_response(inventory_item.serialize())
 
     # ---------------------------------------------------------------------
     # DELETE AN EXISTING INVENTORY ITEM
     # ---------------------------------------------------------------------
     @api.doc("delete_inventory_items")
     @api.response(204, "Inventorty item deleted")
+    @query_budget(1)
     def delete(self, inventory_item_id):
         """
         Delete an Inventory Item
@@ -201,9 +527,7 @@ class InventoryItemResource(Resource):
         app.logger.info(
             "Request to Delete an Inventory item with id [%s]", inventory_item_id
         )
-        inventory_item = InventoryItem.find(inventory_item_id)
-        if inventory_item:
-            inventory_item.delete()
+        if InventoryItem.delete_by_id(inventory_item_id):
             app.logger.info(
                 "Inventory item with id [%s] was deleted", inventory_item_id
             )
@@ -222,44 +546,77 @@ class InventoryItemCollection(Resource):
     ######################################################################
     @api.doc("list_inventory_items")
     @api.expect(inventory_item_args, validate=True)
-    @api.marshal_list_with(inventory_item_model)
+    @api.response(304, "List not modified since the If-None-Match ETag")
+    @api.response(200, "Success", [inventory_item_model])
+    @api.produces([JSON, NDJSON])
+    @query_budget(2)
     def get(self):
-        """Returns all of the InventoryItem objects"""
-        app.logger.info(
-            "Request for inventory list %s", inventory_item_args.parse_args()
-        )
-        inventory_items = []
+        """Returns all of the InventoryItem objects
+
+        Send ``Accept: application/x-ndjson`` or ``?stream=true`` to stream
+        every matching item instead of building the whole list in memory,
+        and ``?fields=sku,count`` to only read and return some of the fields.
+        """
         args = inventory_item_args.parse_args()
+        app.logger.info("Request for inventory list %s", args)
 
-        # If a user provides a SKU query parameter, filter by that
-        if args["sku"]:
-            app.logger.info("Filtering by category: %s", args["sku"])
-            inventory_items = InventoryItem.find_by_sku(args["sku"])
+        # Every filter the client sent is ANDed into one query, and the rows
+        # it returns are encoded straight to JSON without the ORM
+        media_type = request.accept_mimetypes.best_match([JSON, NDJSON], default=JSON)
+        if media_type == NDJSON or args["stream"]:
+            app.logger.info("Streaming inventory items as %s", media_type)
+            return stream_response(args, media_type)
 
-        # If a user provides a condition parameter, filter by that
-        elif args["condition"]:
-            app.logger.info("Filtering by condition: %s", args["condition"])
-            try:
-                inventory_items = InventoryItem.find_by_condition(
-                    getattr(Condition, args["condition"])
+        # Writes by this worker move the table generation on at once. Those
+        # of other workers are caught when an entry's TTL runs out: it is
+        # kept if the database's count of writes has not moved since
+        cache_key = (
+            table_generation.value,
+            tuple(
+                sorted(
+                    (name, value) for name, value in args.items() if value is not None
                 )
-            except AttributeError as error:
-                raise DataValidationError(f"Invalid condition: {args['condition']}")
-
-        # If a user provies an in-stock paramter, filter by that
-        # This is a boolean value, so we need to explictly evaluate it it's not
-        # None
-        elif args["in_stock"] is not None:
-            app.logger.info("Filtering by in stock: %s", args["in_stock"])
-            inventory_items = InventoryItem.find_by_in_stock(args["in_stock"])
-
-        else:
-            app.logger.info("Returning unfiltered list.")
-            inventory_items = InventoryItem.all()
-
-        results = [item.serialize() for item in inventory_items]
-        app.logger.info("Returning %d inventory items", len(results))
-        return results, status.HTTP_200_OK
+            ),
+        )
+        write_count = None
+
+        def unchanged(entry) -> bool:
+            nonlocal write_count
+            write_count = InventorySummary.write_count()
+            return entry[0] == write_count
+
+        cached = list_cache.get(cache_key, revalidate=unchanged)
+        if cached is not None:
+            app.logger.info("Returning cached inventory list")
+            _, body, headers, count = cached
+            LIST_ROWS.observe(count)
+            return Response(body, headers=headers).make_conditional(request)
+        # Read the count before the query, so a write that commits while the
+        # list is being built makes this entry stale instead of wrong
+        if list_cache.maxsize > 0 and write_count is None:
+            write_count = InventorySummary.write_count()
+
+        limit = args["limit"]
+        if limit is not None:
+            limit = min(limit, app.config["MAX_PAGE_LIMIT"])
+        # Only the fields the client asked for are selected and encoded
+        names = InventoryItem.projection(field_names(args))
+        rows, next_cursor = InventoryItem.select_rows(
+            args, limit, args["cursor"], names
+        )
+        app.logger.info("Returning %d inventory items", len(rows))
+        LIST_ROWS.observe(len(rows))
+        response = Response(
+            row_encoder.project(names).encode_list(rows),
+            mimetype=JSON,
+            headers=next_page_headers(next_cursor),
+        )
+        response.add_etag(weak=True)
+        if list_cache.maxsize > 0:
+            body = response.get_data()
+            entry = (write_count, body, list(response.headers), len(rows))
+            list_cache.set(cache_key, entry, len(body))
+        return response.make_conditional(request)
 
     # ---------------------------------------------------------------------
     # ADD A NEW INVENTORY ITEM
@@ -268,6 +625,7 @@ class InventoryItemCollection(Resource):
     @api.response(400, "The posted data was not valid")
     @api.expect(create_model)
     @api.marshal_with(inventory_item_model, code=201)
+    @query_budget(1)
     def post(self):
         """
         Creates an Inventory item
@@ -275,7 +633,7 @@ class InventoryItemCollection(Resource):
         """
         app.logger.info("Request to create an inventory item")
         inventory_item = InventoryItem()
-        app.logger.info("Payload = %s", api.payload)
+        log_payload("Payload = %s", api.payload)
         inventory_item.deserialize(api.payload)
         inventory_item.create()
         message = inventory_item.serialize()
@@ -284,14 +642,259 @@ class InventoryItemCollection(Resource):
         )
         app.logger.info("Inventory item with ID [%s] created.", inventory_item.id)
         return (
-            inventory_item.serialize(),
+            message,
             status.HTTP_201_CREATED,
             {"Location": location_url},
         )
 
+    # ---------------------------------------------------------------------
+    # DELETE EVERY MATCHING INVENTORY ITEM
+    # ---------------------------------------------------------------------
+    @api.doc("delete_inventory_items_by_filter")
+    @api.expect(inventory_delete_args, validate=True)
+    @api.response(200, "The number of Inventory items deleted")
+    @api.response(400, "An unknown argument, or no filter and no all=true")
+    def delete(self):
+        """
+        Deletes every Inventory item that matches the filters
+        This endpoint takes the same filters as the list endpoint and deletes
+        the matching items in chunks. Unknown arguments are rejected, so a
+        misspelt filter cannot widen the delete, and deleting every item
+        takes an explicit ``?all=true``.
+        """
+        args = inventory_delete_args.parse_args(strict=True)
+        # Empty filters such as ?sku= are ignored by the query, so they do
+        # not count as filters here either
+        if not InventoryItem.filter_criteria(args) and not args["all"]:
+            raise DataValidationError(
+                "Give at least one filter, or all=true to delete every item"
+            )
+        app.logger.info("Request to delete inventory items matching %s", args)
+        deleted = InventoryItem.delete_by_filters(
+            args, app.config["BULK_DELETE_CHUNK_SIZE"]
+        )
+        app.logger.info("Deleted %d inventory items", deleted)
+        return {"deleted": deleted}, status.HTTP_200_OK
+
     # TODO: Refactor the LIST ALL endpoint as a method of this class
 
 
+######################################################################
+#  PATH: /inventories/search
+######################################################################
+@api.route("/inventories/search")
+class SearchResource(Resource):
+    """Finds items by part of their SKU"""
+
+    @api.doc("search_inventory_items")
+    @api.expect(search_args, validate=True)
+    @api.response(200, "Success", [inventory_item_model])
+    @query_budget(1)
+    def get(self):
+        """
+        Returns the items whose SKU matches the search, best match first
+
+        ``match=prefix`` returns the SKUs that start with ``sku`` in SKU order.
+        ``match=fuzzy`` returns the SKUs that contain ``sku`` or, on Postgres,
+        are close to it, nearest first. The other list filters narrow the
+        search down, and at most ``limit`` items are returned.
+        """
+        args = search_args.parse_args()
+        app.logger.info("Request to search inventory items %s", args)
+        filters = {name: value for name, value in args.items() if name != "sku"}
+        rows = InventoryItem.search_rows(
+            args["sku"],
+            args["match"],
+            filters,
+            min(args["limit"], app.config["MAX_PAGE_LIMIT"]),
+        )
+        app.logger.info("Returning %d inventory items", len(rows))
+        return Response(row_encoder.encode_list(rows), mimetype=JSON)
+
+
+######################################################################
+#  PATH: /inventories/restock
+######################################################################
+@api.route("/inventories/restock")
+class RestockResource(Resource):
+    """The items that are due a restock order"""
+
+    @api.doc("restock_report")
+    @api.expect(restock_args, validate=True)
+    @api.response(200, "Success", [restock_group_model])
+    @api.produces([JSON, CSV])
+    @query_budget(1)
+    def get(self):
+        """
+        Returns the items at or under their restock level, by condition
+
+        Each item comes with the quantity to order, its restock amount. Pages
+        are ordered by condition and id; the ``Link`` and ``X-Next-Cursor``
+        headers point at the next one. Send ``Accept: text/csv`` to download
+        every item of the report as one streamed CSV file instead.
+        """
+        args = restock_args.parse_args()
+        app.logger.info("Request for the restock report %s", args)
+        if request.accept_mimetypes.best_match([JSON, CSV], default=JSON) == CSV:
+            return restock_csv_response(args["condition"])
+
+        limit = min(
+            args["limit"] or app.config["MAX_PAGE_LIMIT"], app.config["MAX_PAGE_LIMIT"]
+        )
+        rows, next_cursor = InventoryItem.restock_rows(
+            args["condition"], limit, args["cursor"]
+        )
+        app.logger.info("Returning %d items to restock", len(rows))
+        return Response(
+            restock_encoder.encode_groups(rows, "condition"),
+            mimetype=JSON,
+            headers=next_page_headers(next_cursor),
+        )
+
+
+######################################################################
+#  PATH: /inventories/summary
+######################################################################
+@api.route("/inventories/summary")
+class SummaryResource(Resource):
+    """Totals of the inventory, read from the summary table"""
+
+    @api.doc("inventory_summary")
+    @api.response(200, "Success", summary_model)
+    @query_budget(1)
+    def get(self):
+        """
+        Returns the number of items and units by condition and in_stock
+
+        The totals are kept up to date by every write, so this never scans
+        the inventory items.
+        """
+        app.logger.info("Request for the inventory summary")
+        return json_response(InventorySummary.totals())
+
+
+@api.route("/inventories/summary/skus")
+class SkuSummaryResource(Resource):
+    """Totals of the inventory by SKU, read from the summary table"""
+
+    @api.doc("inventory_summary_by_sku")
+    @api.expect(page_args, validate=True)
+    @api.response(200, "Success", [sku_totals_model])
+    @query_budget(1)
+    def get(self):
+        """
+        Returns the number of items and units of each SKU, in SKU order
+
+        The ``Link`` and ``X-Next-Cursor`` headers point at the next page.
+        """
+        args = page_args.parse_args()
+        app.logger.info("Request for the inventory summary by SKU %s", args)
+        limit = min(
+            args["limit"] or app.config["MAX_PAGE_LIMIT"], app.config["MAX_PAGE_LIMIT"]
+        )
+        rows, next_cursor = InventorySummary.sku_rows(limit, args["cursor"])
+        return Response(
+            sku_totals_encoder.encode_list(rows),
+            mimetype=JSON,
+            headers=next_page_headers(next_cursor),
+        )
+
+
+######################################################################
+#  PATH: /inventories/bulk
+######################################################################
+@api.route("/inventories/bulk")
+class BulkInventoryItemResource(Resource):
+    """Handles batches of InventoryItems in a single request"""
+
+    # ---------------------------------------------------------------------
+    # ADD MANY NEW INVENTORY ITEMS
+    # ---------------------------------------------------------------------
+    @api.doc("bulk_create_inventory_items")
+    @api.response(201, "Every Inventory item was created")
+    @api.response(200, "Some Inventory items were not valid, see each result")
+    @api.response(400, "The posted body was not a JSON array or NDJSON")
+    @api.expect([create_model])
+    def post(self):
+        """
+        Creates many Inventory items
+        This endpoint accepts a JSON array or NDJSON (one item per line). Every
+        record is validated on its own and the valid ones are created together.
+        """
+        app.logger.info("Request to create inventory items in bulk")
+        records = read_records()
+        results = []
+        inventory_items = []
+        for index, record in enumerate(records):
+            try:
+                inventory_items.append((index, InventoryItem().deserialize(record)))
+            except DataValidationError as error:
+                results.append(
+                    {
+                        "index": index,
+                        "status": status.HTTP_400_BAD_REQUEST,
+                        "error": str(error),
+                    }
+                )
+
+        InventoryItem.create_many(
+            [item for _, item in inventory_items], app.config["BULK_CHUNK_SIZE"]
+        )
+        results.extend(
+            {
+                "index": index,
+                "status": status.HTTP_201_CREATED,
+                "item": item.serialize(),
+            }
+            for index, item in inventory_items
+        )
+        results.sort(key=lambda result: result["index"])
+        app.logger.info(
+            "Created %d of %d inventory items", len(inventory_items), len(records)
+        )
+        return (
+            {
+                "created": len(inventory_items),
+                "failed": len(records) - len(inventory_items),
+                "results": results,
+            },
+            status.HTTP_201_CREATED
+            if len(inventory_items) == len(records)
+            else status.HTTP_200_OK,
+        )
+
+    # ---------------------------------------------------------------------
+    # UPDATE MANY EXISTING INVENTORY ITEMS
+    # ---------------------------------------------------------------------
+    @api.doc("bulk_update_inventory_items")
+    @api.response(404, "Some of the Inventory items were not found")
+    @api.response(400, "The posted changes were not valid")
+    @api.expect([patch_model])
+    @api.marshal_list_with(inventory_item_model)
+    def patch(self):
+        """
+        Updates some fields of many Inventory items
+        This endpoint takes a JSON array of objects that each hold the id of an
+        item and only the fields to change. The changes are applied together
+        or not at all.
+        """
+        app.logger.info("Request to update inventory items in bulk")
+        check_content_type(JSON)
+        changes = request.get_json(silent=True)
+        if not isinstance(changes, list):
+            raise DataValidationError("Request body must be a JSON array of changes")
+        results, missing = InventoryItem.update_many(
+            changes, app.config["BULK_CHUNK_SIZE"]
+        )
+        if missing:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                "Inventory items with ids {} were not found.".format(missing),
+            )
+        app.logger.info("Updated %d inventory items", len(results))
+        return results, status.HTTP_200_OK
+
+
 ######################################################################
 # MARK AN ITEM AS IN-STOCK
 ######################################################################
@@ -302,6 +905,8 @@ class InStockResource(Resource):
 
     @api.doc("in-stock")
     @api.response(404, "Item not found")
+    @api.response(412, "Item changed since the If-Match ETag")
+    @query_budget(2)
     def put(self, inventory_item_id):
         """
         Update status of an item to in-stock
@@ -315,10 +920,67 @@ class InStockResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 "Item with id [{}] was not found.".format(inventory_item_id),
             )
+        check_if_match(inventory_item.serialize())
         inventory_item.in_stock = True
         inventory_item.update()
         app.logger.info("Item with id [%s] is in-stock!!", inventory_item.id)
-        return inventory_item.serialize(), status.HTTP_200_OK
+        return etag_response(inventory_item.serialize())
+
+
+######################################################################
+# ADJUST THE COUNT OF AN ITEM
+######################################################################
+@api.route("/inventories/<int:inventory_item_id>/adjust")
+@api.param("inventory_item_id", "The Item identifier")
+class AdjustResource(Resource):
+    """Atomic changes to the count of an item"""
+
+    @api.doc("adjust")
+    @api.response(404, "Item not found")
+    @api.response(409, "The change would make the count negative")
+    @api.response(400, "The posted adjustment was not valid")
+    @api.response(200, "Success", inventory_item_model)
+    @api.expect(adjust_model)
+    @query_budget(2)
+    def post(self, inventory_item_id):
+        """
+        Adjust the count of an item
+
+        This endpoint adds delta to the count of an item in a single statement,
+        so concurrent adjustments are never lost
+        """
+        app.logger.info("Request to adjust the count of item %s", inventory_item_id)
+        check_content_type(JSON)
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or "delta" not in data:
+            raise DataValidationError("Invalid adjustment: missing delta")
+        # Only JSON integers and booleans, so "false" or 2.9 are not coerced
+        delta = data["delta"]
+        if not isinstance(delta, int) or isinstance(delta, bool):
+            raise DataValidationError("Invalid adjustment: delta must be an integer")
+        allow_negative = data.get("allow_negative", False)
+        if not isinstance(allow_negative, bool):
+            raise DataValidationError(
+                "Invalid adjustment: allow_negative must be true or false"
+            )
+
+        inventory_item = InventoryItem.adjust_count(
+            inventory_item_id, delta, allow_negative
+        )
+        if inventory_item:
+            app.logger.info("Item with id [%s] was adjusted", inventory_item_id)
+            return json_response(inventory_item)
+        if not InventoryItem.find(inventory_item_id):
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                "Item with id [{}] was not found.".format(inventory_item_id),
+            )
+        abort(
+            status.HTTP_409_CONFLICT,
+            "Adjusting item [{}] by {} would make its count negative.".format(
+                inventory_item_id, delta
+            ),
+        )
 
 
 ######################################################################
@@ -326,6 +988,152 @@ class InStockResource(Resource):
 ######################################################################
 
 
+def next_page_headers(next_cursor):
+    """Returns the Link and X-Next-Cursor headers that point at the next page"""
+    if not next_cursor:
+        return {}
+    query_args = request.args.to_dict()
+    query_args["cursor"] = next_cursor
+    next_url = "{}?{}".format(request.base_url, urlencode(query_args))
+    return {"Link": '<{}>; rel="next"'.format(next_url), "X-Next-Cursor": next_cursor}
+
+
+def stream_response(filters, media_type):
+    """Streams the items matched by filters as NDJSON or as a chunked JSON array"""
+    names = InventoryItem.projection(field_names(filters))
+    rows = count_rows(
+        InventoryItem.stream_rows(filters, app.config["STREAM_BATCH_SIZE"], names)
+    )
+    encode_row = row_encoder.project(names).encode_row
+
+    def generate_ndjson():
+        for row in rows:
+            yield encode_row(row) + "\n"
+
+    def generate_json_array():
+        separator = "["
+        for row in rows:
+            yield separator + encode_row(row)
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+    generate = generate_ndjson if media_type == NDJSON else generate_json_array
+    return Response(stream_with_context(generate()), mimetype=media_type)
+
+
+def field_names(args):
+    """Returns the names in the fields query argument, or None if it is unset"""
+    if not args.get("fields"):
+        return None
+    return args["fields"].split(",")
+
+
+def restock_csv_response(condition):
+    """Streams every row of the restock report as a CSV file"""
+    rows = InventoryItem.stream_restock_rows(condition, app.config["STREAM_BATCH_SIZE"])
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(InventoryItem.RESTOCK_FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=CSV,
+        headers={"Content-Disposition": "attachment; filename=restock.csv"},
+    )
+
+
+def count_rows(rows):
+    """Yields rows and records how many there were once they run out"""
+    count = 0
+    for count, row in enumerate(rows, 1):
+        yield row
+    LIST_ROWS.observe(count)
+
+
+def read_records():
+    """Reads the records of a bulk request from a JSON array or an NDJSON body
+
+    A line of NDJSON that cannot be parsed is returned as None, which fails
+    validation on its own without stopping the other lines.
+    """
+    content_type = request.headers.get("Content-Type")
+    if content_type == NDJSON:
+        records = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+        return records
+    check_content_type(JSON)
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        raise DataValidationError("Request body must be a JSON array of items")
+    return records
+
+
+def item_etag(data):
+    """Returns the strong ETag of a serialized inventory item"""
+    return "{}-{}".format(data["id"], data["version"])
+
+
+def json_response(data, etag=None, code=status.HTTP_200_OK, headers=None):
+    """Returns data as a JSON response with an ETag
+
+    Single items get a strong ETag made from their id and version, anything
+    else gets a weak ETag made from a hash of the body.
+    """
+    response = api.make_response(data, code, headers or {})
+    if etag is None and isinstance(data, dict) and "version" in data:
+        etag = item_etag(data)
+    if etag:
+        response.set_etag(etag)
+    else:
+        response.add_etag(weak=True)
+    return response
+
+
+def etag_response(data, etag=None, code=status.HTTP_200_OK, headers=None):
+    """Returns data as a JSON response with an ETag, or 304 if the client has it
+
+    A GET whose If-None-Match holds the same ETag gets an empty 304 instead.
+    """
+    return json_response(data, etag, code, headers).make_conditional(request)
+
+
+def check_if_match(data):
+    """Aborts with 412 if If-Match was sent and does not match the item"""
+    if request.if_match and not request.if_match.contains(item_etag(data)):
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "Inventory item {} has changed, fetch it and retry".format(data["id"]),
+        )
+
+
+def log_payload(message, *args):
+    """Logs a request or response payload for a sample of this route's requests
+
+    The payload is passed as a log argument, so it is only rendered if the
+    record is written, and then on the logging thread.
+    """
+    if not app.logger.isEnabledFor(logging.INFO):
+        return
+    route = "{} {}".format(request.method, request.url_rule)
+    if payload_sampler.sample(route):
+        app.logger.info(message, *args)
+
+
 def check_content_type(media_type):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
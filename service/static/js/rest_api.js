@@ -217,11 +217,18 @@ $(function () {
         var restock_level = $("#inventory_item_restock_level").val();
         var restock_amount = $("#inventory_item_restock_amount").val();
         var in_stock = $("#inventory_item_in_stock").val();
+        var sku_match = $("#inventory_item_sku_match").val();
 
         var queryString = ""
+        var url = "/api/inventories?"
 
         if (sku) {
-            queryString += 'sku=' + sku
+            queryString += 'sku=' + encodeURIComponent(sku)
+            // Partial SKUs are looked up by the search endpoint
+            if (sku_match != "exact") {
+                queryString += '&match=' + sku_match
+                url = "/api/inventories/search?"
+            }
         }
         
         if (count) {
@@ -266,7 +273,7 @@ $(function () {
 
         var ajax = $.ajax({
             type: "GET",
-            url: "/api/inventories?" + queryString,
+            url: url + queryString,
             data: ''
         })
 
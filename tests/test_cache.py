@@ -0,0 +1,122 @@
+"""
+Test cases for the in-process caches
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import unittest
+from unittest.mock import patch
+
+from service.cache import GenerationCounter, LRUCache
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """Test Cases for LRUCache"""
+
+    def test_get_and_set(self):
+        """Ensure values are returned and counted as hits and misses"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_evicts_least_recently_used(self):
+        """Ensure the least recently used entry is evicted when full"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    @patch("service.cache.time.monotonic")
+    def test_expires_after_ttl(self, monotonic_mock):
+        """Ensure an entry is missed once its TTL has passed"""
+        monotonic_mock.return_value = 100.0
+        cache = LRUCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        monotonic_mock.return_value = 109.0
+        self.assertEqual(cache.get("a"), 1)
+        monotonic_mock.return_value = 111.0
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_invalidate_and_clear(self):
+        """Ensure entries can be removed one at a time or all at once"""
+        cache = LRUCache(maxsize=4, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.invalidate("a")
+        cache.invalidate("missing")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+        cache.clear()
+        self.assertIsNone(cache.get("b"))
+
+    @patch("service.cache.time.monotonic")
+    def test_revalidate(self, monotonic_mock):
+        """Ensure an expired entry is kept only if revalidate accepts it"""
+        monotonic_mock.return_value = 100.0
+        cache = LRUCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        checked = []
+        self.assertEqual(cache.get("a", checked.append), 1)
+        self.assertEqual(checked, [])  # not expired, not checked
+        monotonic_mock.return_value = 111.0
+        self.assertEqual(cache.get("a", lambda value: value == 1), 1)
+        monotonic_mock.return_value = 120.0
+        self.assertEqual(cache.get("a"), 1)  # the TTL started again
+        monotonic_mock.return_value = 122.0
+        self.assertIsNone(cache.get("a", lambda value: False))
+        self.assertEqual(cache.stats()["size"], 0)
+        self.assertEqual(cache.stats()["revalidations"], 1)
+
+    def test_maxbytes(self):
+        """Ensure the cache keeps the total size under maxbytes"""
+        cache = LRUCache(maxsize=10, ttl=60, maxbytes=100)
+        cache.set("a", "a", 40)
+        cache.set("b", "b", 40)
+        cache.set("a", "a", 50)  # replacing an entry frees its old size
+        self.assertEqual(cache.stats()["bytes"], 90)
+        cache.set("c", "c", 30)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "a")
+        self.assertEqual(cache.stats()["bytes"], 80)
+        # A value larger than the whole cache is never stored
+        cache.set("d", "d", 101)
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(cache.get("c"), "c")
+        cache.invalidate("c")
+        self.assertEqual(cache.stats()["bytes"], 50)
+        cache.clear()
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_disabled(self):
+        """Ensure a cache with no size never stores anything"""
+        cache = LRUCache(maxsize=0, ttl=60)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+
+######################################################################
+#  G E N E R A T I O N   C O U N T E R   T E S T   C A S E S
+######################################################################
+class TestGenerationCounter(unittest.TestCase):
+    """Test Cases for GenerationCounter"""
+
+    def test_bump(self):
+        """Ensure every bump moves on to a new generation"""
+        generation = GenerationCounter()
+        self.assertEqual(generation.value, 0)
+        self.assertEqual(generation.bump(), 1)
+        self.assertEqual(generation.bump(), 2)
+        self.assertEqual(generation.value, 2)
@@ -0,0 +1,75 @@
+"""
+Test cases for the row encoders
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import json
+import unittest
+
+from service.encoders import RowEncoder
+
+
+######################################################################
+#  R O W   E N C O D E R   T E S T   C A S E S
+######################################################################
+class TestRowEncoder(unittest.TestCase):
+    """Test Cases for RowEncoder"""
+
+    def setUp(self):
+        self.encoder = RowEncoder({"id": int, "name": str, "active": bool})
+
+    def test_encode_row(self):
+        """Ensure a row is encoded as the JSON object json.dumps would make"""
+        row = (1, "widget", True)
+        encoded = self.encoder.encode_row(row)
+        self.assertEqual(encoded, '{"id":1,"name":"widget","active":true}')
+        self.assertEqual(
+            json.loads(encoded), {"id": 1, "name": "widget", "active": True}
+        )
+
+    def test_encode_row_escapes_strings(self):
+        """Ensure quotes, control characters and non-ASCII text are escaped"""
+        name = 'say "hi"\né\U0001f600'
+        encoded = self.encoder.encode_row((2, name, False))
+        self.assertEqual(json.loads(encoded)["name"], name)
+        self.assertTrue(encoded.isascii())
+        self.assertIn('"active":false', encoded)
+
+    def test_encode_list(self):
+        """Ensure rows are encoded as a JSON array of bytes"""
+        self.assertEqual(self.encoder.encode_list([]), b"[]")
+        rows = [(1, "a", True), (2, "b", False)]
+        self.assertEqual(
+            json.loads(self.encoder.encode_list(rows)),
+            [
+                {"id": 1, "name": "a", "active": True},
+                {"id": 2, "name": "b", "active": False},
+            ],
+        )
+
+    def test_project(self):
+        """Ensure a projection encodes only its fields and is compiled once"""
+        projected = self.encoder.project(["id", "active"])
+        self.assertEqual(projected.encode_row((1, False)), '{"id":1,"active":false}')
+        self.assertIs(self.encoder.project(("id", "active")), projected)
+        self.assertIs(self.encoder.project(["id", "name", "active"]), self.encoder)
+
+    def test_encode_groups(self):
+        """Ensure rows are grouped by their leading column"""
+        self.assertEqual(self.encoder.encode_groups([], "kind"), b"[]")
+        rows = [("x", 1, "a", True), ("x", 2, "b", False), ("y", 3, "c", True)]
+        self.assertEqual(
+            json.loads(self.encoder.encode_groups(rows, "kind")),
+            [
+                {
+                    "kind": "x",
+                    "items": [
+                        {"id": 1, "name": "a", "active": True},
+                        {"id": 2, "name": "b", "active": False},
+                    ],
+                },
+                {"kind": "y", "items": [{"id": 3, "name": "c", "active": True}]},
+            ],
+        )
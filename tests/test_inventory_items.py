@@ -11,10 +11,26 @@ While debugging just these tests it's convinient to use this:
 import os
 import logging
 import unittest
+from unittest.mock import patch
+
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql
+
+from service.models import (
+    InventoryItem,
+    InventorySummary,
+    InventorySummaryDelta,
+    Condition,
+    DataValidationError,
+    db,
+    drop_unused_indexes,
+    escape_like,
+    item_cache,
+    prefix_upper_bound,
+    upgrade_db,
+)
 
-from service.models import InventoryItem, Condition, DataValidationError, db
-
-from service import app
+from service import create_app
 from .factories import InventoryItemFactory
 
 DATABASE_URI = os.getenv(
@@ -30,21 +46,24 @@ class TestInventoryItemModel(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """This runs once before the entire test suite"""
-        app.config["TESTING"] = True
-        app.config["DEBUG"] = False
-        app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
-        app.logger.setLevel(logging.CRITICAL)
-        InventoryItem.init_db(app)
+        cls.flask_app = create_app(
+            {"TESTING": True, "DEBUG": False, "SQLALCHEMY_DATABASE_URI": DATABASE_URI}
+        )
+        cls.flask_app.logger.setLevel(logging.CRITICAL)
+        cls.context = cls.flask_app.app_context()
+        cls.context.push()
 
     @classmethod
     def tearDownClass(cls):
         """This runs once after the entire test suite"""
         db.session.close()
+        cls.context.pop()
 
     def setUp(self):
         """This runs before each test"""
         db.drop_all()  # clean up the last tests
         db.create_all()  # make our sqlalchemy tables
+        item_cache.clear()  # ids are reused once the tables are re-created
 
     def tearDown(self):
         """This runs after each test"""
@@ -153,6 +172,16 @@ class TestInventoryItemModel(unittest.TestCase):
         with self.assertRaises(DataValidationError):
             item.deserialize(data)
 
+    def test_deserialize_bad_sku(self):
+        """Ensure a SKU the table cannot hold fails validation"""
+        data = InventoryItemFactory().serialize()
+        for sku in [None, 12345, "", "  ", "X" * 64]:
+            data["sku"] = sku
+            with self.assertRaises(DataValidationError):
+                InventoryItem().deserialize(data)
+        data["sku"] = "X" * 63
+        self.assertEqual(InventoryItem().deserialize(data).sku, "X" * 63)
+
     def test_repr(self):
         """Ensure string representation of an InventoryItem is correct"""
         item = InventoryItem()
@@ -200,6 +229,16 @@ class TestInventoryItemModel(unittest.TestCase):
         inventory_item.delete()
         self.assertEqual(len(InventoryItem.all()), 0)
 
+    def test_delete_by_id(self):
+        """Delete an item by id with a single DELETE"""
+        inventory_item = InventoryItemFactory()
+        inventory_item.create()
+        inventory_item_id = inventory_item.id
+        self.assertTrue(InventoryItem.delete_by_id(inventory_item_id))
+        self.assertEqual(len(InventoryItem.all()), 0)
+        self.assertFalse(InventoryItem.delete_by_id(inventory_item_id))
+        self.assertFalse(InventoryItem.delete_by_id("not-an-id"))
+
     def test_find_by_sku(self):
         """Ensure find_by_sku returns only items with a given sku"""
         InventoryItem(
@@ -274,3 +313,516 @@ class TestInventoryItemModel(unittest.TestCase):
         self.assertEqual(items[0].condition, Condition.New)
         self.assertEqual(items[0].restock_level, 1)
         self.assertEqual(items[0].restock_amount, 2)
+
+    def test_paginate(self):
+        """Ensure paginate walks every item exactly once with keyset cursors"""
+        for _ in range(5):
+            InventoryItemFactory().create()
+        seen = []
+        items, cursor = InventoryItem.paginate(limit=2)
+        seen.extend(item.id for item in items)
+        while cursor:
+            items, cursor = InventoryItem.paginate(limit=2, cursor=cursor)
+            self.assertLessEqual(len(items), 2)
+            seen.extend(item.id for item in items)
+        self.assertEqual(seen, sorted(item.id for item in InventoryItem.all()))
+
+    def test_paginate_filtered(self):
+        """Ensure paginate honors the query from a find_by_* method"""
+        for sku in ["foo", "bar", "foo", "foo"]:
+            item = InventoryItemFactory(sku=sku)
+            item.create()
+        items, cursor = InventoryItem.paginate(InventoryItem.find_by_sku("foo"), 2)
+        self.assertEqual([item.sku for item in items], ["foo", "foo"])
+        items, cursor = InventoryItem.paginate(
+            InventoryItem.find_by_sku("foo"), 2, cursor
+        )
+        self.assertEqual([item.sku for item in items], ["foo"])
+        self.assertIsNone(cursor)
+
+    def test_paginate_bad_cursor(self):
+        """Ensure a cursor that was not made by the service is rejected"""
+        self.assertRaises(
+            DataValidationError, InventoryItem.paginate, None, 2, "not-a-cursor"
+        )
+        self.assertRaises(DataValidationError, InventoryItem.paginate, None, 0)
+
+    def test_stream(self):
+        """Ensure stream yields every serialized item in id order"""
+        for sku in ["foo", "bar", "foo"]:
+            InventoryItemFactory(sku=sku).create()
+        items = list(InventoryItem.stream(batch_size=2))
+        self.assertEqual(len(items), 3)
+        self.assertEqual([item["id"] for item in items], [1, 2, 3])
+        items = list(InventoryItem.stream(InventoryItem.find_by_sku("bar")))
+        self.assertEqual([item["sku"] for item in items], ["bar"])
+
+    def test_select_rows(self):
+        """Ensure select_rows pages through filtered rows without the ORM"""
+        for sku in ["foo", "bar", "foo", "foo"]:
+            InventoryItemFactory(sku=sku).create()
+        rows, cursor = InventoryItem.select_rows({"sku": "foo"}, 2)
+        self.assertEqual(len(rows), 2)
+        expected = InventoryItem.find(rows[0][0]).serialize()
+        self.assertEqual(dict(zip(InventoryItem.ROW_FIELDS, rows[0])), expected)
+        rows, cursor = InventoryItem.select_rows({"sku": "foo"}, 2, cursor)
+        self.assertEqual([row[1] for row in rows], ["foo"])
+        self.assertIsNone(cursor)
+        self.assertRaises(
+            DataValidationError, InventoryItem.select_rows, {"condition": "Bad"}
+        )
+
+    def test_select_rows_projection(self):
+        """Ensure select_rows and stream_rows only read the fields asked for"""
+        for sku in ["foo", "bar", "foo"]:
+            InventoryItemFactory(sku=sku, count=4).create()
+        self.assertEqual(
+            InventoryItem.projection(["count", " sku", ""]), ("id", "sku", "count")
+        )
+        self.assertEqual(
+            InventoryItem.projection(None), tuple(InventoryItem.ROW_FIELDS)
+        )
+        self.assertRaises(DataValidationError, InventoryItem.projection, ["bad"])
+        statement = InventoryItem.page_statement(fields=["count"])
+        self.assertEqual([column.name for column in statement.columns], ["id", "count"])
+        rows, cursor = InventoryItem.select_rows({"sku": "foo"}, 1, None, ["count"])
+        self.assertEqual(rows, [(1, 4)])
+        rows, cursor = InventoryItem.select_rows({"sku": "foo"}, 1, cursor, ["count"])
+        self.assertEqual(rows, [(3, 4)])
+        rows = list(InventoryItem.stream_rows(fields=["sku"]))
+        self.assertEqual(rows, [(1, "foo"), (2, "bar"), (3, "foo")])
+
+    def test_stream_rows(self):
+        """Ensure stream_rows yields every row in id order"""
+        for sku in ["foo", "bar", "foo"]:
+            InventoryItemFactory(sku=sku).create()
+        rows = list(InventoryItem.stream_rows(batch_size=2))
+        self.assertEqual([row[0] for row in rows], [1, 2, 3])
+        rows = list(InventoryItem.stream_rows({"sku": "bar"}))
+        self.assertEqual([row[1] for row in rows], ["bar"])
+        # Bad filters raise before the first row is asked for
+        self.assertRaises(
+            DataValidationError, InventoryItem.stream_rows, {"condition": "Bad"}
+        )
+
+    def test_summary_follows_every_write(self):
+        """Ensure the summary triggers follow ORM, bulk and Core writes"""
+        first = InventoryItemFactory(
+            sku="A", count=3, condition=Condition.New, in_stock=True
+        )
+        first.create()
+        second = InventoryItemFactory(
+            sku="A", count=4, condition=Condition.Used, in_stock=False
+        )
+        second.create()
+        InventoryItem.create_many(
+            [
+                InventoryItemFactory(
+                    sku="B", count=5, condition=Condition.New, in_stock=False
+                )
+            ]
+        )
+        totals = InventorySummary.totals()
+        self.assertEqual(totals["total"], {"items": 3, "units": 12})
+        self.assertEqual(totals["in_stock"]["true"], {"items": 1, "units": 3})
+        self.assertEqual(totals["condition"]["Used"], {"items": 1, "units": 4})
+
+        first.sku = "C"
+        first.update()
+        InventoryItem.adjust_count(second.id, 2)
+        InventoryItem.update_many([{"id": second.id, "in_stock": True}])
+        InventoryItem.delete_by_filters({"sku": "B"})
+        self.assertEqual(
+            [tuple(row) for row in InventorySummary.sku_rows()[0]],
+            [("A", 1, 6), ("C", 1, 3)],
+        )
+
+        # The incremental totals match a recount from scratch
+        incremental = InventorySummary.totals()
+        InventorySummary.rebuild()
+        self.assertEqual(InventorySummary.totals(), incremental)
+        self.assertEqual(incremental["in_stock"]["true"], {"items": 2, "units": 9})
+        self.assertEqual(incremental["in_stock"]["false"], {"items": 0, "units": 0})
+
+    def test_summary_fold(self):
+        """Ensure folding the deltas into the summary keeps the totals"""
+        for sku, count in [("a", 1), ("b", 2), ("a", 3)]:
+            InventoryItemFactory(sku=sku, count=count, in_stock=True).create()
+        InventoryItem.delete_by_filters({"sku": "b"})
+        totals = InventorySummary.totals()
+        rows = [tuple(row) for row in InventorySummary.sku_rows()[0]]
+        writes = InventorySummary.write_count()
+        self.assertEqual(writes, 4)
+        self.assertGreater(InventorySummaryDelta.query.count(), 0)
+
+        InventorySummary.fold()
+        self.assertEqual(InventorySummaryDelta.query.count(), 0)
+        self.assertEqual(InventorySummary.totals(), totals)
+        self.assertEqual([tuple(row) for row in InventorySummary.sku_rows()[0]], rows)
+        self.assertEqual(InventorySummary.write_count(), writes)
+        # SKUs without items are dropped from the summary
+        self.assertIsNone(InventorySummary.query.get(("sku", "b")))
+
+        InventoryItemFactory(sku="b", count=5, in_stock=True).create()
+        self.assertEqual(InventorySummary.write_count(), writes + 1)
+        self.assertEqual(
+            InventorySummary.totals()["in_stock"]["true"], {"items": 3, "units": 9}
+        )
+
+    def test_summary_fold_if_due(self):
+        """Ensure each process folds the deltas once per fold interval"""
+        InventoryItemFactory(count=2).create()
+        interval = InventorySummary.fold_interval
+        InventorySummary.fold_interval = 60
+        try:
+            InventorySummary.next_fold = 0
+            self.assertTrue(InventorySummary.fold_if_due())
+            self.assertEqual(InventorySummaryDelta.query.count(), 0)
+            InventoryItemFactory(count=3).create()
+            self.assertFalse(InventorySummary.fold_if_due())
+            self.assertGreater(InventorySummaryDelta.query.count(), 0)
+            # Disabled with an interval of 0
+            InventorySummary.fold_interval = 0
+            InventorySummary.next_fold = 0
+            self.assertFalse(InventorySummary.fold_if_due())
+        finally:
+            InventorySummary.fold_interval = interval
+        self.assertEqual(InventorySummary.totals()["total"], {"items": 2, "units": 5})
+
+    def test_summary_counts_every_write(self):
+        """Ensure writes that change no summary row are counted too"""
+        item = InventoryItemFactory()
+        item.create()
+        writes = InventorySummary.write_count()
+        item.restock_level += 1
+        item.update()
+        self.assertEqual(InventorySummary.write_count(), writes + 1)
+        # Statements that change nothing are not counted
+        InventoryItem.delete_by_filters({"sku": "no such sku"})
+        self.assertEqual(InventorySummary.write_count(), writes + 1)
+
+    def test_summary_triggers_installed_once(self):
+        """Ensure the summary triggers are only replaced when they changed"""
+        with db.engine.connect() as connection:
+            self.assertFalse(InventorySummary.install_triggers(connection))
+            connection.execute("DROP TRIGGER inventory_summary_update")
+            self.assertTrue(InventorySummary.install_triggers(connection))
+            self.assertFalse(InventorySummary.install_triggers(connection))
+        item = InventoryItemFactory(count=1)
+        item.create()
+        InventoryItem.adjust_count(item.id, 2)
+        self.assertEqual(InventorySummary.totals()["total"]["units"], 3)
+
+    def test_summary_sku_rows(self):
+        """Ensure the SKU totals are paged through in SKU order"""
+        for sku in ["c", "a", "b", "a"]:
+            InventoryItemFactory(sku=sku, count=1).create()
+        rows, cursor = InventorySummary.sku_rows(limit=2)
+        self.assertEqual([tuple(row) for row in rows], [("a", 2, 2), ("b", 1, 1)])
+        rows, cursor = InventorySummary.sku_rows(limit=2, cursor=cursor)
+        self.assertEqual([row[0] for row in rows], ["c"])
+        self.assertIsNone(cursor)
+        self.assertRaises(DataValidationError, InventorySummary.sku_rows, limit=0)
+
+    def test_restock_rows(self):
+        """Ensure restock_rows pages through low stock items by condition and id"""
+        for count, condition in [
+            (1, Condition.Used),
+            (9, Condition.New),
+            (5, Condition.New),
+            (0, Condition.New),
+        ]:
+            InventoryItemFactory(
+                count=count, restock_level=5, restock_amount=20, condition=condition
+            ).create()
+        rows, cursor = InventoryItem.restock_rows(limit=2)
+        self.assertEqual(
+            [tuple(row) for row in rows],
+            [
+                ("New", 3, rows[0][2], 5, 5, 20),
+                ("New", 4, rows[1][2], 0, 5, 20),
+            ],
+        )
+        rows, cursor = InventoryItem.restock_rows(limit=2, cursor=cursor)
+        self.assertEqual([(row[0], row[1]) for row in rows], [("Used", 1)])
+        self.assertIsNone(cursor)
+        rows, _ = InventoryItem.restock_rows("Used")
+        self.assertEqual([row[1] for row in rows], [1])
+        self.assertEqual(len(list(InventoryItem.stream_restock_rows())), 3)
+        self.assertRaises(DataValidationError, InventoryItem.restock_rows, cursor="bad")
+
+    def test_restock_statement_uses_low_stock_index(self):
+        """Ensure the restock report reads the partial low stock index"""
+        if db.engine.dialect.name != "sqlite":
+            self.skipTest("reads the SQLite query plan")
+        # The planner picks it once the statistics show low stock is rare
+        InventoryItem.create_many(
+            [
+                InventoryItemFactory(count=1 if i % 50 == 0 else 50, restock_level=5)
+                for i in range(1000)
+            ]
+        )
+        db.session.execute("ANALYZE")
+        statement = InventoryItem.restock_statement("New").limit(10)
+        sql = str(statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+        plan = db.session.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+        self.assertIn("ix_inventory_item_low_stock", str(plan))
+
+    def test_search_rows_by_prefix(self):
+        """Ensure a prefix search returns the SKUs that start with it, in order"""
+        for sku in ["AB_1", "ABC", "ABX", "AC", "ab", "XABC"]:
+            InventoryItemFactory(sku=sku, condition=Condition.New).create()
+        rows = InventoryItem.search_rows("AB")
+        self.assertEqual([row[1] for row in rows], ["ABC", "ABX", "AB_1"])
+        self.assertEqual([row[1] for row in InventoryItem.search_rows("ABC")], ["ABC"])
+        self.assertEqual(len(InventoryItem.search_rows("AB", limit=2)), 2)
+        rows = InventoryItem.search_rows("AB", filters={"condition": "Used"})
+        self.assertEqual(rows, [])
+        self.assertRaises(DataValidationError, InventoryItem.search_rows, "")
+        self.assertRaises(DataValidationError, InventoryItem.search_rows, "A", "bad")
+        self.assertRaises(DataValidationError, InventoryItem.search_rows, "A", limit=0)
+
+    def test_search_rows_fuzzy(self):
+        """Ensure a fuzzy search finds SKUs that contain the text, best first"""
+        for sku in ["XX-WIDGET-99", "widget", "WIDGETS", "GADGET"]:
+            InventoryItemFactory(sku=sku).create()
+        skus = [row[1] for row in InventoryItem.search_rows("widget", "fuzzy")]
+        self.assertEqual(set(skus), {"widget", "WIDGETS", "XX-WIDGET-99"})
+        if db.engine.dialect.name == "sqlite":
+            # Earliest match first, then the shortest SKU
+            self.assertEqual(skus, ["widget", "WIDGETS", "XX-WIDGET-99"])
+        self.assertEqual(InventoryItem.search_rows("100%", "fuzzy"), [])
+
+    def test_search_helpers(self):
+        """Ensure LIKE patterns are escaped and prefixes bounded"""
+        self.assertEqual(escape_like("a_b%c\\"), "a\\_b\\%c\\\\")
+        self.assertEqual(prefix_upper_bound("AB"), "AC")
+        self.assertEqual(prefix_upper_bound("A\U0010ffff"), "B")
+        self.assertIsNone(prefix_upper_bound("\U0010ffff"))
+
+    def test_search_statement_uses_sku_index(self):
+        """Ensure a prefix search reads the SKU index instead of the table"""
+        if db.engine.dialect.name != "sqlite":
+            self.skipTest("reads the SQLite query plan")
+        statement = InventoryItem.search_statement("AB").limit(20)
+        sql = str(statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+        plan = str(db.session.execute("EXPLAIN QUERY PLAN " + sql).fetchall())
+        self.assertIn("ix_inventory_item_sku_id", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_search_statement_postgresql_collation(self):
+        """Ensure a Postgres prefix search compares and orders SKUs as bytes"""
+        statement = InventoryItem.search_statement("AB", dialect="postgresql")
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        self.assertIn('WHERE (inventory_item.sku COLLATE "C") >= ', sql)
+        self.assertIn('ORDER BY inventory_item.sku COLLATE "C", inventory_item.id', sql)
+
+    def test_upgrade_db(self):
+        """Ensure upgrade_db builds indexes that are missing from a live table"""
+        db.session.execute("DROP INDEX ix_inventory_item_low_stock")
+        db.session.commit()
+        self.assertEqual(upgrade_db(self.flask_app), ["ix_inventory_item_low_stock"])
+        self.assertEqual(upgrade_db(self.flask_app), [])
+
+    def test_drop_unused_indexes(self):
+        """Ensure indexes the models no longer define are dropped"""
+        db.session.execute("CREATE INDEX ix_inventory_item_sku ON inventory_item (sku)")
+        db.session.execute("CREATE INDEX by_hand ON inventory_item (count)")
+        db.session.commit()
+        self.assertEqual(drop_unused_indexes(self.flask_app), ["ix_inventory_item_sku"])
+        self.assertEqual(drop_unused_indexes(self.flask_app), [])
+        names = {
+            index["name"] for index in inspect(db.engine).get_indexes("inventory_item")
+        }
+        self.assertIn("by_hand", names)
+        self.assertIn("ix_inventory_item_sku_id", names)
+
+    def test_upgrade_db_creates_tables(self):
+        """Ensure upgrade_db creates the tables of an empty database"""
+        db.drop_all()
+        self.assertEqual(
+            upgrade_db(self.flask_app),
+            ["inventory_item", "inventory_summary", "inventory_summary_delta"],
+        )
+        self.assertEqual(upgrade_db(self.flask_app), [])
+
+    def test_upgrade_db_fills_new_summary(self):
+        """Ensure upgrade_db counts existing items into a new summary table"""
+        InventoryItemFactory(count=3).create()
+        InventorySummary.__table__.drop(db.engine)
+        self.assertEqual(upgrade_db(self.flask_app), ["inventory_summary"])
+        self.assertEqual(InventorySummary.totals()["total"], {"items": 1, "units": 3})
+
+    def test_upgrade_db_adds_columns(self):
+        """Ensure upgrade_db adds columns that are missing from a live table"""
+        InventoryItemFactory(id=None).create()
+        db.session.execute("ALTER TABLE inventory_item DROP COLUMN version")
+        db.session.commit()
+        self.assertEqual(upgrade_db(self.flask_app), ["inventory_item.version"])
+        self.assertEqual(InventoryItem.all()[0].version, 1)
+
+    def test_find_by_filters(self):
+        """Ensure find_by_filters ANDs every filter that is given"""
+        for sku, count, condition, in_stock in [
+            ("foo", 1, Condition.New, True),
+            ("foo", 5, Condition.New, True),
+            ("foo", 9, Condition.Used, True),
+            ("bar", 5, Condition.New, False),
+        ]:
+            InventoryItem(
+                sku=sku,
+                count=count,
+                condition=condition,
+                restock_level=2,
+                restock_amount=4,
+                in_stock=in_stock,
+            ).create()
+        items = InventoryItem.find_by_filters(
+            {"sku": "foo", "condition": "New", "in_stock": True}
+        ).all()
+        self.assertEqual([item.count for item in items], [1, 5])
+        items = InventoryItem.find_by_filters(
+            {"sku": "foo", "count_min": 2, "count_max": 9, "in_stock": None}
+        ).all()
+        self.assertEqual([item.count for item in items], [5, 9])
+        self.assertEqual(InventoryItem.find_by_filters({}).count(), 4)
+        self.assertRaises(
+            DataValidationError, InventoryItem.find_by_filters, {"condition": "Bad"}
+        )
+
+    def test_create_many(self):
+        """Ensure create_many writes every item in chunks and sets their ids"""
+        items = [InventoryItemFactory(id=None) for _ in range(7)]
+        InventoryItem.create_many(items, chunk_size=3)
+        self.assertEqual([item.id for item in items], list(range(1, 8)))
+        for item in items:
+            self.assertEqual(InventoryItem.find(item.id).sku, item.sku)
+
+    def test_update_many(self):
+        """Ensure update_many changes only the given fields of each item"""
+        items = [InventoryItemFactory(id=None, count=10) for _ in range(3)]
+        InventoryItem.create_many(items)
+        rows, missing = InventoryItem.update_many(
+            [
+                {"id": items[2].id, "count": "4", "condition": "Used"},
+                {"id": items[0].id, "restock_level": 7},
+            ],
+            chunk_size=1,
+        )
+        self.assertEqual(missing, [])
+        self.assertEqual([row["id"] for row in rows], [items[2].id, items[0].id])
+        self.assertEqual(rows[0]["count"], 4)
+        self.assertEqual(rows[0]["condition"], "Used")
+        self.assertEqual(rows[1]["restock_level"], 7)
+        self.assertEqual(rows[1]["count"], 10)
+        self.assertEqual(InventoryItem.find(items[1].id).count, 10)
+
+    def test_update_many_missing(self):
+        """Ensure update_many changes nothing when an id is not found"""
+        item = InventoryItemFactory(id=None, count=10)
+        item.create()
+        rows, missing = InventoryItem.update_many(
+            [{"id": item.id, "count": 1}, {"id": 999, "count": 1}]
+        )
+        self.assertEqual((rows, missing), ([], [999]))
+        self.assertEqual(InventoryItem.find(item.id).count, 10)
+
+    def test_update_many_bad_data(self):
+        """Ensure update_many rejects unknown fields and bad values"""
+        for changes in [
+            [{"count": 1}],
+            [{"id": 1}],
+            [{"id": 1, "color": "red"}],
+            [{"id": 1, "count": "many"}],
+            [{"id": 1, "condition": "Broken"}],
+            [{"id": 1, "sku": None}],
+            [{"id": 1, "count": 1}, {"id": 1, "count": 2}],
+        ]:
+            self.assertRaises(DataValidationError, InventoryItem.update_many, changes)
+
+    def test_delete_by_filters(self):
+        """Ensure delete_by_filters removes only the matching items in chunks"""
+        items = [InventoryItemFactory(id=None, sku="foo") for _ in range(5)]
+        items.append(InventoryItemFactory(id=None, sku="bar"))
+        InventoryItem.create_many(items)
+        self.assertEqual(InventoryItem.delete_by_filters({"sku": "foo"}, 2), 5)
+        self.assertEqual([item.sku for item in InventoryItem.all()], ["bar"])
+        self.assertEqual(InventoryItem.delete_by_filters({}), 1)
+        self.assertEqual(len(InventoryItem.all()), 0)
+
+    def test_delete_by_filters_rolls_back(self):
+        """Ensure a failed chunk of delete_by_filters is rolled back"""
+        InventoryItem.create_many([InventoryItemFactory(id=None, sku="foo")])
+        with patch.object(db.session, "commit", side_effect=RuntimeError("lost")):
+            self.assertRaises(
+                RuntimeError, InventoryItem.delete_by_filters, {"sku": "foo"}
+            )
+        # The session is usable again and the delete was undone
+        self.assertEqual([item.sku for item in InventoryItem.all()], ["foo"])
+
+    def test_adjust_count(self):
+        """Ensure adjust_count changes the count and follows it with in_stock"""
+        item = InventoryItemFactory(id=None, count=2, in_stock=True)
+        item.create()
+        row = InventoryItem.adjust_count(item.id, -2)
+        self.assertEqual((row["count"], row["in_stock"]), (0, False))
+        self.assertIsNone(InventoryItem.adjust_count(item.id, -1))
+        row = InventoryItem.adjust_count(item.id, -1, allow_negative=True)
+        self.assertEqual((row["count"], row["in_stock"]), (-1, False))
+        row = InventoryItem.adjust_count(item.id, 5)
+        self.assertEqual((row["count"], row["in_stock"]), (4, True))
+        self.assertIsNone(InventoryItem.adjust_count(999, 1))
+
+    def test_version(self):
+        """Ensure every change bumps the version and stale updates fail"""
+        item = InventoryItemFactory(id=None)
+        item.create()
+        self.assertEqual(item.version, 1)
+        item.count += 1
+        item.update()
+        self.assertEqual(item.version, 2)
+        self.assertEqual(InventoryItem.adjust_count(item.id, 1)["version"], 3)
+        rows, _ = InventoryItem.update_many([{"id": item.id, "count": 0}])
+        self.assertEqual(rows[0]["version"], 4)
+
+    def test_find_serialized(self):
+        """Ensure find_serialized caches items until they are written"""
+        item = InventoryItemFactory(id=None, count=5)
+        item.create()
+        hits = item_cache.hits
+        self.assertEqual(InventoryItem.find_serialized(item.id)["count"], 5)
+        self.assertEqual(InventoryItem.find_serialized(str(item.id))["count"], 5)
+        self.assertEqual(item_cache.hits, hits + 1)
+
+        item.count = 6
+        item.update()
+        self.assertEqual(InventoryItem.find_serialized(item.id)["count"], 6)
+        InventoryItem.adjust_count(item.id, 1)
+        self.assertEqual(InventoryItem.find_serialized(item.id)["count"], 7)
+
+        # A change made behind the model's back is only seen without the cache
+        db.session.execute("UPDATE inventory_item SET count = 0")
+        db.session.commit()
+        self.assertEqual(InventoryItem.find_serialized(item.id)["count"], 7)
+        self.assertEqual(InventoryItem.find_serialized(item.id, False)["count"], 0)
+
+        item.delete()
+        self.assertIsNone(InventoryItem.find_serialized(item.id))
+        self.assertIsNone(InventoryItem.find_serialized("not-an-id"))
+
+    def test_find_serialized_projection(self):
+        """Ensure find_serialized returns the fields asked for, cached or not"""
+        item = InventoryItemFactory(id=None, count=5)
+        item.create()
+        data = InventoryItem.find_serialized(item.id, fields=["count"])
+        self.assertEqual(data, {"id": item.id, "count": 5})
+        # Projections read from the database are not cached
+        self.assertIsNone(item_cache.get(item.id))
+        InventoryItem.find_serialized(item.id)
+        hits = item_cache.hits
+        data = InventoryItem.find_serialized(item.id, fields=["sku", "version"])
+        self.assertEqual(data, {"id": item.id, "sku": item.sku, "version": 1})
+        self.assertEqual(item_cache.hits, hits + 1)
+        self.assertRaises(
+            DataValidationError, InventoryItem.find_serialized, item.id, True, ["x"]
+        )
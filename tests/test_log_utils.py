@@ -0,0 +1,131 @@
+"""
+Test cases for the logging helpers
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import logging
+import os
+import threading
+import unittest
+
+from service.log_utils import PayloadSampler, QueueLogHandler, install_queue_handler
+
+
+class RecordingHandler(logging.Handler):
+    """Keeps the formatted messages and the thread that formatted each one"""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.threads = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+        self.threads.append(threading.current_thread())
+
+
+class Payload:
+    """A log argument that records the thread that renders it"""
+
+    def __init__(self):
+        self.rendered_by = None
+
+    def __str__(self):
+        self.rendered_by = threading.current_thread()
+        return "payload"
+
+
+######################################################################
+#  Q U E U E   L O G   H A N D L E R   T E S T   C A S E S
+######################################################################
+class TestQueueLogHandler(unittest.TestCase):
+    """Test Cases for QueueLogHandler"""
+
+    def setUp(self):
+        # Other test modules disable logging for the whole process
+        self.disabled = logging.root.manager.disable
+        logging.disable(logging.NOTSET)
+        self.target = RecordingHandler()
+        self.logger = logging.getLogger("test_log_utils")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.handlers = [self.target]
+
+    def tearDown(self):
+        for handler in self.logger.handlers:
+            if isinstance(handler, QueueLogHandler):
+                handler.stop()
+        self.logger.handlers = []
+        logging.disable(self.disabled)
+
+    def test_formats_on_listener_thread(self):
+        """Ensure records are rendered and written off the logging thread"""
+        handler = install_queue_handler(self.logger, 100)
+        self.assertEqual(self.logger.handlers, [handler])
+        payload = Payload()
+        self.logger.info("Payload = %s", payload)
+        self.assertIsNone(payload.rendered_by)
+        handler.stop()
+        self.assertEqual(self.target.messages, ["Payload = payload"])
+        self.assertIsNot(payload.rendered_by, threading.current_thread())
+        self.assertIsNot(self.target.threads[0], threading.current_thread())
+
+    def test_drops_when_full(self):
+        """Ensure a full queue drops records instead of blocking"""
+        handler = QueueLogHandler([self.target], maxsize=2)
+        self.logger.handlers = [handler]
+        # Pretend the listener is running so nothing drains the queue
+        handler._pid = os.getpid()  # pylint: disable=protected-access
+        for number in range(5):
+            self.logger.info("message %d", number)
+        self.assertEqual(handler.dropped, 3)
+        self.assertEqual(handler.queue.qsize(), 2)
+
+    def test_new_queue_after_fork(self):
+        """Ensure a forked process does not reuse the queue it inherited"""
+        handler = QueueLogHandler([self.target], maxsize=2)
+        self.logger.handlers = [handler]
+        # Pretend the listener was started by the parent of this process
+        handler._pid = -1  # pylint: disable=protected-access
+        inherited = handler.queue
+        inherited.put_nowait(logging.makeLogRecord({"msg": "parent"}))
+        self.logger.info("child")
+        handler.stop()
+        self.assertIsNot(handler.queue, inherited)
+        self.assertEqual(handler.queue.maxsize, 2)
+        self.assertEqual(self.target.messages, ["child"])
+
+    def test_install_without_handlers(self):
+        """Ensure a logger without handlers is left alone"""
+        self.logger.handlers = []
+        self.assertIsNone(install_queue_handler(self.logger))
+        self.assertEqual(self.logger.handlers, [])
+
+
+######################################################################
+#  P A Y L O A D   S A M P L E R   T E S T   C A S E S
+######################################################################
+class TestPayloadSampler(unittest.TestCase):
+    """Test Cases for PayloadSampler"""
+
+    def test_default_rate(self):
+        """Ensure routes without a rate use the default"""
+        self.assertTrue(PayloadSampler(1).sample("GET /"))
+        self.assertFalse(PayloadSampler(0).sample("GET /"))
+
+    def test_route_rates(self):
+        """Ensure a route's own rate overrides the default"""
+        values = iter([0.2, 0.6])
+        sampler = PayloadSampler(0, {"PUT /a": 0.5}, rand=lambda: next(values))
+        self.assertFalse(sampler.sample("GET /a"))
+        self.assertTrue(sampler.sample("PUT /a"))
+        self.assertFalse(sampler.sample("PUT /a"))
+
+    def test_unknown_routes(self):
+        """Ensure rates keyed by a route that does not exist are reported"""
+        sampler = PayloadSampler(0, {"PUT /a/<id>": 1, "PUT /a/<int:id>": 1})
+        self.assertEqual(
+            sampler.unknown_routes(["GET /a/<id>", "PUT /a/<id>"]), ["PUT /a/<int:id>"]
+        )
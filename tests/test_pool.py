@@ -0,0 +1,74 @@
+"""
+Test cases for the connection pool helpers
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import sqlite3
+import unittest
+
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool
+
+from service.pool import TimedQueuePool, engine_options, pool_status
+
+CONFIG = {
+    "DB_POOL_SIZE": 2,
+    "DB_POOL_MAX_OVERFLOW": 1,
+    "DB_POOL_TIMEOUT": 0.01,
+    "DB_POOL_RECYCLE": 60,
+    "DB_POOL_PRE_PING": True,
+}
+
+
+def connect():
+    """Opens a connection for the pools under test"""
+    return sqlite3.connect(":memory:", check_same_thread=False)
+
+
+######################################################################
+#  P O O L   T E S T   C A S E S
+######################################################################
+class TestPool(unittest.TestCase):
+    """Test Cases for the connection pool helpers"""
+
+    def test_engine_options(self):
+        """Ensure only SQLite drops the options of a sized pool"""
+        options = engine_options("postgres://localhost/db", CONFIG)
+        self.assertEqual(options["pool_size"], 2)
+        self.assertEqual(options["max_overflow"], 1)
+        self.assertIs(options["poolclass"], TimedQueuePool)
+        options = engine_options("sqlite:///test.db", CONFIG)
+        self.assertNotIn("pool_size", options)
+        self.assertNotIn("poolclass", options)
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_pool_status(self):
+        """Ensure checkouts, overflow and saturation are reported"""
+        pool = TimedQueuePool(connect, pool_size=2, max_overflow=1, timeout=0.01)
+        connections = [pool.connect() for _ in range(2)]
+        status = pool_status(pool)
+        self.assertEqual((status["checked_out"], status["capacity"]), (2, 3))
+        self.assertEqual(status["checkouts"], 2)
+        self.assertFalse(status["saturated"])
+        self.assertTrue(pool_status(pool, saturation_limit=0.5)["saturated"])
+
+        connections.append(pool.connect())
+        status = pool_status(pool)
+        self.assertEqual(status["overflow"], 1)
+        self.assertTrue(status["saturated"])
+        self.assertRaises(exc.TimeoutError, pool.connect)
+        self.assertEqual(pool_status(pool)["timeouts"], 1)
+        self.assertGreater(pool_status(pool)["wait_ms_max"], 0)
+
+        for connection in connections:
+            connection.close()
+        status = pool_status(pool)
+        self.assertEqual((status["checked_out"], status["checked_in"]), (0, 2))
+        self.assertFalse(status["saturated"])
+
+    def test_pool_status_unsized(self):
+        """Ensure pools without a size are never saturated"""
+        status = pool_status(NullPool(connect))
+        self.assertEqual(status, {"class": "NullPool", "saturated": False})
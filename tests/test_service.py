@@ -11,14 +11,22 @@ Test cases can be run with the following:
 """
 
 import os
+import json
 import logging
+import time
 import unittest
 
 from unittest.mock import patch
 from urllib.parse import quote_plus
-from service import app, routes, status  # HTTP Status Codes
-from service.models import db, init_db, DataValidationError
-from service.routes import app
+from service import check_sample_rates, create_app, routes, status  # HTTP Status Codes
+from service.log_utils import PayloadSampler
+from service.models import (
+    db,
+    item_cache,
+    DataValidationError,
+    InventorySummary,
+    InventorySummaryDelta,
+)
 from .factories import InventoryItemFactory
 
 # Disable all but ciritcal errors during normal test run
@@ -41,23 +49,26 @@ class TestInventoryItemServer(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """Run once before all tests"""
-        app.config["TESTING"] = True
-        app.config["DEBUG"] = False
-        # Set up the test database
-        app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
-        app.logger.setLevel(logging.CRITICAL)
-        init_db(app)
+        cls.flask_app = create_app(
+            {"TESTING": True, "DEBUG": False, "SQLALCHEMY_DATABASE_URI": DATABASE_URI}
+        )
+        cls.flask_app.logger.setLevel(logging.CRITICAL)
+        cls.context = cls.flask_app.app_context()
+        cls.context.push()
 
     @classmethod
     def tearDownClass(cls):
         """Run once after all tests"""
         db.session.close()
+        cls.context.pop()
 
     def setUp(self):
         """Runs before each test"""
         db.drop_all()  # clean up the last tests
         db.create_all()  # create new tables
-        self.app = app.test_client()
+        item_cache.clear()  # ids are reused once the tables are re-created
+        routes.list_cache.clear()
+        self.app = self.flask_app.test_client()
 
     def tearDown(self):
         db.session.remove()
@@ -118,6 +129,8 @@ class TestInventoryItemServer(unittest.TestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         data = resp.get_json()
         self.assertEqual(len(data), 5)
+        resp = self.app.get("/api{}/{}".format(BASE_URL, data[0]["id"]))
+        self.assertEqual(data[0], resp.get_json())
 
     def test_create_inventory_item(self):
         """Create a new Inventory item"""
@@ -360,3 +373,629 @@ class TestInventoryItemServer(unittest.TestCase):
         # check the data just to be sure
         for item in data:
             self.assertEqual(item["in_stock"], test_in_stock)
+
+    def test_get_inventory_list_paginated(self):
+        """Page through the inventory list with limit and cursor"""
+        self._create_inventory_items(5)
+        resp = self.app.get(f"/api{BASE_URL}", query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIn('rel="next"', resp.headers["Link"])
+        ids = [item["id"] for item in resp.get_json()]
+        while "X-Next-Cursor" in resp.headers:
+            resp = self.app.get(
+                f"/api{BASE_URL}",
+                query_string={"limit": 2, "cursor": resp.headers["X-Next-Cursor"]},
+            )
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            ids.extend(item["id"] for item in resp.get_json())
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(ids, sorted(ids))
+        self.assertNotIn("Link", resp.headers)
+
+    def test_get_inventory_list_bad_cursor(self):
+        """Ensure a 400 is returned for a cursor the service did not make"""
+        resp = self.app.get(f"/api{BASE_URL}", query_string="limit=2&cursor=%%%")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_inventory_list_ndjson(self):
+        """Stream the inventory list as NDJSON"""
+        inventory_items = self._create_inventory_items(3)
+        resp = self.app.get(
+            f"/api{BASE_URL}", headers={"Accept": "application/x-ndjson"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), len(inventory_items))
+        self.assertEqual(
+            [json.loads(line)["id"] for line in lines],
+            [item.id for item in inventory_items],
+        )
+
+    def test_stream_inventory_list_json_array(self):
+        """Stream the inventory list as a chunked JSON array"""
+        resp = self.app.get(f"/api{BASE_URL}", query_string="stream=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+        self._create_inventory_items(3)
+        resp = self.app.get(f"/api{BASE_URL}", query_string="stream=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 3)
+
+    def test_find_inventory_items_by_multiple_filters(self):
+        """Query Inventory Items by several filters and a count range at once"""
+        inventory_items = self._create_inventory_items(10)
+        test_condition = inventory_items[0].condition
+        test_in_stock = inventory_items[0].in_stock
+        matches = [
+            item
+            for item in inventory_items
+            if item.condition == test_condition
+            and item.in_stock == test_in_stock
+            and 0 <= item.count <= 50
+        ]
+        resp = self.app.get(
+            f"/api{BASE_URL}",
+            query_string={
+                "condition": test_condition.name,
+                "in_stock": test_in_stock,
+                "count_min": 0,
+                "count_max": 50,
+            },
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), len(matches))
+        for item in data:
+            self.assertEqual(item["condition"], test_condition.name)
+            self.assertEqual(item["in_stock"], test_in_stock)
+
+    def test_list_with_fields(self):
+        """List only the fields asked for, filtered and a page at a time"""
+        for sku in ["foo", "bar", "foo"]:
+            self.app.post(
+                f"/api{BASE_URL}", json=InventoryItemFactory(sku=sku).serialize()
+            )
+        query = {"fields": "sku,count", "sku": "foo", "limit": 1}
+        resp = self.app.get(f"/api{BASE_URL}", query_string=query)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        items = resp.get_json()
+        self.assertEqual(set(items[0]), {"id", "sku", "count"})
+        self.assertEqual(items[0]["id"], 1)
+        query["cursor"] = resp.headers["X-Next-Cursor"]
+        resp = self.app.get(f"/api{BASE_URL}", query_string=query)
+        self.assertEqual([item["id"] for item in resp.get_json()], [3])
+
+        resp = self.app.get(
+            f"/api{BASE_URL}",
+            query_string={"fields": "in_stock"},
+            headers={"Accept": "application/x-ndjson"},
+        )
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(set(json.loads(lines[0])), {"id", "in_stock"})
+        resp = self.app.get(f"/api{BASE_URL}", query_string={"fields": "sku,bad"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_with_fields(self):
+        """Read only the fields of an item that are asked for"""
+        item = self._create_inventory_items(1)[0]
+        url = f"/api{BASE_URL}/{item.id}"
+        resp = self.app.get(url, query_string={"fields": "count,version"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            resp.get_json(), {"id": item.id, "count": item.count, "version": 1}
+        )
+        self.assertEqual(resp.headers["ETag"], f'"{item.id}-1"')
+        resp = self.app.get(url, query_string={"fields": "sku"})
+        self.assertEqual(resp.get_json(), {"id": item.id, "sku": item.sku})
+        resp = self.app.get(url, query_string={"fields": "bad"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_inventory_items(self):
+        """Search items by the start or a part of their SKU"""
+        for sku in ["ABC-1", "ABC-2", "XABC", "DEF"]:
+            item = InventoryItemFactory(sku=sku).serialize()
+            item["in_stock"] = sku != "ABC-2"
+            self.app.post(f"/api{BASE_URL}", json=item)
+        resp = self.app.get(f"/api{BASE_URL}/search", query_string="sku=ABC")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["sku"] for item in resp.get_json()], ["ABC-1", "ABC-2"])
+        resp = self.app.get(
+            f"/api{BASE_URL}/search",
+            query_string={"sku": "abc", "match": "fuzzy", "in_stock": "true"},
+        )
+        self.assertEqual(
+            sorted(item["sku"] for item in resp.get_json()), ["ABC-1", "XABC"]
+        )
+        resp = self.app.get(
+            f"/api{BASE_URL}/search", query_string={"sku": "ABC", "limit": 1}
+        )
+        self.assertEqual(len(resp.get_json()), 1)
+
+        resp = self.app.get(f"/api{BASE_URL}/search")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(f"/api{BASE_URL}/search", query_string="sku=A&match=bad")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_restock_report(self):
+        """Report the items to reorder by condition, a page at a time"""
+        for count, condition in [(1, "Used"), (9, "New"), (0, "New"), (2, "New")]:
+            item = InventoryItemFactory(count=count, restock_level=5).serialize()
+            item["condition"] = condition
+            self.app.post(f"/api{BASE_URL}", json=item)
+        resp = self.app.get(f"/api{BASE_URL}/restock", query_string={"limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        groups = resp.get_json()
+        self.assertEqual([group["condition"] for group in groups], ["New"])
+        self.assertEqual([item["count"] for item in groups[0]["items"]], [0, 2])
+        self.assertEqual(
+            set(groups[0]["items"][0]),
+            {"id", "sku", "count", "restock_level", "order_quantity"},
+        )
+        resp = self.app.get(
+            f"/api{BASE_URL}/restock",
+            query_string={"limit": 2, "cursor": resp.headers["X-Next-Cursor"]},
+        )
+        self.assertEqual(resp.get_json()[0]["condition"], "Used")
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+        resp = self.app.get(f"/api{BASE_URL}/restock", query_string="condition=Bad")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_restock_report_csv(self):
+        """Stream the whole restock report as CSV"""
+        for count in [1, 9, 0]:
+            item = InventoryItemFactory(count=count, restock_level=5).serialize()
+            self.app.post(f"/api{BASE_URL}", json=item)
+        resp = self.app.get(f"/api{BASE_URL}/restock", headers={"Accept": "text/csv"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/csv"))
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(
+            lines[0], "condition,id,sku,count,restock_level,order_quantity"
+        )
+        self.assertEqual(len(lines), 3)
+
+    def test_inventory_summary(self):
+        """Report the items and units by condition, in_stock and SKU"""
+        for sku, count in [("a", 2), ("b", 3), ("a", 4)]:
+            item = InventoryItemFactory(sku=sku, count=count).serialize()
+            item["condition"] = "Used"
+            item["in_stock"] = False
+            self.app.post(f"/api{BASE_URL}", json=item)
+        resp = self.app.get(f"/api{BASE_URL}/summary")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        summary = resp.get_json()
+        self.assertEqual(summary["total"], {"items": 3, "units": 9})
+        self.assertEqual(summary["condition"]["Used"], {"items": 3, "units": 9})
+        self.assertEqual(summary["condition"]["New"], {"items": 0, "units": 0})
+        self.assertEqual(summary["in_stock"]["false"], {"items": 3, "units": 9})
+
+        resp = self.app.get(f"/api{BASE_URL}/summary/skus", query_string="limit=1")
+        self.assertEqual(resp.get_json(), [{"sku": "a", "items": 2, "units": 6}])
+        resp = self.app.get(
+            f"/api{BASE_URL}/summary/skus",
+            query_string={"cursor": resp.headers["X-Next-Cursor"]},
+        )
+        self.assertEqual(resp.get_json(), [{"sku": "b", "items": 1, "units": 3}])
+
+    def test_summary_rebuild_command(self):
+        """Recount the summary with the flask summary-rebuild command"""
+        self.app.post(f"/api{BASE_URL}", json=InventoryItemFactory(count=7).serialize())
+        db.session.execute("DELETE FROM inventory_summary")
+        db.session.commit()
+        result = self.flask_app.test_cli_runner().invoke(args=["summary-rebuild"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("(1 items, 7 units)", result.output)
+
+    def test_summary_fold_command(self):
+        """Fold the pending changes with the flask summary-fold command"""
+        self.app.post(f"/api{BASE_URL}", json=InventoryItemFactory(count=7).serialize())
+        result = self.flask_app.test_cli_runner().invoke(args=["summary-fold"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(InventorySummaryDelta.query.count(), 0)
+        resp = self.app.get(f"/api{BASE_URL}/summary")
+        self.assertEqual(resp.get_json()["total"], {"items": 1, "units": 7})
+
+    def test_summary_folded_after_requests(self):
+        """Fold the pending changes after a request once a fold is due"""
+        self.app.post(f"/api{BASE_URL}", json=InventoryItemFactory(count=7).serialize())
+        self.assertGreater(InventorySummaryDelta.query.count(), 0)
+        with patch.object(InventorySummary, "next_fold", 0):
+            self.app.get(f"/api{BASE_URL}/summary")
+        self.assertEqual(InventorySummaryDelta.query.count(), 0)
+
+    def test_bulk_create_inventory_items(self):
+        """Create many inventory items from a JSON array"""
+        records = [InventoryItemFactory().serialize() for _ in range(5)]
+        resp = self.app.post(
+            f"/api{BASE_URL}/bulk", json=records, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(data["created"], 5)
+        self.assertEqual(data["failed"], 0)
+        for record, result in zip(records, data["results"]):
+            self.assertEqual(result["status"], status.HTTP_201_CREATED)
+            self.assertEqual(result["item"]["sku"], record["sku"])
+        resp = self.app.get(f"/api{BASE_URL}")
+        self.assertEqual(len(resp.get_json()), 5)
+
+    def test_bulk_create_inventory_items_ndjson(self):
+        """Create many inventory items from NDJSON with some bad records"""
+        good = InventoryItemFactory().serialize()
+        missing_sku = InventoryItemFactory().serialize()
+        del missing_sku["sku"]
+        body = "\n".join([json.dumps(good), "{not json", json.dumps(missing_sku)])
+        resp = self.app.post(
+            f"/api{BASE_URL}/bulk", data=body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["created"], 1)
+        self.assertEqual(data["failed"], 2)
+        self.assertEqual(
+            [result["status"] for result in data["results"]],
+            [
+                status.HTTP_201_CREATED,
+                status.HTTP_400_BAD_REQUEST,
+                status.HTTP_400_BAD_REQUEST,
+            ],
+        )
+
+    def test_bulk_create_bad_sku(self):
+        """Fail only the bulk records whose SKU the table cannot hold"""
+        records = [InventoryItemFactory().serialize() for _ in range(3)]
+        records[1]["sku"] = None
+        records[2]["sku"] = "X" * 64
+        resp = self.app.post(
+            f"/api{BASE_URL}/bulk", json=records, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["created"], 1)
+        self.assertEqual(
+            [result["status"] for result in data["results"]],
+            [
+                status.HTTP_201_CREATED,
+                status.HTTP_400_BAD_REQUEST,
+                status.HTTP_400_BAD_REQUEST,
+            ],
+        )
+        self.assertIn("sku", data["results"][1]["error"])
+        self.assertEqual(len(self.app.get(f"/api{BASE_URL}").get_json()), 1)
+
+    def test_bulk_create_not_a_list(self):
+        """Ensure a 400 is returned if the bulk body is not a JSON array"""
+        resp = self.app.post(
+            f"/api{BASE_URL}/bulk",
+            json=InventoryItemFactory().serialize(),
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_inventory_items(self):
+        """Update some fields of many inventory items at once"""
+        inventory_items = self._create_inventory_items(3)
+        changes = [
+            {"id": item.id, "restock_level": 30 + index}
+            for index, item in enumerate(inventory_items)
+        ]
+        resp = self.app.patch(
+            f"/api{BASE_URL}/bulk", json=changes, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        for index, (item, row) in enumerate(zip(inventory_items, data)):
+            self.assertEqual(row["id"], item.id)
+            self.assertEqual(row["restock_level"], 30 + index)
+            self.assertEqual(row["sku"], item.sku)
+
+    def test_bulk_update_bad_sku(self):
+        """Ensure a 400 is returned if a bulk update sets a bad SKU"""
+        item = self._create_inventory_items(1)[0]
+        for sku in [None, 7, "X" * 64]:
+            resp = self.app.patch(
+                f"/api{BASE_URL}/bulk",
+                json=[{"id": item.id, "sku": sku}],
+                content_type=CONTENT_TYPE_JSON,
+            )
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(f"/api{BASE_URL}/{item.id}")
+        self.assertEqual(resp.get_json()["sku"], item.sku)
+
+    def test_bulk_update_not_found(self):
+        """Ensure a 404 is returned if a bulk update names an unknown item"""
+        resp = self.app.patch(
+            f"/api{BASE_URL}/bulk",
+            json=[{"id": 0, "count": 1}],
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_inventory_items_by_filter(self):
+        """Delete every inventory item that matches a filter"""
+        inventory_items = self._create_inventory_items(10)
+        test_in_stock = inventory_items[0].in_stock
+        matches = [item for item in inventory_items if item.in_stock == test_in_stock]
+        resp = self.app.delete(
+            f"/api{BASE_URL}", query_string="in_stock={}".format(test_in_stock)
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["deleted"], len(matches))
+        resp = self.app.get(f"/api{BASE_URL}")
+        data = resp.get_json()
+        self.assertEqual(len(data), len(inventory_items) - len(matches))
+        for item in data:
+            self.assertNotEqual(item["in_stock"], test_in_stock)
+
+    def test_delete_inventory_items_needs_a_filter(self):
+        """Refuse a filtered delete without filters or with an unknown one"""
+        self._create_inventory_items(3)
+        for query in [
+            "",
+            "skew=S1",
+            "sku=S1&skew=S1",
+            "all=false",
+            "sku=",
+            "sku=&condition=",
+        ]:
+            resp = self.app.delete(f"/api{BASE_URL}", query_string=query)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.app.get(f"/api{BASE_URL}").get_json()), 3)
+        resp = self.app.delete(f"/api{BASE_URL}", query_string="all=true")
+        self.assertEqual(resp.get_json()["deleted"], 3)
+
+    def test_adjust_inventory_item(self):
+        """Adjust the count of an inventory item"""
+        test_inventory_item = InventoryItemFactory(count=0, in_stock=False)
+        resp = self.app.post(
+            f"/api{BASE_URL}",
+            json=test_inventory_item.serialize(),
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        test_inventory_item.id = resp.get_json()["id"]
+        resp = self.app.post(
+            "/api{}/{}/adjust".format(BASE_URL, test_inventory_item.id),
+            json={"delta": 3},
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(data["in_stock"], True)
+        self.assertEqual(resp.headers["ETag"], f'"{data["id"]}-{data["version"]}"')
+
+        # Removing more than is left is refused unless it is allowed
+        resp = self.app.post(
+            "/api{}/{}/adjust".format(BASE_URL, test_inventory_item.id),
+            json={"delta": -1000},
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.post(
+            "/api{}/{}/adjust".format(BASE_URL, test_inventory_item.id),
+            json={"delta": -1000, "allow_negative": True},
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["in_stock"], False)
+
+    def test_adjust_inventory_item_errors(self):
+        """Ensure adjusting a missing item or with a bad delta fails"""
+        resp = self.app.post(
+            "/api{}/{}/adjust".format(BASE_URL, 0),
+            json={"delta": 3},
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        test_inventory_item = self._create_inventory_items(1)[0]
+        for body in [
+            {},
+            [],
+            {"delta": "lots"},
+            {"delta": "3"},
+            {"delta": 2.9},
+            {"delta": True},
+            {"delta": -10, "allow_negative": "false"},
+            {"delta": -10, "allow_negative": 1},
+        ]:
+            resp = self.app.post(
+                "/api{}/{}/adjust".format(BASE_URL, test_inventory_item.id),
+                json=body,
+                content_type=CONTENT_TYPE_JSON,
+            )
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_inventory_item_etag(self):
+        """Get an inventory item with its ETag, then get a 304 for it"""
+        test_inventory_item = self._create_inventory_items(1)[0]
+        url = "/api{}/{}".format(BASE_URL, test_inventory_item.id)
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        self.assertEqual(etag, '"{}-1"'.format(test_inventory_item.id))
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(resp.data), 0)
+
+    def test_get_after_update(self):
+        """Read back the new fields and ETag of an item right after a PUT"""
+        test_inventory_item = self._create_inventory_items(1)[0]
+        url = "/api{}/{}".format(BASE_URL, test_inventory_item.id)
+        self.assertEqual(
+            self.app.get(url).headers["ETag"], f'"{test_inventory_item.id}-1"'
+        )
+        data = test_inventory_item.serialize()
+        data["count"] = 99
+        resp = self.app.put(url, json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.get_json()["id"], test_inventory_item.id)
+        etag = resp.headers["ETag"]
+        resp = self.app.get(url)
+        self.assertEqual(resp.get_json()["count"], 99)
+        self.assertEqual(resp.get_json()["version"], 2)
+        self.assertEqual(resp.headers["ETag"], etag)
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_update_inventory_item_if_match(self):
+        """Update an inventory item only if its ETag still matches"""
+        test_inventory_item = self._create_inventory_items(1)[0]
+        url = "/api{}/{}".format(BASE_URL, test_inventory_item.id)
+        etag = self.app.get(url).headers["ETag"]
+        test_inventory_item.count += 1
+        resp = self.app.put(
+            url,
+            json=test_inventory_item.serialize(),
+            content_type=CONTENT_TYPE_JSON,
+            headers={"If-Match": etag},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["count"], test_inventory_item.count)
+        self.assertEqual(resp.get_json()["version"], 2)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        # The old ETag no longer matches for PUT or in-stock
+        resp = self.app.put(
+            url,
+            json=test_inventory_item.serialize(),
+            content_type=CONTENT_TYPE_JSON,
+            headers={"If-Match": etag},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put(url + "/in-stock", headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_get_inventory_list_etag(self):
+        """Get a 304 for an inventory list that has not changed"""
+        self._create_inventory_items(2)
+        resp = self.app.get(f"/api{BASE_URL}")
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+        resp = self.app.get(f"/api{BASE_URL}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self._create_inventory_items(1)
+        resp = self.app.get(f"/api{BASE_URL}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_get_inventory_item_cached(self):
+        """Get an inventory item from the cache, and skip it with no-cache"""
+        test_inventory_item = self._create_inventory_items(1)[0]
+        url = "/api{}/{}".format(BASE_URL, test_inventory_item.id)
+        self.assertEqual(self.app.get(url).status_code, status.HTTP_200_OK)
+        db.session.execute("UPDATE inventory_item SET sku = 'changed'")
+        db.session.commit()
+        resp = self.app.get(url)
+        self.assertEqual(resp.get_json()["sku"], test_inventory_item.sku)
+        resp = self.app.get(url, headers={"Cache-Control": "no-cache"})
+        self.assertEqual(resp.get_json()["sku"], "changed")
+
+        resp = self.app.get("/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertGreaterEqual(resp.get_json()["item_cache"]["hits"], 1)
+
+    def test_create_app_does_not_connect(self):
+        """Create an app without touching its database"""
+        app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:////no/such/dir/test.db"})
+        self.assertIn("db-upgrade", app.cli.commands)
+
+    def test_payload_sample_rates_match_routes(self):
+        """Warn about payload sample rates for routes that do not exist"""
+        rates = {
+            "PUT /api/inventories/<inventory_item_id>": 1,
+            "PUT /api/inventories/<int:inventory_item_id>": 1,
+        }
+        sampler = PayloadSampler(0, rates)
+        with patch.object(self.flask_app.logger, "warning") as warning:
+            check_sample_rates(self.flask_app, sampler)
+        warning.assert_called_once()
+        self.assertEqual(
+            warning.call_args[0][1], "PUT /api/inventories/<int:inventory_item_id>"
+        )
+
+    def test_db_upgrade_command(self):
+        """Upgrade the database with the flask db-upgrade command"""
+        db.drop_all()
+        result = self.flask_app.test_cli_runner().invoke(args=["db-upgrade"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Added inventory_item", result.output)
+        self.assertIn("Added inventory_summary", result.output)
+        self.assertIn("Added inventory_summary_delta", result.output)
+        self.assertIn("(3 changes made)", result.output)
+
+    def test_health_ready(self):
+        """Report ready until the connection pool is saturated"""
+        resp = self.app.get("/health/ready")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["status"], "ready")
+        saturated = {"class": "TimedQueuePool", "saturated": True}
+        with patch("service.routes.pool_status", return_value=saturated):
+            resp = self.app.get("/health/ready")
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(resp.get_json()["db_pool"], saturated)
+
+    def test_get_inventory_list_cached(self):
+        """Get a cached inventory list until the table is written to"""
+        self._create_inventory_items(2)
+        resp = self.app.get(f"/api{BASE_URL}", query_string="limit=5")
+        self.assertEqual(len(resp.get_json()), 2)
+        hits = routes.list_cache.stats()["hits"]
+
+        # A hit does not touch the database
+        resp = self.app.get(f"/api{BASE_URL}", query_string="limit=5")
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertEqual(routes.list_cache.stats()["hits"], hits + 1)
+        self.assertEqual(resp.headers["X-DB-Queries"], "0")
+        etag = resp.headers["ETag"]
+        resp = self.app.get(
+            f"/api{BASE_URL}",
+            query_string="limit=5",
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Any write through the model moves on to a new generation
+        self._create_inventory_items(1)
+        resp = self.app.get(f"/api{BASE_URL}", query_string="limit=5")
+        self.assertEqual(len(resp.get_json()), 3)
+
+    def test_get_inventory_list_revalidated(self):
+        """Keep an expired list until another worker's write is counted"""
+        self._create_inventory_items(2)
+        later = time.monotonic() + routes.list_cache.ttl + 1
+        self.app.get(f"/api{BASE_URL}")
+
+        # Unchanged: the expired entry is served after one count of writes
+        with patch("service.cache.time.monotonic", return_value=later):
+            resp = self.app.get(f"/api{BASE_URL}")
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertEqual(resp.headers["X-DB-Queries"], "1")
+        self.assertEqual(routes.list_cache.stats()["revalidations"], 1)
+
+        # A write this worker did not see, as if made by another worker, is
+        # counted by the database and seen once the TTL runs out
+        db.session.execute("DELETE FROM inventory_item")
+        db.session.commit()
+        resp = self.app.get(f"/api{BASE_URL}")
+        self.assertEqual(len(resp.get_json()), 2)
+        with patch("service.cache.time.monotonic", return_value=later * 2):
+            resp = self.app.get(f"/api{BASE_URL}")
+        self.assertEqual(resp.get_json(), [])
+        self.assertEqual(resp.headers["X-DB-Queries"], "2")
+
+    def test_get_inventory_list_too_large_to_cache(self):
+        """Do not cache a list larger than the whole list cache"""
+        self._create_inventory_items(3)
+        page = self.app.get(f"/api{BASE_URL}", query_string="limit=1").get_data()
+        routes.list_cache.clear()
+        maxbytes = routes.list_cache.maxbytes
+        routes.list_cache.maxbytes = len(page)
+        try:
+            self.app.get(f"/api{BASE_URL}")
+            self.assertEqual(routes.list_cache.stats()["size"], 0)
+            self.app.get(f"/api{BASE_URL}", query_string="limit=1")
+            self.assertEqual(routes.list_cache.stats()["bytes"], len(page))
+        finally:
+            routes.list_cache.maxbytes = maxbytes